@@ -3,6 +3,10 @@ ASGI config for segueme_erp project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The PDV cart stream (/api/pdv/eventos/) keeps connections open, so it
+should be served by an ASGI server (uvicorn, daphne) running a single
+process: cart updates are published in memory (see mercado/tempo_real.py).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
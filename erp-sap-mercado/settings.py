@@ -133,4 +133,27 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Leitores e impressoras seriais de cada terminal do PDV, pelo usuário que
+# opera o caixa (comando perifericos_pdv). Exemplo:
+# PDV_TERMINAIS = {
+#     'caixa1': {'leitor': '/dev/ttyACM0', 'impressora': '/dev/ttyUSB0', 'baudrate': 9600},
+# }
+PDV_TERMINAIS = {}
+
+# Segundos que um produto fica no cache de códigos de barras de um processo
+# antes de ser relido do banco (mercado/catalogo.py).
+CATALOGO_CACHE_SEGUNDOS = 60
+
+# Segundos até o índice de busca de produtos de um processo ser remontado
+# do banco (mercado/busca.py).
+BUSCA_INDICE_SEGUNDOS = 60
+
+# Segundos que as bipagens ficam só no carrinho em memória antes de irem
+# ao banco (mercado/carrinho.py); 0 grava cada bipagem na hora.
+PDV_CHECKPOINT_SEGUNDOS = 10
+
+# Minutos que o estoque de um carrinho gravado fica reservado desde a última
+# bipagem (comando expirar_reservas, mercado/reservas.py).
+PDV_RESERVA_MINUTOS = 30
+
 
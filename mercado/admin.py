@@ -1,7 +1,13 @@
 from django import forms
 from django.contrib import admin, messages
+from django.contrib.admin.views.main import ORDER_VAR
 from django.core.exceptions import ValidationError
-from django.db.models import Sum, F, ExpressionWrapper, DecimalField
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Case, IntegerField, Max, Min, Prefetch, Sum, Value, When
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.functional import cached_property
 from django.utils.html import format_html
 from datetime import date, timedelta
 from decimal import Decimal
@@ -9,7 +15,11 @@ from simple_history.admin import SimpleHistoryAdmin
 from django.contrib.admin.models import LogEntry
 from django.forms.models import BaseInlineFormSet
 
-from .models import Produto, Venda, Cliente, ClienteResumo, Caixa, ItemVenda, PDVSession
+from .busca import buscar_ids
+from .caixa import recalcular_totais
+from .models import Produto, Venda, Cliente, ClienteResumo, Caixa, CaixaTotal, FechamentoCaixa, ImpressaoCupom, ItemVenda, MovimentoEstoque, PDVSession, Quitacao, ReservaEstoque, ResumoHistorico
+from .quitacao import quitar_vendas
+from .reposicao import PARADO, REPOR, SEM_ESTOQUE, STATUS, listar, sugestoes
 
 # ===========================
 # Configurações do Admin
@@ -19,6 +29,55 @@ admin.site.site_title = "Administração do Mini Mercado"
 admin.site.index_title = "Painel Administrativo"
 
 
+def itens_com_produto():
+    return Prefetch('itens', queryset=ItemVenda.objects.select_related('produto').order_by('pk'))
+
+
+class ContagemAproximadaPaginator(Paginator):
+    """
+    Sem filtros, o total do changelist vem de uma estimativa barata em vez
+    de um COUNT(*) da tabela inteira: estatística do PostgreSQL ou o maior
+    id no SQLite. Tabelas pequenas e listas filtradas são contadas de verdade.
+
+    O maior id só vale para tabelas que nunca perdem linhas antigas.
+    """
+    LIMITE_EXATO = 10000
+    # A tabela é podada pelo começo (arquivar_historico): no SQLite, usa maior - menor id
+    PODADA = False
+
+    @cached_property
+    def count(self):
+        if self.object_list.query.where:
+            return super().count
+        estimativa = estimar_linhas(self.object_list, self.PODADA)
+        if estimativa is None or estimativa < self.LIMITE_EXATO:
+            return super().count
+        return estimativa
+
+
+class ContagemPodadaPaginator(ContagemAproximadaPaginator):
+    """
+    Para tabelas arquivadas pelo começo, como o LogEntry. O total ainda é
+    aproximado: conta também os ids que ficaram vagos no meio da faixa.
+    """
+    PODADA = True
+
+
+def estimar_linhas(queryset, podada=False):
+    conexao = connections[queryset.db]
+    if conexao.vendor == 'postgresql':
+        with conexao.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [queryset.model._meta.db_table])
+            linha = cursor.fetchone()
+        return linha[0] if linha and linha[0] > 0 else None
+    if conexao.vendor == 'sqlite':
+        faixa = queryset.model._base_manager.using(queryset.db).aggregate(maior=Max('pk'), menor=Min('pk'))
+        if faixa['maior'] is None:
+            return 0
+        return faixa['maior'] - faixa['menor'] + 1 if podada else faixa['maior']
+    return None
+
+
 # ===========================
 # Inline: ItemVenda
 # ===========================
@@ -35,6 +94,9 @@ class ItemVendaInline(admin.TabularInline):
     fields = ['mostrar_produto', 'produto', 'quantidade', 'subtotal_display']
     can_delete = True
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('produto')
+
     def mostrar_produto(self, obj):
         return obj.produto.nome if obj.produto else "-"
     mostrar_produto.short_description = "Produto"
@@ -54,14 +116,90 @@ class ProdutoAdmin(SimpleHistoryAdmin):
     search_fields = ['nome', 'codigo_barras']
     ordering = ['nome']
 
+    # Quantos achados do índice o autocomplete traz e a lista ordena por relevância
+    LIMITE_BUSCA = 200
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Busca só pelo índice de busca.py, sem icontains no banco: ele cobre
+        acento ("acucar" encontra "Açúcar"), trechos do nome e prefixo do
+        código de barras. Sem ordenação escolhida na lista, os mais
+        relevantes vêm primeiro.
+        """
+        if not search_term:
+            return queryset, False
+        autocomplete = request.resolver_match is not None and request.resolver_match.url_name == 'autocomplete'
+        ids = buscar_ids(search_term, self.LIMITE_BUSCA if autocomplete else None)
+        if not ids:
+            return queryset.none(), False
+        resultado = queryset.filter(pk__in=ids)
+        if ORDER_VAR not in request.GET:
+            relevantes = ids[:self.LIMITE_BUSCA]
+            ordem = Case(*[When(pk=pk, then=Value(i)) for i, pk in enumerate(relevantes)], default=Value(len(relevantes)), output_field=IntegerField())
+            resultado = resultado.order_by(ordem, 'nome')
+        return resultado, False
+
     def status_estoque(self, obj):
-        if obj.estoque == 0:
+        # Status da reposição (reposicao.py), calculado uma vez para o catálogo todo
+        sugestao = sugestoes().get(obj.pk)
+        status = sugestao['status'] if sugestao else (SEM_ESTOQUE if obj.estoque == 0 else PARADO)
+        if status == SEM_ESTOQUE:
             return format_html('<span style="color: red;">❌ Sem Estoque</span>')
-        elif obj.estoque < 10:
-            return format_html('<span style="color: orange;">⚠️ Estoque Baixo ({})</span>', obj.estoque)
+        elif status == REPOR:
+            return format_html(
+                '<span style="color: orange;">⚠️ Repor ({}, {} dia(s); sugerido {})</span>',
+                obj.estoque, sugestao['cobertura_dias'], sugestao['sugerido'],
+            )
+        elif status == PARADO:
+            return format_html('<span style="color: gray;">➖ Sem venda ({})</span>', obj.estoque)
         return format_html('<span style="color: green;">✅ OK ({})</span>', obj.estoque)
     status_estoque.short_description = 'Status'
 
+    def get_urls(self):
+        return [
+            path('reposicao/', self.admin_site.admin_view(self.reposicao_view), name='mercado_produto_reposicao'),
+        ] + super().get_urls()
+
+    def reposicao_view(self, request):
+        status = request.GET.get('status')
+        if status not in STATUS:
+            status = None
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Sugestão de reposição',
+            'sugestoes': listar(status),
+            'status': status,
+            'opcoes_status': STATUS,
+        }
+        return TemplateResponse(request, 'admin/mercado/produto/reposicao.html', context)
+
+
+@admin.register(MovimentoEstoque)
+class MovimentoEstoqueAdmin(admin.ModelAdmin):
+    list_display = ['data', 'produto', 'motivo', 'quantidade', 'venda_id', 'item_id']
+    list_filter = ['motivo', 'data']
+    search_fields = ['produto__nome', 'produto__codigo_barras']
+    list_select_related = ['produto']
+    raw_id_fields = ['produto']
+    paginator = ContagemAproximadaPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """Produto pelo índice de busca.py, como em ProdutoAdmin."""
+        if not search_term:
+            return queryset, False
+        return queryset.filter(produto_id__in=buscar_ids(search_term, ProdutoAdmin.LIMITE_BUSCA)), False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 
 # ===========================
 # Form Venda
@@ -76,10 +214,7 @@ class VendaAdminForm(forms.ModelForm):
         valor_pago = cleaned_data.get('valor_pago')
         forma_pagamento = cleaned_data.get('forma_pagamento')
 
-        total = Decimal('0.00')
-        if self.instance.pk:
-            for item in self.instance.itens.all():
-                total += item.subtotal
+        total = self.instance.valor_total if self.instance.pk else Decimal('0.00')
 
         if forma_pagamento and forma_pagamento.lower() == 'dinheiro':
             if valor_pago is None:
@@ -104,22 +239,29 @@ class VendaAdmin(admin.ModelAdmin):
 
     readonly_fields = [
         'mostrar_valor_total', 'troco', 'data_venda',
-        'saldo_devedor', 'pago'
+        'saldo_devedor', 'pago', 'quitacao'
     ]
 
-    list_filter = ['forma_pagamento', 'data_venda', 'pago']
+    list_filter = ['forma_pagamento', 'data_venda', 'pago', 'cliente__equipe']
     search_fields = ['cliente__nome']
     autocomplete_fields = ['cliente']
-    actions = ['marcar_como_pago']
+    list_select_related = ['cliente']
+    paginator = ContagemAproximadaPaginator
+    show_full_result_count = False
+    actions = ['quitar_em_dinheiro', 'quitar_no_pix', 'quitar_no_credito', 'quitar_no_debito']
 
     # 🔥 AQUI ESTÁ A CORREÇÃO
     class Media:
         js = ("js/admin_pdv.js",)
         css = {"all": ("admin_pdv.css",)}
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(itens_com_produto())
+
     def mostrar_valor_total(self, obj):
-        return f"R$ {obj.calcular_total():.2f}"
+        return f"R$ {obj.valor_total:.2f}"
     mostrar_valor_total.short_description = 'Valor Total'
+    mostrar_valor_total.admin_order_field = 'valor_total'
 
     def produtos(self, obj):
         return ", ".join([item.produto.nome for item in obj.itens.all()])
@@ -129,10 +271,31 @@ class VendaAdmin(admin.ModelAdmin):
         return format_html('<span style="color: green;">✔️</span>') if obj.pago else format_html('<span style="color: red;">❌</span>')
     status_pago.short_description = 'Pago'
 
-    def marcar_como_pago(self, request, queryset):
-        atualizadas = queryset.update(pago=True)
-        self.message_user(request, f"{atualizadas} venda(s) marcadas como pagas com sucesso.")
-    marcar_como_pago.short_description = "Confirmar pagamento das vendas selecionadas"
+    def _quitar(self, request, queryset, forma_pagamento):
+        selecionadas = queryset.count()
+        quitacoes = quitar_vendas(queryset, forma_pagamento, usuario=request.user)
+        vendas = sum(q.quantidade_vendas for q in quitacoes)
+        valor = sum((q.valor for q in quitacoes), Decimal('0.00'))
+        mensagem = f"{vendas} venda(s) quitadas em {len(quitacoes)} quitação(ões), total R$ {valor:.2f}."
+        if selecionadas > vendas:
+            mensagem += f" {selecionadas - vendas} venda(s) ignoradas: só vendas em aberto com saldo, fora carrinhos do PDV, são quitadas."
+        self.message_user(request, mensagem)
+
+    def quitar_em_dinheiro(self, request, queryset):
+        self._quitar(request, queryset, 'dinheiro')
+    quitar_em_dinheiro.short_description = "Quitar vendas selecionadas (dinheiro)"
+
+    def quitar_no_pix(self, request, queryset):
+        self._quitar(request, queryset, 'pix')
+    quitar_no_pix.short_description = "Quitar vendas selecionadas (Pix)"
+
+    def quitar_no_credito(self, request, queryset):
+        self._quitar(request, queryset, 'credito')
+    quitar_no_credito.short_description = "Quitar vendas selecionadas (cartão de crédito)"
+
+    def quitar_no_debito(self, request, queryset):
+        self._quitar(request, queryset, 'debito')
+    quitar_no_debito.short_description = "Quitar vendas selecionadas (cartão de débito)"
 
 
 # ===========================
@@ -146,6 +309,9 @@ class VendaInline(admin.TabularInline):
     show_change_link = True
     can_delete = False
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('cliente').prefetch_related(itens_com_produto())
+
     def has_add_permission(self, request, obj):
         return False
 
@@ -165,46 +331,125 @@ class ClienteAdmin(SimpleHistoryAdmin):
 # ===========================
 # ClienteResumo
 # ===========================
+class SaldoAbertoFilter(admin.SimpleListFilter):
+    title = 'Saldo em aberto'
+    parameter_name = 'saldo'
+
+    def lookups(self, request, model_admin):
+        return [('devendo', 'Com saldo em aberto'), ('quitado', 'Sem saldo em aberto')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'devendo':
+            return queryset.filter(saldo_aberto__gt=0)
+        if self.value() == 'quitado':
+            return queryset.filter(saldo_aberto=0)
+        return queryset
+
+
 @admin.register(ClienteResumo)
 class ClienteResumoAdmin(admin.ModelAdmin):
-    list_display = ['nome', 'tipo', 'total_quantidade', 'total_valor']
+    list_display = ['nome', 'tipo', 'total_quantidade', 'total_valor', 'saldo_em_aberto', 'ultima_compra']
     search_fields = ['nome']
-    list_filter = ['tipo']
+    list_filter = ['tipo', SaldoAbertoFilter, 'ultima_compra']
     ordering = ['nome']
 
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        valor_total_expr = ExpressionWrapper(
-            F('vendas__itens__quantidade') * F('vendas__itens__produto__preco'),
-            output_field=DecimalField()
-        )
-        return qs.annotate(
-            total_qtd=Sum('vendas__itens__quantidade'),
-            total_valor=Sum(valor_total_expr)
-        )
-
     def total_quantidade(self, obj):
-        return obj.total_qtd or 0
+        return obj.total_itens
+    total_quantidade.short_description = 'Total de itens'
+    total_quantidade.admin_order_field = 'total_itens'
 
     def total_valor(self, obj):
-        valor = obj.total_valor or Decimal('0.00')
-        valor_formatado = f"{valor:.2f}"
-        return format_html('<strong>R$ {}</strong>', valor_formatado)
+        return format_html('<strong>R$ {}</strong>', f"{obj.total_comprado:.2f}")
+    total_valor.short_description = 'Total comprado'
+    total_valor.admin_order_field = 'total_comprado'
+
+    def saldo_em_aberto(self, obj):
+        return f"R$ {obj.saldo_aberto:.2f}"
+    saldo_em_aberto.short_description = 'Saldo em aberto'
+    saldo_em_aberto.admin_order_field = 'saldo_aberto'
+
+
+
+# ===========================
+# Quitação
+# ===========================
+@admin.register(Quitacao)
+class QuitacaoAdmin(admin.ModelAdmin):
+    list_display = ['data', 'cliente', 'equipe', 'forma_pagamento', 'quantidade_vendas', 'valor', 'usuario']
+    list_filter = ['forma_pagamento', 'equipe', 'data']
+    search_fields = ['cliente__nome', 'equipe']
+    list_select_related = ['cliente', 'usuario']
+
+    def has_add_permission(self, request):
+        return False
 
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 # ===========================
 # Caixa
 # ===========================
+class CaixaTotalInline(admin.TabularInline):
+    model = CaixaTotal
+    extra = 0
+    fields = ['forma_pagamento', 'quantidade', 'valor', 'quitado']
+    readonly_fields = fields
+    can_delete = False
+
+    def has_add_permission(self, request, obj):
+        return False
+
+
+class FechamentoCaixaInline(admin.StackedInline):
+    model = FechamentoCaixa
+    extra = 0
+    can_delete = False
+
+    def get_readonly_fields(self, request, obj=None):
+        return [campo.name for campo in FechamentoCaixa._meta.fields]
+
+    def has_add_permission(self, request, obj):
+        return False
+
+
 @admin.register(Caixa)
 class CaixaAdmin(admin.ModelAdmin):
-    list_display = ['data_abertura', 'valor_inicial', 'valor_fechamento', 'data_fechamento', 'status']
-    readonly_fields = ['status']
+    list_display = ['data_abertura', 'valor_inicial', 'valor_fechamento', 'data_fechamento', 'status', 'total_vendas']
+    readonly_fields = ['status', 'data_fechamento']
     ordering = ['-data_abertura']
+    inlines = [CaixaTotalInline, FechamentoCaixaInline]
+    actions = ['fechar_caixas', 'recalcular_totais']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('fechamento').annotate(
+            total_aberto=Sum('totais__valor')
+        )
 
     def status(self, obj):
         return "Aberto" if not obj.data_fechamento else "Fechado"
 
+    def total_vendas(self, obj):
+        if hasattr(obj, 'fechamento'):
+            return f"R$ {obj.fechamento.total_vendas:.2f}"
+        return f"R$ {obj.total_aberto or Decimal('0.00'):.2f}"
+    total_vendas.short_description = 'Total vendido'
+
+    def fechar_caixas(self, request, queryset):
+        fechados = 0
+        for caixa in queryset.filter(data_fechamento__isnull=True):
+            caixa.fechar_caixa()
+            fechados += 1
+        self.message_user(request, f"{fechados} caixa(s) fechados com sucesso.")
+    fechar_caixas.short_description = "Fechar os caixas selecionados"
+
+    def recalcular_totais(self, request, queryset):
+        abertos = queryset.filter(data_fechamento__isnull=True)
+        for caixa in abertos:
+            recalcular_totais(caixa)
+        self.message_user(request, f"Totais de {len(abertos)} caixa(s) recalculados a partir das vendas.")
+    recalcular_totais.short_description = "Recalcular totais dos caixas abertos"
+
 
 # ===========================
 # Histórico
@@ -221,6 +466,36 @@ class LogEntryProxyAdmin(admin.ModelAdmin):
     list_display = ['action_time', 'user', 'content_type', 'object_repr', 'action_flag', 'change_message']
     list_filter = ['user', 'content_type', 'action_flag']
     search_fields = ['object_repr', 'change_message']
+    list_select_related = ['user', 'content_type']
+    paginator = ContagemPodadaPaginator
+    show_full_result_count = False
+
+
+@admin.register(ResumoHistorico)
+class ResumoHistoricoAdmin(admin.ModelAdmin):
+    list_display = ['mes', 'origem', 'acao', 'content_type', 'usuario', 'quantidade']
+    list_filter = ['origem', 'acao', 'content_type']
+    list_select_related = ['content_type', 'usuario']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+# ===========================
+# Fila de cupons
+# ===========================
+@admin.register(ImpressaoCupom)
+class ImpressaoCupomAdmin(admin.ModelAdmin):
+    list_display = ['criada_em', 'usuario', 'venda', 'impressa_em', 'tentativas', 'erro']
+    list_filter = ['usuario', ('impressa_em', admin.EmptyFieldListFilter)]
+    list_select_related = ['usuario', 'venda__cliente']
+    readonly_fields = ['usuario', 'venda', 'criada_em', 'impressa_em', 'erro']
+
+    def has_add_permission(self, request):
+        return False
 
 
 # ===========================
@@ -231,3 +506,17 @@ class PDVSessionAdmin(admin.ModelAdmin):
     list_display = ['user', 'venda', 'criada_em']
     readonly_fields = ['criada_em']
 
+
+@admin.register(ReservaEstoque)
+class ReservaEstoqueAdmin(admin.ModelAdmin):
+    """Estoque preso nos carrinhos abertos; quem mexe é o PDV e o comando expirar_reservas."""
+    list_display = ['produto', 'quantidade', 'sessao', 'venda', 'expira_em']
+    list_select_related = ['produto', 'sessao__user', 'venda']
+    date_hierarchy = 'expira_em'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
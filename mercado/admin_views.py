@@ -1,16 +1,16 @@
 from django.http import JsonResponse
-from .models import Produto
+from .catalogo import buscar_produto
 
 def scan_codigo_admin(request):
     codigo = request.GET.get("codigo")
 
-    try:
-        produto = Produto.objects.get(codigo_barras=codigo)
-        return JsonResponse({
-            "ok": True,
-            "id": produto.id,
-            "nome": produto.nome,
-            "preco": float(produto.preco),
-        })
-    except Produto.DoesNotExist:
+    produto = buscar_produto(codigo)
+    if produto is None:
         return JsonResponse({"ok": False, "erro": "Produto não encontrado"})
+
+    return JsonResponse({
+        "ok": True,
+        "id": produto["id"],
+        "nome": produto["nome"],
+        "preco": float(produto["preco"]),
+    })
@@ -1,6 +1,16 @@
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from .models import Produto, PDVSession
+from .carrinho import carrinhos
+from .catalogo import buscar_produto
+from .estoque import EstoqueInsuficiente
+from .models import Cliente
+from .perifericos import enfileirar_cupom
+from .quitacao import quitar_cliente, quitar_equipe
+from .services import finalizar_venda, get_or_create_pdv_session
 
 @csrf_exempt
 def api_bipar(request):
@@ -9,34 +19,146 @@ def api_bipar(request):
     if not codigo:
         return JsonResponse({"erro": "Código não enviado"}, status=400)
 
-    try:
-        produto = Produto.objects.get(codigo_barras=codigo)
-    except Produto.DoesNotExist:
+    produto = buscar_produto(codigo)
+    if produto is None:
         return JsonResponse({"erro": "Produto não encontrado"}, status=404)
 
     if not request.user.is_authenticated:
         return JsonResponse({"erro": "Usuário não autenticado"}, status=403)
 
+    session = get_or_create_pdv_session(request.user)
+
+    eventos = []
+    erros, _ = carrinhos.bipar(session, [(codigo, 1, None)], eventos)
+    if erros:
+        return JsonResponse({"erro": erros[0]["erro"]}, status=409)
+
+    deltas = dict(eventos)
+    return JsonResponse({
+        "mensagem": "Item adicionado com sucesso",
+        "produto": produto["nome"],
+        "quantidade": deltas["item"]["quantidade"],
+        "subtotal": deltas["item"]["subtotal"],
+        "total_venda": deltas["total"]["total"]
+    })
+
+
+def _ler_item(item):
+    """Aceita {"codigo": ..., "quantidade": ...} ou [codigo, quantidade]."""
+    if isinstance(item, dict):
+        return str(item["codigo"]), int(item.get("quantidade", 1))
+    codigo, quantidade = item
+    return str(codigo), int(quantidade)
+
+
+@csrf_exempt
+def api_finalizar_venda(request):
+    if request.method != "POST":
+        return JsonResponse({"erro": "Use POST"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"erro": "Usuário não autenticado"}, status=403)
+
     try:
-        session = PDVSession.objects.get(usuario=request.user, ativa=True)
-        venda = session.venda
-    except PDVSession.DoesNotExist:
-        return JsonResponse({"erro": "Sessão PDV não localizada"}, status=500)
+        dados = json.loads(request.body)
+        itens = [_ler_item(item) for item in dados.get("itens", [])]
+        valor_pago = dados.get("valor_pago")
+        valor_pago = Decimal(str(valor_pago)) if valor_pago not in (None, "") else None
+        cliente_id = int(dados["cliente"]) if dados.get("cliente") else None
+    except (ValueError, TypeError, KeyError, AttributeError, InvalidOperation):
+        return JsonResponse({"erro": "Dados da venda inválidos"}, status=400)
 
-    item, created = venda.itens.get_or_create(
-        produto=produto,
-        defaults={'quantidade': 1, 'subtotal': produto.preco}
-    )
+    cliente = None
+    if cliente_id is not None:
+        cliente = Cliente.objects.filter(pk=cliente_id).first()
+        if cliente is None:
+            return JsonResponse({"erro": "Cliente não encontrado"}, status=404)
 
-    if not created:
-        item.quantidade += 1
-        item.subtotal = produto.preco * item.quantidade
-        item.save()
+    try:
+        if itens:
+            venda = finalizar_venda(
+                itens,
+                forma_pagamento=dados.get("forma_pagamento", "dinheiro"),
+                valor_pago=valor_pago,
+                cliente=cliente,
+            )
+        else:
+            # Sem itens na requisição, fecha o carrinho da sessão do PDV
+            venda = carrinhos.fechar(
+                get_or_create_pdv_session(request.user),
+                forma_pagamento=dados.get("forma_pagamento", "dinheiro"),
+                valor_pago=valor_pago,
+                cliente=cliente,
+            )
+    except EstoqueInsuficiente as e:
+        return JsonResponse({
+            "erro": " ".join(e.messages),
+            "falhas": [
+                {"produto": produto_id, "solicitado": solicitado, "disponivel": disponivel}
+                for produto_id, solicitado, disponivel in e.falhas
+            ],
+        }, status=409)
+    except ValidationError as e:
+        return JsonResponse({"erro": " ".join(e.messages)}, status=400)
+
+    # A impressão fica com o comando perifericos_pdv
+    enfileirar_cupom(venda, request.user)
 
     return JsonResponse({
-        "mensagem": "Item adicionado com sucesso",
-        "produto": produto.nome,
-        "quantidade": item.quantidade,
-        "subtotal": float(item.subtotal),
-        "total_venda": float(venda.calcular_total())
+        "mensagem": "Venda finalizada com sucesso",
+        "venda": venda.pk,
+        "codigo_barras": venda.codigo_barras,
+        "forma_pagamento": venda.forma_pagamento,
+        "total": float(venda.valor_total),
+        "valor_pago": float(venda.valor_pago) if venda.valor_pago is not None else None,
+        "troco": float(venda.troco) if venda.troco is not None else None,
+        "saldo_devedor": float(venda.saldo_devedor),
+        "pago": venda.pago,
+    })
+
+
+@csrf_exempt
+def api_quitar_contas(request):
+    """
+    Quita as vendas em aberto de um cliente ou de uma equipe:
+    {"cliente": id} ou {"equipe": "..."}, mais "forma_pagamento".
+    """
+    if request.method != "POST":
+        return JsonResponse({"erro": "Use POST"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"erro": "Usuário não autenticado"}, status=403)
+
+    try:
+        dados = json.loads(request.body)
+        forma_pagamento = dados["forma_pagamento"]
+        cliente_id = int(dados["cliente"]) if dados.get("cliente") else None
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({"erro": "Dados da quitação inválidos"}, status=400)
+
+    try:
+        if dados.get("equipe"):
+            quitacoes = quitar_equipe(dados["equipe"], forma_pagamento, usuario=request.user)
+        elif cliente_id is not None:
+            cliente = Cliente.objects.filter(pk=cliente_id).first()
+            if cliente is None:
+                return JsonResponse({"erro": "Cliente não encontrado"}, status=404)
+            quitacoes = quitar_cliente(cliente, forma_pagamento, usuario=request.user)
+        else:
+            return JsonResponse({"erro": "Informe o cliente ou a equipe"}, status=400)
+    except ValidationError as e:
+        return JsonResponse({"erro": " ".join(e.messages)}, status=400)
+
+    return JsonResponse({
+        "mensagem": "Contas quitadas com sucesso" if quitacoes else "Nenhuma venda em aberto",
+        "quitacoes": [{
+            "id": quitacao.pk,
+            "cliente": quitacao.cliente_id,
+            "equipe": quitacao.equipe,
+            "vendas": quitacao.quantidade_vendas,
+            "valor": float(quitacao.valor),
+        } for quitacao in quitacoes],
+        "vendas": sum(quitacao.quantidade_vendas for quitacao in quitacoes),
+        "valor": float(sum(quitacao.valor for quitacao in quitacoes)),
     })
+
@@ -0,0 +1,213 @@
+import csv
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .inventario import estoque_em
+from .models import Produto
+from .reposicao import COBERTURA_ALVO_DIAS, JANELA_DIAS, PRAZO_ENTREGA_DIAS, STATUS, listar
+from .relatorios import (
+    AGRUPAMENTOS_ATRASO, FAIXAS_ATRASO, contas_a_receber, ler_limite, resumo_do_dia, vendas_do_dia,
+)
+from .resumo import RESOLUCOES, serie_vendas
+
+
+@login_required
+def api_relatorio_vendas(request):
+    """
+    Vendas por período: ?de=...&ate=...&resolucao=hora|dia|semana|mes,
+    com filtros opcionais categoria, cliente e forma_pagamento. A resposta
+    cobre o intervalo [inicio, fim).
+    """
+    hoje = timezone.localdate()
+    resolucao = request.GET.get("resolucao", "dia")
+    if resolucao not in RESOLUCOES:
+        return JsonResponse({"erro": f"Resolução inválida. Use: {', '.join(RESOLUCOES)}"}, status=400)
+
+    try:
+        inicio = ler_limite(request.GET.get("de") or str(hoje - timedelta(days=29)))
+        fim = ler_limite(request.GET.get("ate") or str(hoje), fim=True)
+        cliente = request.GET.get("cliente")
+        cliente = int(cliente) if cliente else None
+    except ValueError:
+        return JsonResponse({"erro": "Parâmetros inválidos"}, status=400)
+
+    if fim <= inicio:
+        return JsonResponse({"erro": "Período inválido"}, status=400)
+
+    serie = serie_vendas(
+        inicio, fim, resolucao,
+        categorias=request.GET.getlist("categoria"),
+        cliente_id=cliente,
+        formas_pagamento=request.GET.getlist("forma_pagamento"),
+    )
+
+    return JsonResponse({
+        "inicio": timezone.localtime(inicio).isoformat(),
+        "fim": timezone.localtime(fim).isoformat(),
+        "resolucao": resolucao,
+        "periodos": [{
+            "inicio": timezone.localtime(item["periodo"]).isoformat(),
+            "quantidade": item["quantidade"],
+            "valor": float(item["valor"]),
+        } for item in serie],
+        "total": {
+            "quantidade": sum(item["quantidade"] for item in serie),
+            "valor": float(sum(item["valor"] for item in serie)),
+        },
+    })
+
+
+@login_required
+def api_vendas_por_data(request, data):
+    """Vendas do dia com itens, paginadas por cursor (?apos=...), e o resumo do dia."""
+    dia = parse_date(data)
+    if dia is None:
+        return JsonResponse({"erro": "Data inválida"}, status=400)
+
+    try:
+        vendas, proxima_pagina = vendas_do_dia(dia, apos=request.GET.get("apos"))
+    except ValueError:
+        return JsonResponse({"erro": "Cursor inválido"}, status=400)
+
+    resumo = resumo_do_dia(dia)
+    return JsonResponse({
+        "data": dia.isoformat(),
+        "resumo": {
+            "valor_total_dia": float(resumo["valor_total_dia"]),
+            "vendas_confirmadas": resumo["vendas_confirmadas"],
+            "vendas_pendentes": resumo["vendas_pendentes"],
+            "saldo_total_devedor": float(resumo["saldo_total_devedor"]),
+        },
+        "vendas": [{
+            "id": venda.pk,
+            "cliente": venda.cliente.nome if venda.cliente else None,
+            "data_venda": timezone.localtime(venda.data_venda).isoformat(),
+            "forma_pagamento": venda.forma_pagamento,
+            "valor_total": float(venda.valor_total),
+            "pago": venda.pago,
+            "saldo_devedor": float(venda.saldo_devedor),
+            "itens": [{
+                "produto": item.produto.nome,
+                "quantidade": item.quantidade,
+                "subtotal": float(item.subtotal),
+            } for item in venda.itens.all()],
+        } for venda in vendas],
+        "proxima_pagina": proxima_pagina,
+    })
+
+
+@login_required
+def api_contas_a_receber(request):
+    """
+    Contas a receber por faixa de atraso: ?agrupar=cliente|equipe, com
+    filtros opcionais tipo, equipe e cor. ?formato=csv baixa a planilha.
+    """
+    agrupar_por = request.GET.get("agrupar", "cliente")
+    if agrupar_por not in AGRUPAMENTOS_ATRASO:
+        return JsonResponse({"erro": f"Agrupamento inválido. Use: {', '.join(AGRUPAMENTOS_ATRASO)}"}, status=400)
+
+    hoje = timezone.localdate()
+    linhas = contas_a_receber(
+        agrupar_por,
+        hoje=hoje,
+        tipo=request.GET.get("tipo"),
+        equipe=request.GET.get("equipe"),
+        cor=request.GET.get("cor"),
+    )
+    faixas = [nome for nome, _, _ in FAIXAS_ATRASO]
+
+    if request.GET.get("formato") == "csv":
+        colunas = list(AGRUPAMENTOS_ATRASO[agrupar_por]) + ["vendas"] + faixas + ["total", "venda_mais_antiga"]
+        resposta = HttpResponse(content_type="text/csv; charset=utf-8")
+        resposta["Content-Disposition"] = f'attachment; filename="contas_a_receber_{agrupar_por}_{hoje:%Y%m%d}.csv"'
+        resposta.write("\ufeff")
+        escritor = csv.writer(resposta)
+        escritor.writerow([coluna.replace("cliente__", "") for coluna in colunas])
+        for linha in linhas:
+            linha["venda_mais_antiga"] = timezone.localtime(linha["venda_mais_antiga"]).date()
+            for coluna in faixas + ["total"]:
+                linha[coluna] = f"{linha[coluna]:.2f}"
+            escritor.writerow(["" if linha[coluna] is None else linha[coluna] for coluna in colunas])
+        return resposta
+
+    resultado = []
+    for linha in linhas:
+        resultado.append({
+            **({
+                "cliente": linha["cliente"],
+                "nome": linha["cliente__nome"],
+                "equipe": linha["cliente__equipe"],
+                "tipo": linha["cliente__tipo"],
+            } if agrupar_por == "cliente" else {"equipe": linha["cliente__equipe"]}),
+            "vendas": linha["vendas"],
+            "faixas": {nome: float(linha[nome]) for nome in faixas},
+            "total": float(linha["total"]),
+            "venda_mais_antiga": timezone.localtime(linha["venda_mais_antiga"]).date().isoformat(),
+        })
+
+    return JsonResponse({
+        "data": hoje.isoformat(),
+        "agrupar": agrupar_por,
+        "linhas": resultado,
+        "total": {
+            **{nome: sum(item["faixas"][nome] for item in resultado) for nome in faixas},
+            "geral": sum(item["total"] for item in resultado),
+        },
+    })
+
+
+@login_required
+def api_posicao_estoque(request):
+    """
+    Estoque de cada produto num momento passado: ?em=AAAA-MM-DD (fim do
+    dia) ou data e hora ISO, com ?produto= opcional (repetível). O valor
+    usa o preço atual.
+    """
+    try:
+        momento = ler_limite(request.GET.get("em") or str(timezone.localdate()), fim=True)
+        produtos = [int(pk) for pk in request.GET.getlist("produto")] or None
+    except ValueError:
+        return JsonResponse({"erro": "Parâmetros inválidos"}, status=400)
+
+    saldos = estoque_em(momento, produtos)
+    resultado = []
+    valor_total = Decimal("0.00")
+    for produto in Produto.objects.filter(pk__in=saldos).order_by("nome").values("pk", "nome", "preco"):
+        estoque = saldos[produto["pk"]]
+        valor = produto["preco"] * estoque
+        valor_total += valor
+        resultado.append({
+            "produto": produto["pk"],
+            "nome": produto["nome"],
+            "estoque": estoque,
+            "valor": float(valor),
+        })
+
+    return JsonResponse({
+        "em": timezone.localtime(momento).isoformat(),
+        "produtos": resultado,
+        "valor_total": float(valor_total),
+    })
+
+
+@login_required
+def api_reposicao(request):
+    """
+    Sugestão de reposição do catálogo (ver reposicao.py), do mais urgente
+    para o menos, com ?status= opcional.
+    """
+    status = request.GET.get("status") or None
+    if status is not None and status not in STATUS:
+        return JsonResponse({"erro": f"Status inválido. Use: {', '.join(STATUS)}"}, status=400)
+
+    return JsonResponse({
+        "janela_dias": JANELA_DIAS,
+        "prazo_dias": PRAZO_ENTREGA_DIAS,
+        "cobertura_alvo_dias": COBERTURA_ALVO_DIAS,
+        "produtos": listar(status),
+    })
@@ -0,0 +1,128 @@
+"""
+Arquivamento do histórico.
+
+O HistoricalProduto e o LogEntry do admin crescem sem limite. As linhas
+mais antigas que o corte saem do banco em lotes: cada lote é copiado para
+um arquivo SQLite à parte (que só acumula) e, depois de gravado lá, é
+contado no ResumoHistorico e apagado na mesma transação. Rodar de novo
+depois de uma interrupção não duplica nada no arquivo.
+
+As tabelas do arquivo acompanham o model: campos novos viram colunas
+novas (nulas nas linhas antigas) e campos removidos continuam lá, nulos
+nas linhas novas.
+
+Do histórico de produtos fica sempre a linha mais recente de cada
+produto, para o admin ter com o que comparar a próxima alteração.
+"""
+import sqlite3
+from collections import Counter
+from contextlib import closing
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.contrib.admin.models import ADDITION, CHANGE, DELETION, LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from .models import Produto, ResumoHistorico
+
+LOTE = 5000
+
+ACAO_DO_LOG = {ADDITION: '+', CHANGE: '~', DELETION: '-'}
+
+
+def _mes(momento):
+    return timezone.localtime(momento).date().replace(day=1)
+
+
+def _valor(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    return valor
+
+
+def _somar_resumo(origem, contagem):
+    for (mes, acao, content_type_id, usuario_id), quantidade in contagem.items():
+        chave = {
+            'mes': mes,
+            'origem': origem,
+            'acao': acao,
+            'content_type_id': content_type_id,
+            'usuario_id': usuario_id,
+        }
+        if not ResumoHistorico.objects.filter(**chave).update(quantidade=F('quantidade') + quantidade):
+            ResumoHistorico.objects.create(quantidade=quantidade, **chave)
+
+
+def _preparar_tabela(conexao, tabela, colunas, chave):
+    """Cria a tabela no arquivo ou acrescenta as colunas que faltam."""
+    definicao = ', '.join(f'"{coluna}" PRIMARY KEY' if coluna == chave else f'"{coluna}"' for coluna in colunas)
+    conexao.execute(f'CREATE TABLE IF NOT EXISTS "{tabela}" ({definicao})')
+    existentes = {linha[1] for linha in conexao.execute(f'PRAGMA table_info("{tabela}")')}
+    for coluna in colunas:
+        if coluna not in existentes:
+            conexao.execute(f'ALTER TABLE "{tabela}" ADD COLUMN "{coluna}"')
+
+
+def _arquivar(arquivo, origem, linhas, resumir, lote):
+    """
+    Move `linhas` para a tabela de mesmo nome no arquivo SQLite, `lote` por
+    vez. `resumir(linha)` devolve a chave (mes, acao, content_type_id,
+    usuario_id) de cada linha no ResumoHistorico.
+    """
+    model = linhas.model
+    tabela = model._meta.db_table
+    chave = model._meta.pk.attname
+    colunas = [campo.attname for campo in model._meta.concrete_fields]
+    nomes = ', '.join(f'"{coluna}"' for coluna in colunas)
+    marcadores = ', '.join('?' for _ in colunas)
+    i_chave = colunas.index(chave)
+
+    movidas = 0
+    with closing(sqlite3.connect(arquivo)) as conexao:
+        _preparar_tabela(conexao, tabela, colunas, chave)
+        while True:
+            bloco = list(linhas.order_by(chave).values_list(*colunas)[:lote])
+            if not bloco:
+                break
+
+            # O arquivo é gravado antes de apagar do banco
+            conexao.executemany(
+                f'INSERT OR IGNORE INTO "{tabela}" ({nomes}) VALUES ({marcadores})',
+                [tuple(_valor(valor) for valor in linha) for linha in bloco],
+            )
+            conexao.commit()
+
+            with transaction.atomic():
+                _somar_resumo(origem, Counter(resumir(dict(zip(colunas, linha))) for linha in bloco))
+                model._base_manager.filter(pk__in=[linha[i_chave] for linha in bloco]).delete()
+            movidas += len(bloco)
+    return movidas
+
+
+def arquivar_historico_produtos(antes_de, arquivo, lote=LOTE):
+    """Arquiva as linhas do HistoricalProduto anteriores a `antes_de`, menos a última de cada produto."""
+    Historico = Produto.history.model
+    content_type_id = ContentType.objects.get_for_model(Produto).pk
+    mais_nova = Historico.objects.filter(id=OuterRef('id'), history_id__gt=OuterRef('history_id'))
+    linhas = Historico.objects.filter(history_date__lt=antes_de).filter(Exists(mais_nova))
+
+    def resumir(linha):
+        return _mes(linha['history_date']), linha['history_type'], content_type_id, linha['history_user_id']
+
+    return _arquivar(arquivo, 'produto', linhas, resumir, lote)
+
+
+def arquivar_log_admin(antes_de, arquivo, lote=LOTE):
+    """Arquiva as linhas do LogEntry do admin anteriores a `antes_de`."""
+    linhas = LogEntry.objects.filter(action_time__lt=antes_de)
+
+    def resumir(linha):
+        acao = ACAO_DO_LOG.get(linha['action_flag'], '~')
+        return _mes(linha['action_time']), acao, linha['content_type_id'], linha['user_id']
+
+    return _arquivar(arquivo, 'admin', linhas, resumir, lote)
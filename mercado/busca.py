@@ -0,0 +1,222 @@
+"""
+Busca de produtos por nome e código de barras.
+
+Índice de trigramas em memória do processo, montado na primeira busca a
+partir de uma única consulta e mantido pelos sinais de Produto (ver
+signals.py). Os nomes são normalizados sem acento e em minúsculas, então
+"acucar" encontra "Açúcar"; erros de digitação leves ainda casam pelos
+trigramas em comum, e um trecho do meio da palavra ("car") casa pelos
+trigramas internos. Consultas só com dígitos também procuram pelo
+prefixo do código de barras.
+
+Como no catálogo (ver catalogo.py), os sinais só alcançam o processo que
+gravou o produto: nos demais o índice é remontado depois de
+BUSCA_INDICE_SEGUNDOS.
+"""
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+
+from .models import Produto
+
+LIMITE_PADRAO = 20
+
+VALIDADE_PADRAO = 60
+
+# Fração mínima dos trigramas da consulta que o nome precisa ter
+SEMELHANCA_MINIMA = 0.5
+
+CAMPOS = ('id', 'nome', 'codigo_barras', 'preco', 'categoria')
+
+
+def normalizar(texto):
+    """Minúsculas, sem acentos e só letras/dígitos separados por espaço."""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in texto).split())
+
+
+def trigramas(texto, prefixo=False):
+    """
+    Trigramas das palavras de um texto já normalizado. Com `prefixo`, a
+    última palavra não é fechada, para casar com o que ainda está sendo
+    digitado ("acu" casa com "acucar").
+    """
+    palavras = texto.split()
+    resultado = set()
+    for i, palavra in enumerate(palavras):
+        aberta = prefixo and i == len(palavras) - 1
+        marcada = f"  {palavra}" if aberta else f"  {palavra} "
+        resultado.update(marcada[j:j + 3] for j in range(len(marcada) - 2))
+    return resultado
+
+
+class IndiceProdutos:
+    """Índice de trigramas dos nomes e lista ordenada dos códigos, seguro entre threads."""
+
+    def __init__(self, validade=VALIDADE_PADRAO):
+        # Segundos até remontar a partir do banco; None não expira
+        self.validade = validade
+        self._lock = threading.Lock()
+        self._pronto = False
+        self._montado_em = None
+        self._produtos = {}
+        self._nomes = {}
+        self._postagens = {}
+        self._codigos = []
+
+    def _atual(self):
+        if not self._pronto:
+            return False
+        return self.validade is None or time.monotonic() - self._montado_em < self.validade
+
+    def _montar(self):
+        with self._lock:
+            if self._atual():
+                return
+        # A consulta fica fora do lock: quem busca enquanto isso usa o índice antigo
+        produtos = list(Produto.objects.values(*CAMPOS).iterator(chunk_size=5000))
+        with self._lock:
+            if self._atual():
+                return
+            self._zerar()
+            for produto in produtos:
+                self._guardar(produto)
+            self._pronto = True
+            self._montado_em = time.monotonic()
+
+    def _zerar(self):
+        self._produtos.clear()
+        self._nomes.clear()
+        self._postagens.clear()
+        self._codigos.clear()
+
+    def _guardar(self, produto):
+        pk = produto['id']
+        nome = normalizar(produto['nome'])
+        self._produtos[pk] = produto
+        self._nomes[pk] = nome
+        for trigrama in trigramas(nome):
+            self._postagens.setdefault(trigrama, set()).add(pk)
+        if produto['codigo_barras']:
+            i = bisect_left(self._codigos, (produto['codigo_barras'], pk))
+            self._codigos.insert(i, (produto['codigo_barras'], pk))
+
+    def _descartar(self, pk):
+        produto = self._produtos.pop(pk, None)
+        if produto is None:
+            return
+        for trigrama in trigramas(self._nomes.pop(pk)):
+            ids = self._postagens.get(trigrama)
+            if ids is not None:
+                ids.discard(pk)
+                if not ids:
+                    del self._postagens[trigrama]
+        if produto['codigo_barras']:
+            i = bisect_left(self._codigos, (produto['codigo_barras'], pk))
+            if i < len(self._codigos) and self._codigos[i] == (produto['codigo_barras'], pk):
+                del self._codigos[i]
+
+    def atualizar(self, produto):
+        """Reindexa uma instância de Produto recém-gravada."""
+        if not self._pronto:
+            return
+        with self._lock:
+            self._descartar(produto.pk)
+            self._guardar({campo: getattr(produto, campo) for campo in CAMPOS})
+
+    def remover(self, produto_id):
+        with self._lock:
+            self._descartar(produto_id)
+
+    def limpar(self):
+        with self._lock:
+            self._pronto = False
+            self._zerar()
+
+    def _por_codigo(self, prefixo, limite):
+        ids = []
+        i = bisect_left(self._codigos, (prefixo,))
+        while i < len(self._codigos) and (limite is None or len(ids) < limite):
+            codigo, pk = self._codigos[i]
+            if not codigo.startswith(prefixo):
+                break
+            ids.append(pk)
+            i += 1
+        return ids
+
+    def _por_nome(self, consulta, limite):
+        buscados = trigramas(consulta, prefixo=True)
+        if not buscados:
+            return []
+        contagem = Counter()
+        for trigrama in buscados:
+            contagem.update(self._postagens.get(trigrama, ()))
+
+        minimo = len(buscados) * SEMELHANCA_MINIMA
+        trechos = self._por_trecho(consulta)
+        candidatos = []
+        for pk, comuns in contagem.items():
+            if comuns < minimo and pk not in trechos:
+                continue
+            nome = self._nomes[pk]
+            candidatos.append((
+                -comuns / len(buscados),
+                not nome.startswith(consulta),
+                consulta not in nome,
+                len(nome),
+                pk,
+            ))
+        candidatos.sort()
+        return [candidato[-1] for candidato in candidatos[:limite]]
+
+    def _por_trecho(self, consulta):
+        """
+        Ids cujo nome contém a consulta, mesmo no meio de uma palavra: quem
+        tem todos os trigramas internos dela, conferido no nome.
+        """
+        internos = {palavra[j:j + 3] for palavra in consulta.split() for j in range(len(palavra) - 2)}
+        ids = None
+        for trigrama in sorted(internos, key=lambda t: len(self._postagens.get(t, ()))):
+            postagem = self._postagens.get(trigrama, set())
+            ids = set(postagem) if ids is None else ids & postagem
+            if not ids:
+                return set()
+        return {pk for pk in ids or () if consulta in self._nomes[pk]}
+
+    def buscar_ids(self, termo, limite=LIMITE_PADRAO):
+        """Ids dos produtos mais parecidos com o termo, do melhor para o pior; limite None traz todos."""
+        self._montar()
+        consulta = normalizar(termo)
+        if not consulta:
+            return []
+
+        with self._lock:
+            ids = self._por_codigo(consulta, limite) if consulta.isdigit() else []
+            for pk in self._por_nome(consulta, limite):
+                if limite is not None and len(ids) >= limite:
+                    break
+                if pk not in ids:
+                    ids.append(pk)
+        return ids
+
+    def buscar(self, termo, limite=LIMITE_PADRAO):
+        """Como buscar_ids, mas devolve cópias dos produtos (id, nome, código, preço, categoria)."""
+        ids = self.buscar_ids(termo, limite)
+        with self._lock:
+            return [dict(self._produtos[pk]) for pk in ids if pk in self._produtos]
+
+
+indice = IndiceProdutos(getattr(settings, 'BUSCA_INDICE_SEGUNDOS', VALIDADE_PADRAO))
+
+
+def buscar_produtos(termo, limite=LIMITE_PADRAO):
+    return indice.buscar(termo, limite)
+
+
+def buscar_ids(termo, limite=LIMITE_PADRAO):
+    return indice.buscar_ids(termo, limite)
@@ -0,0 +1,144 @@
+"""
+Motor de caixa.
+
+Enquanto o caixa está aberto, o total vendido por forma de pagamento é
+mantido em CaixaTotal por deltas, na mesma transação que registra os
+resumos de vendas (ver resumo.registrar_venda). O que entra em
+quitações de contas em aberto (ver quitacao.py) vai para o `quitado` da
+forma de pagamento. No fechamento esses totais são congelados em
+FechamentoCaixa, e vendas alteradas depois disso não mexem mais no caixa
+fechado.
+"""
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Caixa, CaixaTotal, FechamentoCaixa, ItemVenda, Quitacao
+
+
+def caixa_aberto_em(momento):
+    """Id do caixa aberto que cobre o momento, ou None."""
+    return (
+        Caixa.objects
+        .filter(data_fechamento__isnull=True, data_abertura__lte=momento)
+        .order_by('-data_abertura')
+        .values_list('pk', flat=True)
+        .first()
+    )
+
+
+def aplicar_no_caixa(caixa_id, forma_pagamento, quantidade, valor):
+    """Soma o delta ao total do caixa; chamada dentro da transação dos resumos."""
+    atualizados = (
+        CaixaTotal.objects
+        .filter(caixa_id=caixa_id, forma_pagamento=forma_pagamento)
+        .update(quantidade=F('quantidade') + quantidade, valor=F('valor') + valor)
+    )
+    if not atualizados:
+        CaixaTotal.objects.create(
+            caixa_id=caixa_id,
+            forma_pagamento=forma_pagamento,
+            quantidade=quantidade,
+            valor=valor,
+        )
+
+
+def receber_no_caixa(caixa_id, forma_pagamento, valor):
+    """Soma ao caixa o valor recebido numa quitação; chamada dentro da transação dela."""
+    atualizados = (
+        CaixaTotal.objects
+        .filter(caixa_id=caixa_id, forma_pagamento=forma_pagamento)
+        .update(quitado=F('quitado') + valor)
+    )
+    if not atualizados:
+        CaixaTotal.objects.create(caixa_id=caixa_id, forma_pagamento=forma_pagamento, quitado=valor)
+
+
+def calcular_totais(caixa, ate=None):
+    """{forma_pagamento: (quantidade, valor)} calculado do zero a partir dos itens."""
+    itens = ItemVenda.objects.filter(venda__data_venda__gte=caixa.data_abertura)
+    if ate is not None:
+        itens = itens.filter(venda__data_venda__lte=ate)
+    return {
+        linha['venda__forma_pagamento']: (linha['total_quantidade'], linha['total_valor'])
+        for linha in (
+            itens
+            .values('venda__forma_pagamento')
+            .annotate(total_quantidade=Sum('quantidade'), total_valor=Sum('subtotal'))
+            .order_by()
+        )
+    }
+
+
+def calcular_quitacoes(caixa, ate=None):
+    """{forma_pagamento: valor} recebido em quitações desde a abertura do caixa."""
+    quitacoes = Quitacao.objects.filter(data__gte=caixa.data_abertura)
+    if ate is not None:
+        quitacoes = quitacoes.filter(data__lte=ate)
+    return dict(
+        quitacoes
+        .values('forma_pagamento')
+        .annotate(total=Sum('valor'))
+        .order_by()
+        .values_list('forma_pagamento', 'total')
+    )
+
+
+@transaction.atomic
+def recalcular_totais(caixa):
+    """Refaz os totais de um caixa aberto a partir das vendas e quitações do período."""
+    vendido = calcular_totais(caixa, caixa.data_fechamento)
+    quitado = calcular_quitacoes(caixa, caixa.data_fechamento)
+    CaixaTotal.objects.filter(caixa=caixa).delete()
+    CaixaTotal.objects.bulk_create([
+        CaixaTotal(
+            caixa=caixa,
+            forma_pagamento=forma,
+            quantidade=vendido.get(forma, (0, 0))[0],
+            valor=vendido.get(forma, (0, 0))[1],
+            quitado=quitado.get(forma, 0),
+        )
+        for forma in set(vendido) | set(quitado)
+    ])
+
+
+def fechar_caixa(caixa, valor_fechamento=None):
+    """
+    Fecha o caixa e grava o FechamentoCaixa com os totais do momento.
+
+    `valor_fechamento` é o dinheiro contado na gaveta; com ele a diferença
+    para o esperado (valor inicial + vendas e quitações em dinheiro) fica
+    registrada.
+    """
+    with transaction.atomic():
+        caixa = Caixa.objects.select_for_update().get(pk=caixa.pk)
+        if caixa.data_fechamento:
+            raise ValidationError("Este caixa já está fechado.")
+
+        caixa.valor_fechamento = valor_fechamento if valor_fechamento is not None else caixa.valor_fechamento
+        caixa.data_fechamento = timezone.now()
+        caixa.save(update_fields=['valor_fechamento', 'data_fechamento'])
+
+        totais = dict(caixa.totais.values_list('forma_pagamento', 'valor'))
+        quitado = dict(caixa.totais.values_list('forma_pagamento', 'quitado'))
+        fechamento = FechamentoCaixa(
+            caixa=caixa,
+            data_fechamento=caixa.data_fechamento,
+            valor_inicial=caixa.valor_inicial,
+            quantidade_itens=caixa.totais.aggregate(total=Sum('quantidade'))['total'] or 0,
+            total_quitado=sum(quitado.values(), Decimal('0.00')),
+            valor_fechamento=caixa.valor_fechamento,
+        )
+        for forma, campo in FechamentoCaixa.CAMPO_POR_FORMA.items():
+            setattr(fechamento, campo, totais.get(forma, 0))
+        fechamento.dinheiro_esperado = (
+            fechamento.valor_inicial + fechamento.total_dinheiro + quitado.get('dinheiro', 0)
+        )
+        if fechamento.valor_fechamento is not None:
+            fechamento.diferenca = fechamento.valor_fechamento - fechamento.dinheiro_esperado
+        fechamento.save()
+
+    return fechamento
@@ -0,0 +1,470 @@
+"""
+Carrinho aberto do PDV em memória, com gravação adiada.
+
+A bipagem não grava nada: o item entra no carrinho da sessão, guardado em
+memória do processo, e a quantidade fica reservada contra o estoque do
+catálogo (ver catalogo.py); sem saldo, as reservas vencidas de carrinhos
+abandonados são expiradas na hora (ver reservas.py). As bipagens pendentes
+vão para o banco de uma vez, pelo caminho de sempre
+(services.aplicar_bipagens), quando:
+
+- a venda é finalizada (Carrinhos.fechar);
+- passam PDV_CHECKPOINT_SEGUNDOS desde a primeira bipagem pendente;
+- o processo termina normalmente.
+
+Com PDV_CHECKPOINT_SEGUNDOS = 0 cada bipagem é gravada na hora, como
+antes. Como o hub de tempo_real, o carrinho vale para um processo só: com
+vários processos, cada um reserva apenas o que ele mesmo tem pendente. Uma
+queda do processo perde o que ainda não foi gravado, mas o diário do PDV
+reenvia essas bipagens (ver pendentes()).
+
+Quem grava a venda por fora (o daemon dos periféricos, outro processo)
+muda o valor_total no banco; o carrinho guarda o total que gravou por
+último e, quando ele não bate com o da venda, grava o que tem pendente e
+relê a venda.
+
+Da gravação final até a venda fechar, o carrinho não aceita bipagem: a
+que chegar nesse meio (de uma requisição que leu a sessão antes) volta
+com erro, em vez de ficar numa venda que já foi finalizada.
+"""
+import atexit
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections
+
+from .catalogo import buscar_produto, catalogo
+from .models import BipagemProcessada, PDVSession
+from .reservas import RESERVA_MINUTOS, disponibilidade, expirar_reservas
+from .services import aplicar_bipagens, finalizar_carrinho
+from .tempo_real import evento_item, evento_total, hub
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_SEGUNDOS = getattr(settings, 'PDV_CHECKPOINT_SEGUNDOS', 10)
+
+VAZIO = {"venda": None, "itens": [], "total": 0.0}
+
+VENDA_ALTERADA = "A venda foi finalizada ou relida durante a bipagem; bipe de novo."
+
+
+class CarrinhoAberto:
+    """Itens da venda em andamento de uma sessão, já somadas as bipagens pendentes."""
+
+    def __init__(self, sessao_id, venda_id, itens, valor_gravado=Decimal('0.00')):
+        self.sessao_id = sessao_id
+        self.venda_id = venda_id
+        # valor_total da venda no banco depois da última leitura ou gravação
+        self.valor_gravado = valor_gravado
+        # {produto_id: {"codigo_barras", "produto", "preco", "quantidade"}}
+        self.itens = itens
+        # [(codigo, quantidade, chave, produto_id)] ainda não gravadas
+        self.pendentes = []
+        self.chaves = set()
+        # Venda sendo finalizada ou já finalizada: não aceita mais bipagem
+        self.fechado = False
+        self.gravando = threading.Lock()
+        self.tocado_em = time.monotonic()
+
+    def parado(self):
+        """Sem bipagem há mais que o prazo da reserva: o banco pode ter expirado o carrinho."""
+        return not self.pendentes and time.monotonic() - self.tocado_em > RESERVA_MINUTOS * 60
+
+    @classmethod
+    def carregar(cls, session):
+        itens = {}
+        if session.venda_id:
+            for item in session.venda.itens.select_related('produto').order_by('pk'):
+                itens[item.produto_id] = {
+                    "codigo_barras": item.produto.codigo_barras,
+                    "produto": item.produto.nome,
+                    "preco": item.subtotal / item.quantidade,
+                    "quantidade": item.quantidade,
+                }
+            return cls(session.pk, session.venda_id, itens, session.venda.valor_total)
+        return cls(session.pk, session.venda_id, itens)
+
+    def total(self):
+        return sum((item["preco"] * item["quantidade"] for item in self.itens.values()), Decimal('0.00'))
+
+    def evento(self, produto_id):
+        item = self.itens[produto_id]
+        return evento_item(produto_id, item["codigo_barras"], item["produto"], item["quantidade"],
+                           item["preco"], item["preco"] * item["quantidade"])
+
+    def retrato(self):
+        """Mesmo formato de services.carrinho, para a tela do PDV."""
+        return {
+            "venda": self.venda_id,
+            "itens": [self.evento(pk)[1] for pk in self.itens],
+            "total": float(self.total()),
+        }
+
+
+class Carrinhos:
+    """Carrinhos abertos por sessão e o estoque que eles reservam, seguro entre threads."""
+
+    def __init__(self, checkpoint=CHECKPOINT_SEGUNDOS):
+        self.checkpoint = checkpoint
+        self._lock = threading.Lock()
+        self._carrinhos = {}
+        self._reservado = {}
+        self._timer = None
+
+    def _carrinho(self, session, erros=None):
+        """
+        Carrinho da venda da sessão, relido do banco quando preciso. As
+        bipagens pendentes de um carrinho substituído voltam em `erros`.
+        """
+        def mesma_venda(carrinho):
+            return carrinho is not None and carrinho.venda_id == session.venda_id
+
+        def atual(carrinho):
+            if not mesma_venda(carrinho):
+                return False
+            if carrinho.fechado:
+                # Sessão lida antes do fechamento: a bipagem é recusada
+                return True
+            if carrinho.parado():
+                return False
+            return carrinho.valor_gravado == session.venda.valor_total
+
+        with self._lock:
+            carrinho = self._carrinhos.get(session.pk)
+        if atual(carrinho):
+            return carrinho
+
+        relido = mesma_venda(carrinho)
+        if relido:
+            # A venda mudou no banco por fora: o pendente vai antes de reler
+            self.gravar(session.pk)
+            session.venda.refresh_from_db(fields=['valor_total'])
+
+        carregado = CarrinhoAberto.carregar(session)
+        with self._lock:
+            carrinho = self._carrinhos.get(session.pk)
+            if atual(carrinho):
+                return carrinho
+            perdidos = self._abandonar(carrinho) if carrinho is not None else []
+            carrinho = self._carrinhos[session.pk] = carregado
+            retrato = carrinho.retrato()
+        if perdidos:
+            logger.warning("Carrinho da sessão %s substituído com %s bipagem(ns) pendente(s)", session.pk, len(perdidos))
+            if erros is not None:
+                erros.extend(perdidos)
+        if relido:
+            hub.publicar(session.pk, [('carrinho', retrato)])
+        return carrinho
+
+    def _abandonar(self, carrinho):
+        """
+        Tira do ar um carrinho que vai ser substituído, liberando a reserva
+        do que ele ainda tinha pendente. Chamado com o lock; devolve as
+        pendentes como erros.
+        """
+        carrinho.fechado = True
+        pendentes, carrinho.pendentes = carrinho.pendentes, []
+        self._liberar(pendentes)
+        return [{"codigo": codigo, "erro": VENDA_ALTERADA} for codigo, _, _, _ in pendentes]
+
+    def _liberar(self, pendentes):
+        """Devolve ao disponível o reservado pelas bipagens; chamado com o lock."""
+        for _, quantidade, _, pk in pendentes:
+            restante = self._reservado.get(pk, 0) - quantidade
+            if restante > 0:
+                self._reservado[pk] = restante
+            else:
+                self._reservado.pop(pk, None)
+
+    def reservado(self, produto_id):
+        with self._lock:
+            return self._reservado.get(produto_id, 0)
+
+    def retrato(self, session):
+        if not session.venda_id:
+            return dict(VAZIO)
+        carrinho = self._carrinho(session)
+        with self._lock:
+            return carrinho.retrato()
+
+    def total(self, session):
+        if not session.venda_id:
+            return Decimal('0.00')
+        carrinho = self._carrinho(session)
+        with self._lock:
+            return carrinho.total()
+
+    def bipar(self, session, bipagens, eventos=None):
+        """
+        Aplica bipagens (codigo, quantidade, chave) ao carrinho em memória.
+
+        Confere o estoque do catálogo menos o que já está reservado; o que
+        passa fica reservado até ser gravado. Chaves já vistas (em memória
+        ou no banco) são puladas. Devolve (erros, repetidas), como
+        services.aplicar_bipagens.
+        """
+        erros = []
+        carrinho = self._carrinho(session, erros)
+
+        chaves = {chave for _, _, chave in bipagens if chave}
+        with self._lock:
+            chaves -= carrinho.chaves
+        gravadas = set(BipagemProcessada.objects.filter(chave__in=chaves).values_list('chave', flat=True)) if chaves else set()
+
+        pedidos = {}
+        repetidas = 0
+        with self._lock:
+            vistas = set(carrinho.chaves) | gravadas
+            for codigo, quantidade, chave in bipagens:
+                if chave and chave in vistas:
+                    repetidas += 1
+                    continue
+                if chave:
+                    vistas.add(chave)
+                pedidos.setdefault(codigo, []).append((quantidade, chave))
+
+        produtos = {}
+        for codigo, linhas in list(pedidos.items()):
+            if any(quantidade <= 0 for quantidade, _ in linhas):
+                erros.append({"codigo": codigo, "erro": "Quantidade inválida"})
+                del pedidos[codigo]
+                continue
+            produto = buscar_produto(codigo)
+            if produto is None:
+                erros.append({"codigo": codigo, "erro": "Produto não encontrado"})
+                del pedidos[codigo]
+                continue
+            produtos[codigo] = produto
+
+        alterados = []
+        with self._lock:
+            faltando = self._reservar(carrinho, pedidos, produtos, alterados)
+
+        if faltando:
+            # Estoque preso em carrinho abandonado volta antes da recusa
+            ids = {codigo: produtos[codigo]['id'] for codigo in faltando}
+            saldo = disponibilidade(ids.values())
+            with self._lock:
+                recuperar = [
+                    pk for codigo, pk in ids.items()
+                    if saldo.get(pk, 0) - self._reservado.get(pk, 0) >= sum(qtd for qtd, _ in pedidos[codigo])
+                ]
+            if recuperar and expirar_reservas(produtos=recuperar, exceto_venda=session.venda_id):
+                for pk in recuperar:
+                    catalogo.invalidar(pk)
+                for codigo in faltando:
+                    produtos[codigo] = buscar_produto(codigo) or produtos[codigo]
+                with self._lock:
+                    faltando = self._reservar(carrinho, pedidos, produtos, alterados)
+
+        with self._lock:
+            for codigo, disponivel in faltando.items():
+                erros.append({
+                    "codigo": codigo,
+                    "erro": f"Estoque insuficiente para {produtos[codigo]['nome']}. Disponível: {max(disponivel, 0)}",
+                })
+            # O que sobrou sem falta de estoque não entrou porque o carrinho fechou
+            erros.extend({"codigo": codigo, "erro": VENDA_ALTERADA} for codigo in pedidos if codigo not in faltando)
+
+            deltas = [carrinho.evento(pk) for pk in alterados]
+            if deltas:
+                deltas.append(evento_total(carrinho.total()))
+                if self.checkpoint:
+                    self._agendar()
+
+        if eventos is not None:
+            eventos.extend(deltas)
+        if deltas:
+            hub.publicar(session.pk, deltas)
+            if not self.checkpoint:
+                erros.extend(self.gravar(session.pk))
+                if carrinho.valor_gravado is not None:
+                    # A venda da requisição fica com o total que acabamos de gravar
+                    session.venda.valor_total = carrinho.valor_gravado
+        return erros, repetidas
+
+    def pendentes(self, session, chaves):
+        """
+        Das `chaves` de bipagem, as que o carrinho aceitou mas o banco ainda
+        não confirmou. O diário do PDV as guarda até a próxima resposta
+        dizer que foram gravadas.
+        """
+        with self._lock:
+            carrinho = self._carrinhos.get(session.pk)
+            aceitas = [chave for chave in chaves if chave and carrinho is not None and chave in carrinho.chaves]
+        if not aceitas:
+            return []
+        gravadas = set(BipagemProcessada.objects.filter(chave__in=aceitas).values_list('chave', flat=True))
+        return [chave for chave in aceitas if chave not in gravadas]
+
+    def _reservar(self, carrinho, pedidos, produtos, alterados):
+        """
+        Põe no carrinho os pedidos {codigo: [(quantidade, chave)]} que cabem
+        no estoque do catálogo menos o reservado. Chamado com o lock; devolve
+        {codigo: disponivel} dos que não couberam (e os mantém em `pedidos`).
+        Carrinho fechado ou já substituído não recebe nada.
+        """
+        faltando = {}
+        if carrinho.fechado or self._carrinhos.get(carrinho.sessao_id) is not carrinho:
+            return faltando
+        for codigo, linhas in list(pedidos.items()):
+            produto = produtos[codigo]
+            pk = produto['id']
+            quantidade = sum(qtd for qtd, _ in linhas)
+            disponivel = produto['estoque'] - self._reservado.get(pk, 0)
+            if quantidade > disponivel:
+                faltando[codigo] = disponivel
+                continue
+
+            del pedidos[codigo]
+            carrinho.tocado_em = time.monotonic()
+            self._reservado[pk] = self._reservado.get(pk, 0) + quantidade
+            item = carrinho.itens.setdefault(pk, {
+                "codigo_barras": codigo,
+                "produto": produto['nome'],
+                "quantidade": 0,
+            })
+            item["preco"] = produto['preco']
+            item["quantidade"] += quantidade
+            carrinho.pendentes.extend((codigo, qtd, chave, pk) for qtd, chave in linhas)
+            carrinho.chaves.update(chave for _, chave in linhas if chave)
+            if pk not in alterados:
+                alterados.append(pk)
+        return faltando
+
+    def gravar(self, sessao_id):
+        """
+        Leva ao banco as bipagens pendentes da sessão e libera a reserva
+        delas. Devolve os erros das que o banco recusou (estoque vendido
+        por outro caminho, por exemplo); nesse caso o carrinho é relido do
+        banco e a tela recebe o carrinho inteiro de novo.
+        """
+        with self._lock:
+            carrinho = self._carrinhos.get(sessao_id)
+        if carrinho is None:
+            return []
+
+        with carrinho.gravando:
+            erros, session = self._gravar(carrinho)
+
+        if erros:
+            hub.publicar(sessao_id, [('carrinho', self.retrato(session))])
+        return erros
+
+    def _gravar(self, carrinho):
+        """Corpo de gravar, chamado com carrinho.gravando; devolve (erros, sessão relida)."""
+        with self._lock:
+            pendentes, carrinho.pendentes = carrinho.pendentes, []
+        if not pendentes:
+            return [], None
+
+        try:
+            session = PDVSession.objects.select_related('venda').get(pk=carrinho.sessao_id)
+            outra_venda = session.venda_id != carrinho.venda_id
+            if outra_venda:
+                # A venda fechou (ou foi trocada) depois da bipagem: não há onde gravar
+                erros = [{"codigo": codigo, "erro": VENDA_ALTERADA} for codigo, _, _, _ in pendentes]
+            else:
+                antes = session.venda.valor_total
+                # A tela já mostra o carrinho em memória, que pode estar à frente do banco
+                linhas = [(codigo, qtd, chave) for codigo, qtd, chave, _ in pendentes]
+                erros, _ = aplicar_bipagens(session, linhas, publicar=False)
+        except Exception:
+            with self._lock:
+                carrinho.pendentes[:0] = pendentes
+            raise
+
+        with self._lock:
+            self._liberar(pendentes)
+            if outra_venda:
+                # Fica guardado, fechado: quem ainda tem a venda antiga é recusado
+                carrinho.fechado = True
+            elif antes == carrinho.valor_gravado:
+                carrinho.valor_gravado = session.venda.valor_total
+            else:
+                # Alguém gravou na venda antes de nós: relê na próxima bipagem
+                carrinho.valor_gravado = None
+            if erros and not outra_venda:
+                self._descartar(carrinho)
+        return erros, session
+
+    def gravar_todos(self):
+        with self._lock:
+            sessoes = [pk for pk, carrinho in self._carrinhos.items() if carrinho.pendentes]
+        for sessao_id in sessoes:
+            try:
+                self.gravar(sessao_id)
+            except Exception:
+                logger.exception("Falha ao gravar o carrinho da sessão %s", sessao_id)
+
+    def fechar(self, session, forma_pagamento, valor_pago=None, cliente=None):
+        """
+        Grava o carrinho e finaliza a venda da sessão (services.finalizar_carrinho).
+
+        O carrinho fica fechado da gravação em diante e continua guardado:
+        requisições que ainda têm a sessão com a venda antiga caem nele e
+        têm a bipagem recusada. Se a venda não fechar, ele reabre.
+        """
+        if not session.venda_id:
+            return finalizar_carrinho(session, forma_pagamento, valor_pago, cliente)
+
+        carrinho = self._carrinho(session)
+        venda = None
+        with carrinho.gravando:
+            with self._lock:
+                # Um segundo fechamento da mesma venda não pode reabri-la
+                reabrir, carrinho.fechado = not carrinho.fechado, True
+            try:
+                erros, _ = self._gravar(carrinho)
+                if not erros:
+                    session.refresh_from_db()
+                    venda = finalizar_carrinho(session, forma_pagamento, valor_pago, cliente)
+            finally:
+                if venda is None and reabrir:
+                    with self._lock:
+                        carrinho.fechado = False
+
+        if erros:
+            hub.publicar(session.pk, [('carrinho', self.retrato(session))])
+            raise ValidationError([erro["erro"] for erro in erros])
+        hub.publicar(session.pk, [('carrinho', dict(VAZIO))])
+        return venda
+
+    def _descartar(self, carrinho):
+        if self._carrinhos.get(carrinho.sessao_id) is carrinho:
+            del self._carrinhos[carrinho.sessao_id]
+
+    def _agendar(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.checkpoint, self._no_checkpoint)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _no_checkpoint(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.gravar_todos()
+        finally:
+            close_old_connections()
+        with self._lock:
+            if any(carrinho.pendentes for carrinho in self._carrinhos.values()):
+                self._agendar()
+
+    def limpar(self):
+        """Esquece carrinhos e reservas sem gravar nada (testes)."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._carrinhos.clear()
+            self._reservado.clear()
+
+
+carrinhos = Carrinhos()
+
+atexit.register(carrinhos.gravar_todos)
@@ -0,0 +1,113 @@
+"""
+Cache do catálogo por código de barras.
+
+Guarda, em memória do processo, um retrato do produto (id, nome, preço,
+categoria e estoque) para que a bipagem não precise ir ao banco. As
+entradas são descartadas pelos sinais de Produto (ver signals.py) e o
+estoque é ajustado pelo motor de estoque a cada baixa/devolução.
+
+Os sinais só alcançam o processo que gravou o produto: nos demais (outros
+workers, o daemon dos periféricos) a entrada vale por no máximo
+CATALOGO_CACHE_SEGUNDOS e depois é relida do banco.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Produto
+
+LIMITE_PADRAO = 5000
+
+VALIDADE_PADRAO = 60
+
+CAMPOS = ('id', 'nome', 'preco', 'categoria', 'estoque')
+
+
+class CatalogoCache:
+    """LRU de produtos por código de barras, seguro entre threads."""
+
+    def __init__(self, limite=LIMITE_PADRAO, validade=VALIDADE_PADRAO):
+        self.limite = limite
+        # Segundos até reler do banco; 0 desliga o cache, None não expira
+        self.validade = validade
+        # {codigo: (produto, guardado_em)}
+        self._itens = OrderedDict()
+        self._codigo_por_id = {}
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def buscar(self, codigo):
+        """Devolve uma cópia do produto com o código, ou None se não existir."""
+        if not codigo:
+            return None
+
+        with self._lock:
+            entrada = self._itens.get(codigo)
+            if entrada is not None and self._valida(entrada):
+                self._itens.move_to_end(codigo)
+                self.acertos += 1
+                return dict(entrada[0])
+            self.falhas += 1
+
+        produto = Produto.objects.filter(codigo_barras=codigo).values(*CAMPOS).first()
+        if produto is None:
+            return None
+
+        with self._lock:
+            self._guardar(codigo, produto)
+        return dict(produto)
+
+    def _valida(self, entrada):
+        return self.validade is None or time.monotonic() - entrada[1] < self.validade
+
+    def _guardar(self, codigo, produto):
+        self._itens[codigo] = (produto, time.monotonic())
+        self._itens.move_to_end(codigo)
+        self._codigo_por_id[produto['id']] = codigo
+        while len(self._itens) > self.limite:
+            _, (antigo, _) = self._itens.popitem(last=False)
+            self._codigo_por_id.pop(antigo['id'], None)
+
+    def invalidar(self, produto_id):
+        """Descarta o produto, seja qual for o código com que foi guardado."""
+        with self._lock:
+            codigo = self._codigo_por_id.pop(produto_id, None)
+            if codigo is not None:
+                self._itens.pop(codigo, None)
+
+    def ajustar_estoque(self, deltas):
+        """Aplica {produto_id: delta} ao estoque dos produtos em cache."""
+        with self._lock:
+            for produto_id, delta in deltas.items():
+                codigo = self._codigo_por_id.get(produto_id)
+                if codigo is not None:
+                    self._itens[codigo][0]['estoque'] += delta
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._codigo_por_id.clear()
+            self.acertos = 0
+            self.falhas = 0
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'itens': len(self._itens),
+                'limite': self.limite,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+            }
+
+
+catalogo = CatalogoCache(
+    getattr(settings, 'CATALOGO_CACHE_LIMITE', LIMITE_PADRAO),
+    getattr(settings, 'CATALOGO_CACHE_SEGUNDOS', VALIDADE_PADRAO),
+)
+
+
+def buscar_produto(codigo):
+    return catalogo.buscar(codigo)
@@ -0,0 +1,130 @@
+"""
+Contadores por cliente.
+
+Cliente guarda, em colunas próprias, o total de itens e o valor já
+comprados, a data da última compra e o saldo em aberto. Os totais de
+compra andam por deltas junto com os resumos de vendas (ver
+resumo.registrar_venda); o saldo é refeito com um UPDATE por subconsulta
+sempre que o saldo de uma venda do cliente muda.
+"""
+from decimal import Decimal
+
+from django.db.models import DecimalField, F, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Cliente, ItemVenda, Venda
+
+_ZERO = Value(Decimal('0.00'), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def registrar_compra(cliente_id, quantidade, valor, momento):
+    """
+    Soma itens/valor comprados ao cliente. Compras novas só avançam
+    ultima_compra; estornos a buscam de novo nas vendas que sobraram.
+    """
+    campos = {
+        'total_itens': F('total_itens') + quantidade,
+        'total_comprado': F('total_comprado') + valor,
+    }
+    if quantidade > 0:
+        campos['ultima_compra'] = Greatest(Coalesce(F('ultima_compra'), Value(momento)), Value(momento))
+    elif quantidade < 0:
+        campos['ultima_compra'] = _ultima_compra()
+    Cliente.objects.filter(pk=cliente_id).update(**campos)
+
+
+def _ultima_compra():
+    return Subquery(
+        Venda.objects
+        .filter(cliente=OuterRef('pk'), itens__isnull=False)
+        .order_by()
+        .values('cliente')
+        .annotate(ultima=Max('data_venda'))
+        .values('ultima')
+    )
+
+
+def _saldo_aberto():
+    return Coalesce(
+        Subquery(
+            Venda.objects
+            .filter(cliente=OuterRef('pk'), pago=False)
+            .order_by()
+            .values('cliente')
+            .annotate(total=Sum('saldo_devedor'))
+            .values('total')
+        ),
+        _ZERO,
+    )
+
+
+def atualizar_saldo_aberto(clientes):
+    """
+    Refaz saldo_aberto dos clientes informados (ids ou uma subconsulta de
+    ids) a partir das vendas não pagas, num único UPDATE.
+    """
+    if isinstance(clientes, (list, tuple, set)):
+        clientes = [pk for pk in clientes if pk is not None]
+        if not clientes:
+            return
+    Cliente.objects.filter(pk__in=clientes).update(saldo_aberto=_saldo_aberto())
+
+
+def recalcular_contadores(clientes=None):
+    """Recalcula do zero todos os contadores (de todos os clientes, se não informados)."""
+    itens = ItemVenda.objects.filter(venda__cliente=OuterRef('pk')).order_by().values('venda__cliente')
+    queryset = Cliente.objects.all()
+    if clientes is not None:
+        queryset = queryset.filter(pk__in=clientes)
+    return queryset.update(
+        total_itens=Coalesce(
+            Subquery(itens.annotate(total=Sum('quantidade')).values('total')),
+            Value(0), output_field=IntegerField(),
+        ),
+        total_comprado=Coalesce(Subquery(itens.annotate(total=Sum('subtotal')).values('total')), _ZERO),
+        ultima_compra=_ultima_compra(),
+        saldo_aberto=_saldo_aberto(),
+    )
+
+
+def contadores_divergentes():
+    """Clientes cujos contadores não batem com as vendas: [(cliente, {campo: (gravado, calculado)})]."""
+    gravados = {
+        c.pk: c for c in Cliente.objects.only('nome', 'total_itens', 'total_comprado', 'ultima_compra', 'saldo_aberto')
+    }
+    calculados = {
+        linha['venda__cliente']: linha
+        for linha in (
+            ItemVenda.objects
+            .filter(venda__cliente__isnull=False)
+            .values('venda__cliente')
+            .annotate(total_itens=Sum('quantidade'), total_comprado=Sum('subtotal'), ultima_compra=Max('venda__data_venda'))
+            .order_by()
+        )
+    }
+    saldos = dict(
+        Venda.objects
+        .filter(cliente__isnull=False, pago=False)
+        .values('cliente')
+        .annotate(total=Sum('saldo_devedor'))
+        .order_by()
+        .values_list('cliente', 'total')
+    )
+
+    divergentes = []
+    for pk, cliente in gravados.items():
+        calculado = calculados.get(pk, {})
+        esperado = {
+            'total_itens': calculado.get('total_itens') or 0,
+            'total_comprado': calculado.get('total_comprado') or Decimal('0.00'),
+            'ultima_compra': calculado.get('ultima_compra'),
+            'saldo_aberto': saldos.get(pk) or Decimal('0.00'),
+        }
+        diferencas = {
+            campo: (getattr(cliente, campo), valor)
+            for campo, valor in esperado.items()
+            if getattr(cliente, campo) != valor
+        }
+        if diferencas:
+            divergentes.append((cliente, diferencas))
+    return divergentes
@@ -0,0 +1,139 @@
+"""
+Motor de estoque.
+
+Toda baixa e devolução de estoque passa por aqui. As operações são feitas
+direto no banco com UPDATE condicional (estoque >= quantidade), sem carregar
+a instância de Produto e sem gerar linha no HistoricalProduto. Cada
+movimento fica registrado no MovimentoEstoque, na mesma transação. O
+estoque guardado no cache do catálogo é ajustado quando a transação
+confirma.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .catalogo import catalogo
+from .models import MovimentoEstoque, Produto
+
+# Quantas vezes a baixa é refeita quando outro terminal mexe no mesmo
+# produto entre o UPDATE e a conferência das falhas.
+TENTATIVAS_BAIXA = 3
+
+
+class EstoqueInsuficiente(ValidationError):
+    """Baixa recusada; `falhas` traz (produto_id, solicitado, disponivel)."""
+
+    def __init__(self, falhas, nomes=None):
+        nomes = nomes or {}
+        self.falhas = falhas
+        super().__init__([
+            f"Estoque insuficiente para {nomes.get(produto_id, produto_id)}. Disponível: {disponivel}"
+            for produto_id, _, disponivel in falhas
+        ])
+
+
+def agrupar_linhas(linhas):
+    """Soma as quantidades por produto: [(produto_id, qtd), ...] -> {produto_id: qtd}."""
+    quantidades = {}
+    for produto_id, quantidade in linhas:
+        if not quantidade:
+            continue
+        quantidades[produto_id] = quantidades.get(produto_id, 0) + quantidade
+    return quantidades
+
+
+def _quantidade_por_produto(quantidades):
+    return Case(
+        *[When(pk=produto_id, then=Value(qtd)) for produto_id, qtd in quantidades.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _conferir_falhas(quantidades):
+    disponivel = dict(
+        Produto.objects
+        .filter(pk__in=quantidades)
+        .values_list('pk', 'estoque')
+    )
+    return [
+        (produto_id, qtd, disponivel.get(produto_id, 0))
+        for produto_id, qtd in quantidades.items()
+        if disponivel.get(produto_id, 0) < qtd
+    ]
+
+
+def registrar_movimentos(movimentos, motivo, venda_id=None):
+    """
+    Grava no livro de estoque os movimentos (produto_id, delta, item_id).
+
+    Delta negativo é saída. Chamado pelo próprio motor ou, quando o item
+    ainda não existia na hora da baixa, por quem acabou de criá-lo.
+    """
+    MovimentoEstoque.objects.bulk_create([
+        MovimentoEstoque(produto_id=produto_id, quantidade=delta, motivo=motivo,
+                         venda_id=venda_id, item_id=item_id)
+        for produto_id, delta, item_id in movimentos
+        if delta
+    ])
+
+
+def baixar_estoque(linhas, motivo=MovimentoEstoque.VENDA, venda_id=None, item_id=None):
+    """
+    Baixa o estoque de todas as linhas de uma venda num único UPDATE.
+
+    A baixa é tudo-ou-nada: se algum produto não tiver saldo, nada é
+    alterado. Devolve a lista de falhas como (produto_id, solicitado,
+    disponivel); lista vazia significa que a baixa foi feita.
+
+    A baixa vai para o livro com `motivo`, `venda_id` e `item_id`. Com
+    `motivo=None` o livro fica a cargo de quem chamou (registrar_movimentos),
+    para quando os itens só passam a existir depois da baixa.
+    """
+    quantidades = agrupar_linhas(linhas)
+    if not quantidades:
+        return []
+
+    qtd = _quantidade_por_produto(quantidades)
+
+    for _ in range(TENTATIVAS_BAIXA):
+        with transaction.atomic():
+            alterados = (
+                Produto.objects
+                .filter(pk__in=quantidades, estoque__gte=qtd)
+                .update(estoque=F('estoque') - qtd)
+            )
+            if alterados == len(quantidades):
+                baixas = {produto_id: -qtd for produto_id, qtd in quantidades.items()}
+                if motivo is not None:
+                    registrar_movimentos(
+                        [(produto_id, delta, item_id) for produto_id, delta in baixas.items()],
+                        motivo, venda_id,
+                    )
+                transaction.on_commit(lambda: catalogo.ajustar_estoque(baixas))
+                return []
+            transaction.set_rollback(True)
+
+        falhas = _conferir_falhas(quantidades)
+        if falhas:
+            return falhas
+
+    return _conferir_falhas(quantidades) or [
+        (produto_id, qtd, None) for produto_id, qtd in quantidades.items()
+    ]
+
+
+def devolver_estoque(linhas, motivo=MovimentoEstoque.DEVOLUCAO, venda_id=None, item_id=None):
+    """Devolve ao estoque as quantidades das linhas num único UPDATE."""
+    quantidades = agrupar_linhas(linhas)
+    if not quantidades:
+        return
+
+    Produto.objects.filter(pk__in=quantidades).update(
+        estoque=F('estoque') + _quantidade_por_produto(quantidades)
+    )
+    if motivo is not None:
+        registrar_movimentos(
+            [(produto_id, qtd, item_id) for produto_id, qtd in quantidades.items()],
+            motivo, venda_id,
+        )
+    transaction.on_commit(lambda: catalogo.ajustar_estoque(quantidades))
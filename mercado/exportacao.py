@@ -0,0 +1,93 @@
+"""
+Exportação de vendas (Venda + ItemVenda + Cliente + Produto) para a
+contabilidade, em CSV ou XLSX.
+
+As linhas vêm do banco em blocos (`iterator`) e são escritas à medida
+que chegam, então a memória não cresce com o período exportado. O valor
+de cada item é o subtotal gravado na venda, não o preço atual do produto.
+"""
+import csv
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .models import Venda
+
+TAMANHO_BLOCO = 2000
+
+CENTAVO = Decimal('0.01')
+
+FORMATOS = ('csv', 'xlsx')
+
+CABECALHO = (
+    'venda', 'data', 'cliente', 'forma_pagamento', 'pago', 'valor_total',
+    'saldo_devedor', 'produto', 'codigo_barras', 'categoria', 'quantidade',
+    'preco_unitario', 'subtotal',
+)
+
+
+def linhas_vendas(inicio, fim, tamanho_bloco=TAMANHO_BLOCO):
+    """Uma linha por item das vendas em [inicio, fim); venda sem itens sai numa linha só."""
+    linhas = (
+        Venda.objects
+        .filter(data_venda__gte=inicio, data_venda__lt=fim)
+        .order_by('data_venda', 'pk', 'itens__pk')
+        .values_list(
+            'pk', 'data_venda', 'cliente__nome', 'forma_pagamento', 'pago',
+            'valor_total', 'saldo_devedor', 'itens__produto__nome',
+            'itens__produto__codigo_barras', 'itens__produto__categoria',
+            'itens__quantidade', 'itens__subtotal',
+        )
+        .iterator(chunk_size=tamanho_bloco)
+    )
+    for (pk, data_venda, cliente, forma_pagamento, pago, valor_total, saldo_devedor,
+         produto, codigo_barras, categoria, quantidade, subtotal) in linhas:
+        preco_unitario = (subtotal / quantidade).quantize(CENTAVO) if quantidade else None
+        yield (
+            pk,
+            timezone.localtime(data_venda).replace(tzinfo=None, microsecond=0),
+            cliente or '',
+            forma_pagamento,
+            pago,
+            valor_total,
+            saldo_devedor,
+            produto or '',
+            codigo_barras or '',
+            categoria or '',
+            quantidade,
+            preco_unitario,
+            subtotal,
+        )
+
+
+class _Eco:
+    """Arquivo falso para o csv.writer: devolve a linha em vez de guardar."""
+
+    def write(self, valor):
+        return valor
+
+
+def csv_em_fluxo(linhas):
+    """Gera o CSV linha a linha, pronto para um StreamingHttpResponse."""
+    escritor = csv.writer(_Eco())
+    yield '\ufeff'  # BOM para o Excel abrir com acentos
+    yield escritor.writerow(CABECALHO)
+    for linha in linhas:
+        yield escritor.writerow(['' if valor is None else valor for valor in linha])
+
+
+def escrever_csv(linhas, arquivo):
+    for parte in csv_em_fluxo(linhas):
+        arquivo.write(parte)
+
+
+def escrever_xlsx(linhas, arquivo):
+    """Grava a planilha em `arquivo` (caminho ou arquivo binário) no modo write-only."""
+    from openpyxl import Workbook
+
+    planilha = Workbook(write_only=True)
+    aba = planilha.create_sheet('Vendas')
+    aba.append(CABECALHO)
+    for linha in linhas:
+        aba.append(linha)
+    planilha.save(arquivo)
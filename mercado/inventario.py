@@ -0,0 +1,152 @@
+"""
+Estoque em qualquer momento do passado.
+
+O estoque de um produto é a soma do seu MovimentoEstoque. Para não somar
+o livro inteiro, o comando saldos_estoque grava um SaldoEstoque (estoque
+no fim do dia) para cada produto que mudou naquele dia. A posição num
+momento é o último saldo antes dele mais os movimentos desde então, que
+nunca passam de alguns dias (ou de um mês, na parte compactada).
+
+Todo dia já fotografado tem saldo de todo produto que mudou nele, então o
+último saldo de cada produto até esse dia é o estoque no fim do dia.
+"""
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import Exists, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import MovimentoEstoque, SaldoEstoque
+from .relatorios import intervalo_do_dia
+
+# Saldos mais novos que isso ficam diários; os mais antigos, um por mês
+DIAS_DIARIOS = 90
+
+
+def _ultimos_saldos(ate, produtos=None):
+    """{produto_id: estoque} do último saldo de cada produto até o dia `ate`."""
+    ultimo_dia = (
+        SaldoEstoque.objects
+        .filter(produto=OuterRef('produto'), dia__lte=ate)
+        .order_by('-dia')
+        .values('dia')[:1]
+    )
+    saldos = SaldoEstoque.objects.filter(dia=Subquery(ultimo_dia))
+    if produtos is not None:
+        saldos = saldos.filter(produto__in=produtos)
+    return dict(saldos.values_list('produto_id', 'estoque'))
+
+
+def _somar_movimentos(movimentos, saldos):
+    for produto_id, total in (
+        movimentos
+        .values('produto')
+        .annotate(total=Sum('quantidade'))
+        .order_by()
+        .values_list('produto', 'total')
+    ):
+        saldos[produto_id] = saldos.get(produto_id, 0) + total
+    return saldos
+
+
+def estoque_em(momento, produtos=None):
+    """
+    Estoque {produto_id: quantidade} no instante `momento`, de todo o
+    catálogo ou só dos `produtos` (ids). Produto sem saldo nem movimento
+    até lá fica de fora (estoque zero).
+    """
+    base = (
+        SaldoEstoque.objects
+        .filter(dia__lt=timezone.localdate(momento))
+        .aggregate(dia=Max('dia'))['dia']
+    )
+    movimentos = MovimentoEstoque.objects.filter(data__lt=momento)
+    if produtos is not None:
+        movimentos = movimentos.filter(produto__in=produtos)
+
+    saldos = {}
+    if base is not None:
+        saldos = _ultimos_saldos(base, produtos)
+        movimentos = movimentos.filter(data__gte=intervalo_do_dia(base)[1])
+    return _somar_movimentos(movimentos, saldos)
+
+
+def ultimo_dia_fotografado():
+    return SaldoEstoque.objects.aggregate(dia=Max('dia'))['dia']
+
+
+def fotografar_dia(dia):
+    """
+    Grava o saldo do fim do `dia` dos produtos que mudaram nele, a partir do
+    saldo anterior de cada um. Refazer o mesmo dia substitui os saldos.
+    Devolve quantos saldos foram gravados.
+    """
+    inicio, fim = intervalo_do_dia(dia)
+    deltas = _somar_movimentos(MovimentoEstoque.objects.filter(data__gte=inicio, data__lt=fim), {})
+    deltas = {produto_id: delta for produto_id, delta in deltas.items() if delta}
+
+    with transaction.atomic():
+        SaldoEstoque.objects.filter(dia=dia).delete()
+        if not deltas:
+            return 0
+        anteriores = _ultimos_saldos(dia - timedelta(days=1), list(deltas))
+        SaldoEstoque.objects.bulk_create([
+            SaldoEstoque(dia=dia, produto_id=produto_id, estoque=anteriores.get(produto_id, 0) + delta)
+            for produto_id, delta in deltas.items()
+        ], batch_size=1000)
+    return len(deltas)
+
+
+def fotografar_ate(ate):
+    """
+    Fotografa, em ordem, os dias seguintes ao último saldo gravado até
+    `ate` (ou, sem saldo nenhum, desde o primeiro movimento). Devolve
+    {dia: saldos gravados}.
+    """
+    ultimo = ultimo_dia_fotografado()
+    if ultimo is not None:
+        dia = ultimo + timedelta(days=1)
+    else:
+        primeiro = MovimentoEstoque.objects.aggregate(data=Min('data'))['data']
+        if primeiro is None:
+            return {}
+        dia = timezone.localdate(primeiro)
+
+    gravados = {}
+    while dia <= ate:
+        gravados[dia] = fotografar_dia(dia)
+        dia += timedelta(days=1)
+    return gravados
+
+
+def _fim_do_mes(dia):
+    proximo = date(dia.year + dia.month // 12, dia.month % 12 + 1, 1)
+    return proximo - timedelta(days=1)
+
+
+def compactar(antes_de):
+    """
+    Deixa um saldo por produto e mês (o do fim do mês) para os meses
+    inteiros antes de `antes_de`. Devolve quantos saldos foram apagados.
+    """
+    corte = antes_de.replace(day=1)
+    antigos = SaldoEstoque.objects.filter(dia__lt=corte)
+    mais_novo_no_mes = (
+        SaldoEstoque.objects
+        .annotate(mes=TruncMonth('dia'))
+        .filter(produto=OuterRef('produto'), dia__gt=OuterRef('dia'), dia__lt=corte, mes=OuterRef('mes'))
+    )
+
+    with transaction.atomic():
+        apagados, _ = (
+            antigos
+            .annotate(mes=TruncMonth('dia'))
+            .filter(Exists(mais_novo_no_mes))
+            .delete()
+        )
+        # O saldo que sobrou é o estoque no fim do mês; passa a ser desse dia
+        for mes in antigos.dates('dia', 'month'):
+            fim = _fim_do_mes(mes)
+            antigos.filter(dia__gte=mes, dia__lt=fim).update(dia=fim)
+    return apagados
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from mercado.arquivo import LOTE, arquivar_historico_produtos, arquivar_log_admin
+
+
+class Command(BaseCommand):
+    help = (
+        "Move o histórico de produtos e o log do admin mais antigos para um arquivo SQLite "
+        "à parte, deixando no banco só a contagem mensal (ResumoHistorico)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=365, help="Mantém no banco os últimos N dias (padrão 365).")
+        parser.add_argument(
+            '--arquivo',
+            default=getattr(settings, 'HISTORICO_ARQUIVO', settings.BASE_DIR / 'historico_arquivado.sqlite3'),
+            help="Arquivo SQLite que recebe as linhas arquivadas.",
+        )
+        parser.add_argument('--lote', type=int, default=LOTE, help=f"Linhas por lote (padrão {LOTE}).")
+        parser.add_argument('--vacuum', action='store_true', help="No SQLite, devolve ao disco o espaço liberado.")
+
+    def handle(self, *args, **options):
+        if options['dias'] < 1 or options['lote'] < 1:
+            raise CommandError("--dias e --lote precisam ser positivos.")
+
+        antes_de = timezone.now() - timedelta(days=options['dias'])
+        arquivo = str(options['arquivo'])
+
+        produtos = arquivar_historico_produtos(antes_de, arquivo, options['lote'])
+        self.stdout.write(f"Histórico de produtos: {produtos} linha(s) arquivada(s).")
+        log = arquivar_log_admin(antes_de, arquivo, options['lote'])
+        self.stdout.write(f"Log do admin: {log} linha(s) arquivada(s).")
+
+        if options['vacuum'] and connection.vendor == 'sqlite' and (produtos or log):
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+
+        self.stdout.write(self.style.SUCCESS(f"Arquivo: {arquivo}"))
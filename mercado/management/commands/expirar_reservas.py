@@ -0,0 +1,49 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from mercado.reservas import LOTE, expirar_reservas
+from mercado.services import DIAS_BIPAGENS, esquecer_bipagens
+
+
+class Command(BaseCommand):
+    help = (
+        "Expira as reservas de estoque vencidas dos carrinhos do PDV: os itens saem da venda "
+        "em andamento e o estoque volta. Também apaga as chaves de bipagem antigas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=LOTE, help=f"Reservas por transação (padrão {LOTE}).")
+        parser.add_argument(
+            '--intervalo', type=float, default=0,
+            help="Repete a cada N segundos até ser interrompido (padrão: roda uma vez).",
+        )
+        parser.add_argument(
+            '--dias-bipagens', type=int, default=DIAS_BIPAGENS,
+            help=f"Mantém as chaves de bipagem dos últimos N dias (padrão {DIAS_BIPAGENS}).",
+        )
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1 or options['intervalo'] < 0 or options['dias_bipagens'] < 1:
+            raise CommandError(
+                "--lote e --dias-bipagens precisam ser positivos e --intervalo não pode ser negativo."
+            )
+
+        while True:
+            expiradas = expirar_reservas(lote=options['lote'])
+            if expiradas or not options['intervalo']:
+                self.stdout.write(f"{expiradas} reserva(s) expirada(s).")
+            corte = timezone.now() - timedelta(days=options['dias_bipagens'])
+            esquecidas = esquecer_bipagens(corte, lote=options['lote'])
+            if esquecidas or not options['intervalo']:
+                self.stdout.write(f"{esquecidas} chave(s) de bipagem apagada(s).")
+            if not options['intervalo']:
+                break
+            close_old_connections()
+            try:
+                time.sleep(options['intervalo'])
+            except KeyboardInterrupt:
+                break
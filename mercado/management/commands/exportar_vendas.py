@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mercado.exportacao import FORMATOS, escrever_csv, escrever_xlsx, linhas_vendas
+from mercado.relatorios import ler_limite
+
+
+class Command(BaseCommand):
+    help = "Exporta vendas e itens de um período em CSV ou XLSX."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--de', required=True, help="Primeiro dia (AAAA-MM-DD) ou data e hora ISO.")
+        parser.add_argument('--ate', required=True, help="Último dia, inclusive (AAAA-MM-DD) ou data e hora ISO.")
+        parser.add_argument('--formato', choices=FORMATOS, default='csv')
+        parser.add_argument('--saida', help="Arquivo de saída. Sem ele, o CSV vai para a saída padrão.")
+
+    def handle(self, *args, **options):
+        try:
+            inicio = ler_limite(options['de'])
+            fim = ler_limite(options['ate'], fim=True)
+        except ValueError as erro:
+            raise CommandError(f"Data inválida: {erro}")
+        if fim <= inicio:
+            raise CommandError("Período inválido.")
+
+        linhas = linhas_vendas(inicio, fim)
+        saida = options['saida']
+
+        if options['formato'] == 'xlsx':
+            if not saida:
+                raise CommandError("Informe --saida para exportar em XLSX.")
+            escrever_xlsx(linhas, saida)
+        elif saida:
+            with open(saida, 'w', newline='', encoding='utf-8') as arquivo:
+                escrever_csv(linhas, arquivo)
+        else:
+            escrever_csv(linhas, sys.stdout)
+            return
+
+        self.stdout.write(self.style.SUCCESS(f"Exportação gravada em {saida}."))
@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mercado.catalogo import catalogo
+from mercado.perifericos import INTERVALO_SPOOL, JANELA_REPETICAO, DaemonPerifericos, terminais
+
+
+class Command(BaseCommand):
+    help = "Liga os leitores de código de barras e as impressoras de cupom seriais dos terminais (PDV_TERMINAIS)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--terminal', action='append', help="Só este usuário de terminal (pode repetir).")
+        parser.add_argument(
+            '--janela', type=float, default=JANELA_REPETICAO,
+            help=f"Segundos em que a mesma leitura repetida é ignorada (padrão {JANELA_REPETICAO}).",
+        )
+        parser.add_argument(
+            '--intervalo-spool', type=float, default=INTERVALO_SPOOL,
+            help=f"Segundos entre consultas à fila de cupons (padrão {INTERVALO_SPOOL}).",
+        )
+
+    def handle(self, *args, **options):
+        configurados = terminais()
+        if options['terminal']:
+            faltando = set(options['terminal']) - set(configurados)
+            if faltando:
+                raise CommandError(f"Terminal fora de PDV_TERMINAIS: {', '.join(sorted(faltando))}")
+            configurados = {usuario: configurados[usuario] for usuario in options['terminal']}
+        if not configurados:
+            raise CommandError("Nenhum terminal configurado em PDV_TERMINAIS.")
+
+        saida = logging.StreamHandler(self.stdout)
+        saida.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        logger = logging.getLogger('mercado.perifericos')
+        logger.addHandler(saida)
+        logger.setLevel(logging.INFO)
+
+        # Alterações de preço e nome feitas no admin não chegam a este
+        # processo pelos sinais: cada leitura consulta o banco
+        catalogo.validade = 0
+
+        daemon = DaemonPerifericos(configurados, janela=options['janela'], intervalo_spool=options['intervalo_spool'])
+        asyncio.run(self.rodar(daemon))
+        self.stdout.write(self.style.SUCCESS("Periféricos desligados."))
+
+    async def rodar(self, daemon):
+        loop = asyncio.get_running_loop()
+        for sinal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sinal, daemon.parar)
+        await daemon.rodar()
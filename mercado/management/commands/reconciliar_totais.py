@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from mercado.clientes import contadores_divergentes, recalcular_contadores
+from mercado.models import Venda
+
+
+class Command(BaseCommand):
+    help = "Confere valor_total das vendas contra a soma dos itens (e os contadores dos clientes) e, opcionalmente, corrige."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corrigir', action='store_true',
+            help="Recalcula do zero as vendas divergentes.",
+        )
+        parser.add_argument(
+            '--clientes', action='store_true',
+            help="Confere também os contadores dos clientes (itens, valor, última compra e saldo).",
+        )
+
+    def handle(self, *args, **options):
+        divergentes = (
+            Venda.objects
+            .annotate(soma_itens=Coalesce(
+                Sum('itens__subtotal'),
+                Value(Decimal('0.00')),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ))
+            .exclude(valor_total=F('soma_itens'))
+            .order_by('pk')
+        )
+
+        encontradas = 0
+        for venda in divergentes:
+            encontradas += 1
+            self.stdout.write(
+                f"Venda #{venda.pk}: valor_total={venda.valor_total} soma dos itens={venda.soma_itens}"
+            )
+            if options['corrigir']:
+                venda.recalcular_totais()
+
+        if not encontradas:
+            self.stdout.write(self.style.SUCCESS("Nenhuma divergência encontrada."))
+        elif options['corrigir']:
+            self.stdout.write(self.style.SUCCESS(f"{encontradas} venda(s) recalculada(s)."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{encontradas} venda(s) divergente(s). Use --corrigir para recalcular."))
+
+        if options['clientes']:
+            self.conferir_clientes(options['corrigir'])
+
+    def conferir_clientes(self, corrigir):
+        divergentes = contadores_divergentes()
+        for cliente, diferencas in divergentes:
+            detalhes = ", ".join(
+                f"{campo}={gravado} calculado={calculado}"
+                for campo, (gravado, calculado) in diferencas.items()
+            )
+            self.stdout.write(f"Cliente #{cliente.pk} ({cliente.nome}): {detalhes}")
+
+        if not divergentes:
+            self.stdout.write(self.style.SUCCESS("Contadores dos clientes conferem."))
+        elif corrigir:
+            recalcular_contadores([cliente.pk for cliente, _ in divergentes])
+            self.stdout.write(self.style.SUCCESS(f"{len(divergentes)} cliente(s) recalculado(s)."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(divergentes)} cliente(s) divergente(s). Use --corrigir para recalcular."))
@@ -0,0 +1,118 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from mercado.models import ResumoVendaDia, ResumoVendaHora
+from mercado.resumo import calcular_a_partir_dos_itens, calcular_horas_a_partir_dos_itens
+
+
+class Command(BaseCommand):
+    help = "Reconstrói (backfill) e/ou confere os resumos de vendas a partir dos itens."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reconstruir', action='store_true', help="Apaga e recalcula os resumos.")
+        parser.add_argument('--verificar', action='store_true', help="Compara os resumos com os itens.")
+        parser.add_argument('--desde', help="Limita ao período a partir desta data (AAAA-MM-DD).")
+
+    def handle(self, *args, **options):
+        if not (options['reconstruir'] or options['verificar']):
+            raise CommandError("Informe --reconstruir e/ou --verificar.")
+
+        desde = None
+        if options['desde']:
+            try:
+                desde = datetime.strptime(options['desde'], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("Data inválida em --desde; use AAAA-MM-DD.")
+
+        if options['reconstruir']:
+            self.reconstruir(desde)
+        if options['verificar']:
+            self.verificar(desde)
+
+    def _resumos_dia(self, desde):
+        resumos = ResumoVendaDia.objects.all()
+        if desde is not None:
+            resumos = resumos.filter(dia__gte=desde)
+        return resumos
+
+    def _resumos_hora(self, desde):
+        resumos = ResumoVendaHora.objects.all()
+        if desde is not None:
+            resumos = resumos.filter(hora__date__gte=desde)
+        return resumos
+
+    def reconstruir(self, desde):
+        dias = calcular_a_partir_dos_itens(desde)
+        horas = calcular_horas_a_partir_dos_itens(desde)
+
+        with transaction.atomic():
+            self._resumos_dia(desde).delete()
+            ResumoVendaDia.objects.bulk_create([
+                ResumoVendaDia(
+                    dia=dia,
+                    produto_id=produto_id,
+                    forma_pagamento=forma_pagamento,
+                    categoria=categoria,
+                    quantidade=quantidade,
+                    valor=valor,
+                )
+                for (dia, produto_id, forma_pagamento), (categoria, quantidade, valor) in dias.items()
+            ], batch_size=1000)
+
+            self._resumos_hora(desde).delete()
+            ResumoVendaHora.objects.bulk_create([
+                ResumoVendaHora(
+                    hora=hora,
+                    categoria=categoria,
+                    forma_pagamento=forma_pagamento,
+                    cliente_id=cliente_id,
+                    quantidade=quantidade,
+                    valor=valor,
+                )
+                for (hora, categoria, forma_pagamento, cliente_id), (quantidade, valor) in horas.items()
+            ], batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Resumos reconstruídos: {len(dias)} linha(s) por dia, {len(horas)} por hora."
+        ))
+
+    def verificar(self, desde):
+        esperado_dia = {
+            chave: (quantidade, valor)
+            for chave, (_, quantidade, valor) in calcular_a_partir_dos_itens(desde).items()
+        }
+        atual_dia = {}
+        for r in self._resumos_dia(desde):
+            chave = (r.dia, r.produto_id, r.forma_pagamento)
+            atual_dia[chave] = self._somar(atual_dia.get(chave), r)
+
+        esperado_hora = calcular_horas_a_partir_dos_itens(desde)
+        atual_hora = {}
+        for r in self._resumos_hora(desde):
+            chave = (r.hora, r.categoria, r.forma_pagamento, r.cliente_id)
+            atual_hora[chave] = self._somar(atual_hora.get(chave), r)
+
+        divergencias = self._comparar("dia", esperado_dia, atual_dia)
+        divergencias += self._comparar("hora", esperado_hora, atual_hora)
+        for linha in divergencias[:50]:
+            self.stdout.write(linha)
+
+        if divergencias:
+            raise CommandError(f"{len(divergencias)} divergência(s) nos resumos. Rode com --reconstruir.")
+        self.stdout.write(self.style.SUCCESS("Resumos conferem com os itens."))
+
+    @staticmethod
+    def _somar(atual, resumo):
+        quantidade, valor = atual or (0, 0)
+        return quantidade + resumo.quantidade, valor + resumo.valor
+
+    @staticmethod
+    def _comparar(nome, esperado, atual):
+        zero = (0, 0)
+        return [
+            f"[{nome}] {chave}: resumo={atual.get(chave, zero)} itens={esperado.get(chave, zero)}"
+            for chave in set(esperado) | set(atual)
+            if atual.get(chave, zero) != esperado.get(chave, zero)
+        ]
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from mercado.inventario import DIAS_DIARIOS, compactar, fotografar_ate
+from mercado.models import SaldoEstoque
+
+
+class Command(BaseCommand):
+    help = "Grava os saldos diários de estoque a partir do livro de movimentos e compacta os antigos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ate', help="Último dia a fotografar (AAAA-MM-DD). Padrão: ontem.")
+        parser.add_argument('--refazer', action='store_true', help="Apaga todos os saldos e refaz desde o primeiro movimento.")
+        parser.add_argument(
+            '--dias-diarios', type=int, default=DIAS_DIARIOS,
+            help=f"Mantém saldos diários nos últimos N dias; antes disso, um por mês (padrão {DIAS_DIARIOS}).",
+        )
+        parser.add_argument('--sem-compactar', action='store_true', help="Só grava os saldos novos.")
+
+    def handle(self, *args, **options):
+        hoje = timezone.localdate()
+        ate = hoje - timedelta(days=1)
+        if options['ate']:
+            try:
+                ate = datetime.strptime(options['ate'], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("Data inválida em --ate; use AAAA-MM-DD.")
+            if ate >= hoje:
+                raise CommandError("--ate precisa ser um dia já encerrado.")
+
+        with transaction.atomic():
+            if options['refazer']:
+                apagados, _ = SaldoEstoque.objects.all().delete()
+                self.stdout.write(f"{apagados} saldo(s) apagado(s).")
+
+            gravados = fotografar_ate(ate)
+            self.stdout.write(self.style.SUCCESS(
+                f"{len(gravados)} dia(s) fotografado(s), {sum(gravados.values())} saldo(s) gravado(s)."
+            ))
+
+            if not options['sem_compactar']:
+                compactados = compactar(hoje - timedelta(days=options['dias_diarios']))
+                self.stdout.write(f"{compactados} saldo(s) antigo(s) compactado(s).")
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:14
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def resumir_vendas_por_dia(apps, schema_editor):
+    """Resumo diário das vendas já gravadas (como resumo_vendas --reconstruir)."""
+    ItemVenda = apps.get_model('mercado', 'ItemVenda')
+    ResumoVendaDia = apps.get_model('mercado', 'ResumoVendaDia')
+
+    linhas = (
+        ItemVenda.objects
+        .annotate(dia=TruncDate('venda__data_venda'))
+        .values('dia', 'produto_id', 'produto__categoria', 'venda__forma_pagamento')
+        .annotate(total_quantidade=Sum('quantidade'), total_valor=Sum('subtotal'))
+        .order_by()
+    )
+    ResumoVendaDia.objects.bulk_create([
+        ResumoVendaDia(
+            dia=linha['dia'],
+            produto_id=linha['produto_id'],
+            categoria=linha['produto__categoria'],
+            forma_pagamento=linha['venda__forma_pagamento'],
+            quantidade=linha['total_quantidade'],
+            valor=linha['total_valor'],
+        )
+        for linha in linhas.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0028_venda_codigo_barras'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoVendaDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('categoria', models.CharField(choices=[('comida', 'Comida'), ('bebida_nao_alcoolica', 'Bebida Não Alcoólica'), ('bebida_alcoolica', 'Bebida Alcoólica'), ('doces', 'Doces'), ('acessorios', 'Acessórios'), ('cigarros', 'Cigarros')], max_length=20)),
+                ('forma_pagamento', models.CharField(choices=[('pix', 'Pix'), ('credito', 'Cartão de Crédito'), ('debito', 'Cartão de Débito'), ('dinheiro', 'Dinheiro'), ('em aberto', 'Em aberto')], max_length=10)),
+                ('quantidade', models.IntegerField(default=0)),
+                ('valor', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos_dia', to='mercado.produto')),
+            ],
+            options={
+                'verbose_name': 'Resumo por Dia',
+                'verbose_name_plural': 'Resumo por Dia',
+                'constraints': [models.UniqueConstraint(fields=('dia', 'produto', 'forma_pagamento'), name='resumo_venda_dia_unico')],
+            },
+        ),
+        migrations.RunPython(resumir_vendas_por_dia, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:15
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncHour
+
+
+def resumir_vendas_por_hora(apps, schema_editor):
+    """Resumo por hora das vendas já gravadas (como resumo_vendas --reconstruir)."""
+    ItemVenda = apps.get_model('mercado', 'ItemVenda')
+    ResumoVendaHora = apps.get_model('mercado', 'ResumoVendaHora')
+
+    linhas = (
+        ItemVenda.objects
+        .annotate(hora=TruncHour('venda__data_venda'))
+        .values('hora', 'produto__categoria', 'venda__forma_pagamento', 'venda__cliente_id')
+        .annotate(total_quantidade=Sum('quantidade'), total_valor=Sum('subtotal'))
+        .order_by()
+    )
+    ResumoVendaHora.objects.bulk_create([
+        ResumoVendaHora(
+            hora=linha['hora'],
+            categoria=linha['produto__categoria'],
+            forma_pagamento=linha['venda__forma_pagamento'],
+            cliente_id=linha['venda__cliente_id'],
+            quantidade=linha['total_quantidade'],
+            valor=linha['total_valor'],
+        )
+        for linha in linhas.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0029_resumovendadia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoVendaHora',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hora', models.DateTimeField()),
+                ('categoria', models.CharField(choices=[('comida', 'Comida'), ('bebida_nao_alcoolica', 'Bebida Não Alcoólica'), ('bebida_alcoolica', 'Bebida Alcoólica'), ('doces', 'Doces'), ('acessorios', 'Acessórios'), ('cigarros', 'Cigarros')], max_length=20)),
+                ('forma_pagamento', models.CharField(choices=[('pix', 'Pix'), ('credito', 'Cartão de Crédito'), ('debito', 'Cartão de Débito'), ('dinheiro', 'Dinheiro'), ('em aberto', 'Em aberto')], max_length=10)),
+                ('quantidade', models.IntegerField(default=0)),
+                ('valor', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('cliente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='resumos_hora', to='mercado.cliente')),
+            ],
+            options={
+                'verbose_name': 'Resumo por Hora',
+                'verbose_name_plural': 'Resumo por Hora',
+                'constraints': [models.UniqueConstraint(fields=('hora', 'categoria', 'forma_pagamento', 'cliente'), name='resumo_venda_hora_unico')],
+            },
+        ),
+        migrations.RunPython(resumir_vendas_por_hora, migrations.RunPython.noop),
+    ]
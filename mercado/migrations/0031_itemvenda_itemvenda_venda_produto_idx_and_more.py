@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0030_resumovendahora'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='itemvenda',
+            index=models.Index(fields=['venda', 'produto'], name='itemvenda_venda_produto_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='venda',
+            index=models.Index(fields=['data_venda', 'pago'], name='venda_data_pago_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='venda',
+            index=models.Index(fields=['data_venda', 'forma_pagamento'], name='venda_data_forma_idx'),
+        ),
+    ]
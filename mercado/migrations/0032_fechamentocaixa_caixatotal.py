@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:21
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0031_itemvenda_itemvenda_venda_produto_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FechamentoCaixa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_fechamento', models.DateTimeField()),
+                ('valor_inicial', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_pix', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_credito', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_debito', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_dinheiro', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_em_aberto', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('quantidade_itens', models.IntegerField(default=0)),
+                ('dinheiro_esperado', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('valor_fechamento', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('diferenca', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('caixa', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fechamento', to='mercado.caixa')),
+            ],
+            options={
+                'verbose_name': 'Fechamento de Caixa',
+                'verbose_name_plural': 'Fechamentos de Caixa',
+            },
+        ),
+        migrations.CreateModel(
+            name='CaixaTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('forma_pagamento', models.CharField(choices=[('pix', 'Pix'), ('credito', 'Cartão de Crédito'), ('debito', 'Cartão de Débito'), ('dinheiro', 'Dinheiro'), ('em aberto', 'Em aberto')], max_length=10)),
+                ('quantidade', models.IntegerField(default=0)),
+                ('valor', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('caixa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='totais', to='mercado.caixa')),
+            ],
+            options={
+                'verbose_name': 'Total do Caixa',
+                'verbose_name_plural': 'Totais do Caixa',
+                'constraints': [models.UniqueConstraint(fields=('caixa', 'forma_pagamento'), name='caixa_total_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:23
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def contadores_dos_clientes(apps, schema_editor):
+    """Contadores a partir das vendas já gravadas (como clientes.recalcular_contadores)."""
+    Cliente = apps.get_model('mercado', 'Cliente')
+    ItemVenda = apps.get_model('mercado', 'ItemVenda')
+    Venda = apps.get_model('mercado', 'Venda')
+
+    zero = Value(Decimal('0.00'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    itens = ItemVenda.objects.filter(venda__cliente=OuterRef('pk')).order_by().values('venda__cliente')
+    vendas = Venda.objects.filter(cliente=OuterRef('pk')).order_by().values('cliente')
+    Cliente.objects.update(
+        total_itens=Coalesce(
+            Subquery(itens.annotate(total=Sum('quantidade')).values('total')),
+            Value(0), output_field=IntegerField(),
+        ),
+        total_comprado=Coalesce(Subquery(itens.annotate(total=Sum('subtotal')).values('total')), zero),
+        ultima_compra=Subquery(
+            vendas.filter(itens__isnull=False).annotate(ultima=Max('data_venda')).values('ultima')
+        ),
+        saldo_aberto=Coalesce(
+            Subquery(vendas.filter(pago=False).annotate(total=Sum('saldo_devedor')).values('total')), zero,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0032_fechamentocaixa_caixatotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='saldo_aberto',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cliente',
+            name='total_comprado',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cliente',
+            name='total_itens',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cliente',
+            name='ultima_compra',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(contadores_dos_clientes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:25
+
+from decimal import Decimal
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def saldo_das_vendas_em_aberto(apps, schema_editor):
+    """Vendas em aberto passam a dever o total; o saldo dos clientes acompanha."""
+    Venda = apps.get_model('mercado', 'Venda')
+    Cliente = apps.get_model('mercado', 'Cliente')
+
+    Venda.objects.filter(forma_pagamento='em aberto', pago=False).update(saldo_devedor=F('valor_total'))
+
+    saldo = (
+        Venda.objects
+        .filter(cliente=OuterRef('pk'), pago=False)
+        .order_by()
+        .values('cliente')
+        .annotate(total=Sum('saldo_devedor'))
+        .values('total')
+    )
+    Cliente.objects.update(saldo_aberto=Coalesce(
+        Subquery(saldo), Value(Decimal('0.00')), output_field=DecimalField(max_digits=12, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0033_cliente_saldo_aberto_cliente_total_comprado_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Quitacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateTimeField(default=django.utils.timezone.now)),
+                ('equipe', models.CharField(blank=True, max_length=100, null=True)),
+                ('forma_pagamento', models.CharField(choices=[('pix', 'Pix'), ('credito', 'Cartão de Crédito'), ('debito', 'Cartão de Débito'), ('dinheiro', 'Dinheiro')], max_length=10)),
+                ('valor', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('quantidade_vendas', models.IntegerField(default=0)),
+                ('cliente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='quitacoes', to='mercado.cliente')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Quitação',
+                'verbose_name_plural': 'Quitações',
+                'ordering': ['-data'],
+            },
+        ),
+        migrations.AddField(
+            model_name='venda',
+            name='quitacao',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='vendas', to='mercado.quitacao'),
+        ),
+        migrations.RunPython(saldo_das_vendas_em_aberto, migrations.RunPython.noop),
+    ]
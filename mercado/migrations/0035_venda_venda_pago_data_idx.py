@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0034_quitacao_venda_quitacao'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='venda',
+            index=models.Index(fields=['pago', 'data_venda'], name='venda_pago_data_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def livro_a_partir_do_historico(apps, schema_editor):
+    """
+    Monta o livro de cada produto com as diferenças de estoque entre linhas
+    seguidas do histórico, na data de cada uma, antes que a coluna saia do
+    histórico. Baixas feitas sem passar pelo histórico (UPDATE direto)
+    fecham com um ajuste até o estoque atual. O motivo de cada diferença
+    não fica no histórico: tudo entra como ajuste.
+    """
+    Produto = apps.get_model('mercado', 'Produto')
+    HistoricalProduto = apps.get_model('mercado', 'HistoricalProduto')
+    MovimentoEstoque = apps.get_model('mercado', 'MovimentoEstoque')
+
+    estoque_atual = dict(Produto.objects.values_list('pk', 'estoque'))
+    historico = (
+        HistoricalProduto.objects
+        .filter(id__in=estoque_atual)
+        .order_by('id', 'history_date', 'history_id')
+        .values_list('id', 'estoque', 'history_date')
+    )
+
+    def movimentos():
+        anterior = {}
+        for produto_id, estoque, data in historico.iterator(chunk_size=2000):
+            delta = estoque - anterior.get(produto_id, 0)
+            anterior[produto_id] = estoque
+            if delta:
+                yield MovimentoEstoque(produto_id=produto_id, quantidade=delta, motivo='ajuste', data=data)
+        for produto_id, estoque in estoque_atual.items():
+            delta = estoque - anterior.get(produto_id, 0)
+            if delta:
+                yield MovimentoEstoque(produto_id=produto_id, quantidade=delta, motivo='ajuste')
+
+    # bulk_create monta a lista inteira: grava em blocos
+    lote = []
+    for movimento in movimentos():
+        lote.append(movimento)
+        if len(lote) == 1000:
+            MovimentoEstoque.objects.bulk_create(lote)
+            lote = []
+    MovimentoEstoque.objects.bulk_create(lote)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0035_venda_venda_pago_data_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimentoEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.IntegerField(help_text='Negativa na saída')),
+                ('motivo', models.CharField(choices=[('venda', 'Venda'), ('devolucao', 'Devolução'), ('ajuste', 'Ajuste')], max_length=10)),
+                ('data', models.DateTimeField(default=django.utils.timezone.now)),
+                ('item', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='mercado.itemvenda')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimentos', to='mercado.produto')),
+                ('venda', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='movimentos_estoque', to='mercado.venda')),
+            ],
+            options={
+                'verbose_name': 'Movimento de estoque',
+                'verbose_name_plural': 'Movimentos de estoque',
+                'indexes': [models.Index(fields=['produto', 'data'], name='movimento_produto_data_idx')],
+            },
+        ),
+        migrations.RunPython(livro_a_partir_do_historico, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='historicalproduto',
+            name='estoque',
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0036_movimentoestoque'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('estoque', models.IntegerField()),
+            ],
+            options={
+                'verbose_name': 'Saldo de estoque',
+                'verbose_name_plural': 'Saldos de estoque',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='movimentoestoque',
+            index=models.Index(fields=['data'], name='movimento_data_idx'),
+        ),
+        migrations.AddField(
+            model_name='saldoestoque',
+            name='produto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos', to='mercado.produto'),
+        ),
+        migrations.AddIndex(
+            model_name='saldoestoque',
+            index=models.Index(fields=['dia'], name='saldo_estoque_dia_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='saldoestoque',
+            constraint=models.UniqueConstraint(fields=('produto', 'dia'), name='saldo_estoque_unico'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Filtros do changelist do LogEntryProxyAdmin, sempre ordenados por data
+INDICES_LOG = [
+    ('mercado_log_usuario_data_idx', 'user_id, action_time'),
+    ('mercado_log_tipo_data_idx', 'content_type_id, action_time'),
+    ('mercado_log_acao_data_idx', 'action_flag, action_time'),
+    ('mercado_log_data_idx', 'action_time'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin', '0003_logentry_add_action_flag_choices'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('mercado', '0037_saldoestoque'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoHistorico',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('origem', models.CharField(choices=[('produto', 'Histórico de produtos'), ('admin', 'Log do admin')], max_length=10)),
+                ('acao', models.CharField(choices=[('+', 'Criação'), ('~', 'Alteração'), ('-', 'Exclusão')], max_length=1)),
+                ('quantidade', models.IntegerField(default=0)),
+                ('content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='contenttypes.contenttype')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Resumo do histórico arquivado',
+                'verbose_name_plural': 'Resumos do histórico arquivado',
+                'ordering': ['-mes'],
+                'indexes': [models.Index(fields=['mes', 'origem'], name='resumo_historico_mes_idx')],
+            },
+        ),
+    ] + [
+        migrations.RunSQL(
+            f"CREATE INDEX {nome} ON django_admin_log ({colunas})",
+            f"DROP INDEX {nome}",
+        )
+        for nome, colunas in INDICES_LOG
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0038_resumohistorico_logentry_indices'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImpressaoCupom',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('criada_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('impressa_em', models.DateTimeField(blank=True, null=True)),
+                ('tentativas', models.IntegerField(default=0)),
+                ('erro', models.TextField(blank=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('venda', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='impressoes', to='mercado.venda')),
+            ],
+            options={
+                'verbose_name': 'Impressão de cupom',
+                'verbose_name_plural': 'Impressões de cupom',
+                'indexes': [models.Index(fields=['usuario', 'impressa_em'], name='impressao_pendente_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:54
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def reservar_carrinhos_abertos(apps, schema_editor):
+    """Carrinhos já abertos ganham reserva com prazo a partir de agora."""
+    ItemVenda = apps.get_model('mercado', 'ItemVenda')
+    ReservaEstoque = apps.get_model('mercado', 'ReservaEstoque')
+    expira_em = timezone.now() + timedelta(minutes=30)
+    itens = (
+        ItemVenda.objects
+        .filter(venda__pdvsession__isnull=False)
+        .values_list('venda__pdvsession', 'venda_id', 'produto_id', 'quantidade')
+    )
+    reservas = {}
+    for sessao_id, venda_id, produto_id, quantidade in itens.iterator():
+        reserva = reservas.setdefault((venda_id, produto_id), ReservaEstoque(
+            sessao_id=sessao_id, venda_id=venda_id, produto_id=produto_id, quantidade=0, expira_em=expira_em,
+        ))
+        reserva.quantidade += quantidade
+    ReservaEstoque.objects.bulk_create(reservas.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0040_bipagemprocessada'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.PositiveIntegerField()),
+                ('expira_em', models.DateTimeField()),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='mercado.produto')),
+                ('sessao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='mercado.pdvsession')),
+                ('venda', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='mercado.venda')),
+            ],
+            options={
+                'verbose_name': 'Reserva de estoque',
+                'verbose_name_plural': 'Reservas de estoque',
+                'indexes': [models.Index(fields=['produto', 'expira_em'], name='reserva_produto_expira_idx'), models.Index(fields=['expira_em'], name='reserva_expira_idx')],
+                'constraints': [models.UniqueConstraint(fields=('venda', 'produto'), name='reserva_venda_produto_unica')],
+            },
+        ),
+        migrations.RunPython(reservar_carrinhos_abertos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:06
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def juntar_linhas_do_balcao(apps, schema_editor):
+    """Clientes excluídos deixaram várias linhas sem cliente na mesma hora; soma na primeira."""
+    ResumoVendaHora = apps.get_model('mercado', 'ResumoVendaHora')
+    repetidas = (
+        ResumoVendaHora.objects
+        .filter(cliente__isnull=True)
+        .values('hora', 'categoria', 'forma_pagamento')
+        .annotate(linhas=Count('pk'), primeira=Min('pk'), total_quantidade=Sum('quantidade'), total_valor=Sum('valor'))
+        .filter(linhas__gt=1)
+        .order_by()
+    )
+    for grupo in repetidas:
+        ResumoVendaHora.objects.filter(pk=grupo['primeira']).update(
+            quantidade=grupo['total_quantidade'], valor=grupo['total_valor'],
+        )
+        (
+            ResumoVendaHora.objects
+            .filter(cliente__isnull=True, hora=grupo['hora'], categoria=grupo['categoria'],
+                    forma_pagamento=grupo['forma_pagamento'])
+            .exclude(pk=grupo['primeira'])
+            .delete()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0041_reservaestoque'),
+    ]
+
+    operations = [
+        migrations.RunPython(juntar_linhas_do_balcao, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='resumovendahora',
+            constraint=models.UniqueConstraint(condition=models.Q(('cliente__isnull', True)), fields=('hora', 'categoria', 'forma_pagamento'), name='resumo_venda_hora_balcao_unico'),
+        ),
+    ]
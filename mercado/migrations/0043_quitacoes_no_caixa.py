@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:10
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def quitacoes_dos_caixas_abertos(apps, schema_editor):
+    """Caixas abertos passam a contar as quitações feitas desde a abertura."""
+    Caixa = apps.get_model('mercado', 'Caixa')
+    CaixaTotal = apps.get_model('mercado', 'CaixaTotal')
+    Quitacao = apps.get_model('mercado', 'Quitacao')
+    for caixa in Caixa.objects.filter(data_fechamento__isnull=True):
+        recebido = (
+            Quitacao.objects
+            .filter(data__gte=caixa.data_abertura)
+            .values('forma_pagamento')
+            .annotate(total=Sum('valor'))
+            .order_by()
+        )
+        for linha in recebido:
+            CaixaTotal.objects.update_or_create(
+                caixa=caixa, forma_pagamento=linha['forma_pagamento'], defaults={'quitado': linha['total']},
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercado', '0042_resumo_hora_balcao_unico'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caixatotal',
+            name='quitado',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='fechamentocaixa',
+            name='total_quitado',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.RunPython(quitacoes_dos_caixas_abertos, migrations.RunPython.noop),
+    ]
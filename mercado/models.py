@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from django.db.models import Sum
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Greatest
 from decimal import Decimal
 from simple_history.models import HistoricalRecords
 
@@ -28,7 +29,55 @@ class Produto(models.Model):
     categoria = models.CharField(max_length=20, choices=CATEGORIAS)
     codigo_barras = models.CharField(max_length=50, unique=True, blank=True, null=True)
 
-    history = HistoricalRecords()
+    # O histórico acompanha só o catálogo; o estoque vai para o MovimentoEstoque
+    history = HistoricalRecords(excluded_fields=['estoque'])
+
+    CAMPOS_CATALOGO = ('nome', 'preco', 'categoria', 'codigo_barras')
+
+    # catálogo e estoque como estão gravados no banco
+    _estado_salvo = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._guardar_estado()
+        return instance
+
+    def _guardar_estado(self):
+        # __dict__ para não carregar campos adiados (.only/.defer)
+        self._estado_salvo = {
+            campo: self.__dict__[campo]
+            for campo in self.CAMPOS_CATALOGO + ('estoque',)
+            if campo in self.__dict__
+        }
+
+    def save(self, *args, **kwargs):
+        """
+        Grava o produto e leva ao livro de estoque, como ajuste, a diferença
+        entre o estoque informado e o gravado. Se só o estoque mudou, não
+        cria linha no histórico.
+        """
+        from .estoque import registrar_movimentos
+
+        anterior = self._estado_salvo or {}
+        update_fields = kwargs.get('update_fields')
+        grava_estoque = 'estoque' in self.__dict__ and (update_fields is None or 'estoque' in update_fields)
+        so_estoque = bool(anterior) and all(
+            self.__dict__.get(campo) == anterior.get(campo) for campo in self.CAMPOS_CATALOGO
+        )
+
+        if so_estoque:
+            self.skip_history_when_saving = True
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                if grava_estoque and (not anterior or 'estoque' in anterior):
+                    diferenca = self.estoque - anterior.get('estoque', 0)
+                    registrar_movimentos([(self.pk, diferenca, None)], MovimentoEstoque.AJUSTE)
+        finally:
+            if so_estoque:
+                del self.skip_history_when_saving
+        self._guardar_estado()
 
     def __str__(self):
         return self.nome
@@ -38,16 +87,26 @@ class Produto(models.Model):
             return False
         return self.estoque >= quantidade
 
-    def diminuir_estoque(self, quantidade):
-        if self.verificar_estoque(quantidade):
-            self.estoque -= quantidade
-            self.save()
-            return True
-        return False
+    def diminuir_estoque(self, quantidade, motivo=None, venda_id=None):
+        from .estoque import baixar_estoque
+
+        motivo = motivo or MovimentoEstoque.AJUSTE
+        if quantidade is None or baixar_estoque([(self.pk, quantidade)], motivo, venda_id):
+            return False
+        self._acompanhar_estoque(-quantidade)
+        return True
+
+    def aumentar_estoque(self, quantidade, motivo=None, venda_id=None):
+        from .estoque import devolver_estoque
 
-    def aumentar_estoque(self, quantidade):
-        self.estoque += quantidade
-        self.save()
+        devolver_estoque([(self.pk, quantidade)], motivo or MovimentoEstoque.AJUSTE, venda_id)
+        self._acompanhar_estoque(quantidade)
+
+    def _acompanhar_estoque(self, delta):
+        # O movimento já foi para o livro; um save() depois não é outro ajuste
+        self.estoque += delta
+        if self._estado_salvo and 'estoque' in self._estado_salvo:
+            self._estado_salvo['estoque'] += delta
 
 
 # -------------------------------
@@ -65,16 +124,20 @@ class Cliente(models.Model):
     equipe = models.CharField(max_length=100, blank=True, null=True)
     cor = models.CharField(max_length=20, blank=True, null=True)
 
+    # Contadores mantidos por clientes.py; não editar à mão
+    total_itens = models.IntegerField(default=0, editable=False, db_index=True)
+    total_comprado = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False, db_index=True)
+    saldo_aberto = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False, db_index=True)
+    ultima_compra = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+
     def __str__(self):
         return f"{self.nome} ({self.get_tipo_display()})"
 
     def get_total_quantidade_comprada(self):
-        total = self.vendas.aggregate(total=Sum('quantidade'))['total']
-        return total or 0
+        return self.total_itens
 
     def get_total_valor_comprado(self):
-        total = self.vendas.aggregate(total=Sum('valor_pago'))['total']
-        return total or Decimal('0.00')
+        return self.total_comprado
 
 
 class ClienteResumo(Cliente):
@@ -106,6 +169,28 @@ class Venda(models.Model):
     saldo_devedor = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'), editable=False)
     pago = models.BooleanField(default=False)
     codigo_barras = models.CharField(max_length=50, unique=True, blank=True, null=True)
+    quitacao = models.ForeignKey('Quitacao', on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='vendas')
+
+    class Meta:
+        # Relatórios do dia/período filtram por faixa de data_venda
+        indexes = [
+            models.Index(fields=['data_venda', 'pago'], name='venda_data_pago_idx'),
+            models.Index(fields=['data_venda', 'forma_pagamento'], name='venda_data_forma_idx'),
+            # Contas a receber: só as não pagas, por idade
+            models.Index(fields=['pago', 'data_venda'], name='venda_pago_data_idx'),
+        ]
+
+    # (forma_pagamento, cliente_id) como estão gravados no banco
+    _estado_salvo = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._estado_salvo = (
+            instance.__dict__.get('forma_pagamento'),
+            instance.__dict__.get('cliente_id'),
+        )
+        return instance
 
     def calcular_total(self):
         total = self.itens.aggregate(total=Sum('subtotal'))['total']
@@ -130,21 +215,16 @@ class Venda(models.Model):
             if self.troco:
                 raise ValidationError("Troco só para pagamento em dinheiro.")
 
-    def save(self, *args, validate=True, **kwargs):
-        if validate:
-            self.full_clean()
-
-        creating = self.pk is None
+    # Campos derivados do total, mantidos por aplicar_regras_pagamento
+    CAMPOS_TOTAIS = ['valor_total', 'troco', 'valor_pago', 'saldo_devedor', 'pago']
 
-        # Primeiro salva a venda caso não exista
-        if creating:
-            super().save(*args, **kwargs)
-
-        # Agora pode calcular total
-        total = self.calcular_total()
-        self.valor_total = total
-
-        # Regras de pagamento
+    def aplicar_regras_pagamento(self):
+        """
+        Ajusta troco, saldo e pagamento (em memória) a partir de valor_total.
+        Venda em aberto deve o total até ser quitada; venda quitada não
+        deve mais nada.
+        """
+        total = self.valor_total
         if self.forma_pagamento == 'dinheiro':
             if self.valor_pago:
                 self.troco = max(self.valor_pago - total, Decimal('0.00'))
@@ -154,12 +234,93 @@ class Venda(models.Model):
             self.troco = None
             self.valor_pago = None
             self.pago = False
+            self.saldo_devedor = total if self.forma_pagamento == 'em aberto' else Decimal('0.00')
+
+        if self.quitacao_id:
             self.saldo_devedor = Decimal('0.00')
+            self.pago = True
+
+    @staticmethod
+    def expressoes_totais(delta):
+        """
+        Mesmas regras de aplicar_regras_pagamento, em SQL, somando `delta` ao
+        total. Serve para um único UPDATE por alteração de item.
+        """
+        zero = Value(Decimal('0.00'), output_field=models.DecimalField())
+        novo_total = F('valor_total') + Value(delta, output_field=models.DecimalField())
+        dinheiro = Q(forma_pagamento='dinheiro')
+        dinheiro_informado = dinheiro & Q(valor_pago__gt=0)
+        quitada = Q(quitacao__isnull=False)
+
+        return {
+            'valor_total': novo_total,
+            'troco': Case(
+                When(dinheiro_informado, then=Greatest(F('valor_pago') - novo_total, zero)),
+                When(dinheiro, then=F('troco')),
+                default=None,
+            ),
+            'saldo_devedor': Case(
+                When(quitada, then=zero),
+                When(dinheiro_informado, then=Greatest(novo_total - F('valor_pago'), zero)),
+                When(dinheiro, then=F('saldo_devedor')),
+                When(forma_pagamento='em aberto', then=novo_total),
+                default=zero,
+            ),
+            'pago': Case(
+                When(quitada, then=Value(True)),
+                When(dinheiro_informado & Q(valor_pago__gte=novo_total), then=Value(True)),
+                When(dinheiro_informado, then=Value(False)),
+                When(dinheiro, then=F('pago')),
+                default=Value(False),
+            ),
+            'valor_pago': Case(
+                When(dinheiro, then=F('valor_pago')),
+                default=None,
+            ),
+        }
+
+    def aplicar_delta_total(self, delta):
+        """Soma `delta` ao total da venda com um único UPDATE, sem reagregar os itens."""
+        from .clientes import atualizar_saldo_aberto
+
+        Venda.objects.filter(pk=self.pk).update(**Venda.expressoes_totais(delta))
+        self.valor_total += delta
+        self.aplicar_regras_pagamento()
+        atualizar_saldo_aberto([self.cliente_id])
+
+    def recalcular_totais(self):
+        """
+        Recalcula os totais do zero a partir dos itens. É o caminho de
+        conferência: o dia a dia usa aplicar_delta_total.
+        """
+        from .clientes import atualizar_saldo_aberto
+
+        self.valor_total = self.calcular_total()
+        self.aplicar_regras_pagamento()
+        Venda.objects.filter(pk=self.pk).update(
+            **{campo: getattr(self, campo) for campo in self.CAMPOS_TOTAIS}
+        )
+        atualizar_saldo_aberto([self.cliente_id])
+
+    def save(self, *args, validate=True, **kwargs):
+        if validate:
+            self.full_clean()
+
+        from .clientes import atualizar_saldo_aberto
+        from .resumo import mover_venda
 
-        # Agora salva apenas os campos que mudaram
-        super().save(update_fields=[
-            'valor_total', 'troco', 'valor_pago', 'saldo_devedor', 'pago'
-        ])
+        # Venda nova ainda não tem itens; as demais são conferidas do zero
+        self.valor_total = self.calcular_total() if self.pk else Decimal('0.00')
+        self.aplicar_regras_pagamento()
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            estado = (self.forma_pagamento, self.cliente_id)
+            if self._estado_salvo and self._estado_salvo[0] and self._estado_salvo != estado:
+                mover_venda(self, *self._estado_salvo)
+            cliente_anterior = self._estado_salvo[1] if self._estado_salvo else None
+            atualizar_saldo_aberto({self.cliente_id, cliente_anterior})
+            self._estado_salvo = estado
 
     def __str__(self):
         return f"Venda #{self.pk} - Cliente: {self.cliente.nome if self.cliente else 'Desconhecido'}"
@@ -177,32 +338,102 @@ class ItemVenda(models.Model):
     quantidade = models.PositiveIntegerField()
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['venda', 'produto'], name='itemvenda_venda_produto_idx'),
+        ]
+
+    # venda, produto, quantidade e subtotal como estão gravados no banco
+    _estado_salvo = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._guardar_estado()
+        return instance
+
+    def _guardar_estado(self):
+        self._estado_salvo = {
+            'venda_id': self.venda_id,
+            'produto_id': self.produto_id,
+            'quantidade': self.quantidade,
+            'subtotal': self.subtotal,
+        }
+
+    def _movimento_estoque(self):
+        """Calcula o que precisa sair e voltar ao estoque para gravar este item."""
+        if self._estado_salvo is None:
+            return [(self.produto_id, self.quantidade)], []
+
+        produto_id = self._estado_salvo['produto_id']
+        quantidade = self._estado_salvo['quantidade']
+        if produto_id != self.produto_id:
+            return [(self.produto_id, self.quantidade)], [(produto_id, quantidade)]
+
+        diferenca = self.quantidade - quantidade
+        if diferenca > 0:
+            return [(produto_id, diferenca)], []
+        return [], [(produto_id, -diferenca)]
+
     def clean(self):
         super().clean()
         if self.quantidade is None:
             raise ValidationError("Informe a quantidade.")
-        if not self.produto.verificar_estoque(self.quantidade):
-            raise ValidationError(f'Estoque insuficiente para {self.produto.nome}. Disponível: {self.produto.estoque}')
+        saida, _ = self._movimento_estoque()
+        for _, quantidade in saida:
+            if not self.produto.verificar_estoque(quantidade):
+                raise ValidationError(f'Estoque insuficiente para {self.produto.nome}. Disponível: {self.produto.estoque}')
 
     def save(self, *args, **kwargs):
-        novo = not self.pk
+        from .estoque import EstoqueInsuficiente, baixar_estoque, devolver_estoque, registrar_movimentos
+        from .resumo import registrar_item
 
-        if novo:
-            self.clean()
-            self.produto.diminuir_estoque(self.quantidade)
+        if self.quantidade is None:
+            raise ValidationError("Informe a quantidade.")
 
-        self.subtotal = self.produto.preco * self.quantidade
-        super().save(*args, **kwargs)
+        saida, entrada = self._movimento_estoque()
+        anterior = self._estado_salvo
 
-        # Recalcular a venda após salvar o item
-        self.venda.save(validate=False)
+        with transaction.atomic():
+            # O livro de estoque é gravado depois do save, quando o item já tem id
+            falhas = baixar_estoque(saida, motivo=None)
+            if falhas:
+                raise EstoqueInsuficiente(falhas, {self.produto_id: self.produto.nome})
+            devolver_estoque(entrada, motivo=None)
 
-    def delete(self, *args, **kwargs):
-        self.produto.aumentar_estoque(self.quantidade)
-        super().delete(*args, **kwargs)
+            self.subtotal = self.produto.preco * self.quantidade
+            super().save(*args, **kwargs)
 
-        # Atualiza venda após excluir item
-        self.venda.save(validate=False)
+            registrar_movimentos(
+                [(produto_id, -quantidade, self.pk) for produto_id, quantidade in saida],
+                MovimentoEstoque.VENDA, self.venda_id,
+            )
+            registrar_movimentos(
+                [(produto_id, quantidade, self.pk) for produto_id, quantidade in entrada],
+                MovimentoEstoque.DEVOLUCAO, anterior['venda_id'] if anterior else self.venda_id,
+            )
+
+            # Aplica na venda só a diferença do subtotal
+            if anterior is None:
+                delta = self.subtotal
+            elif anterior['venda_id'] != self.venda_id:
+                Venda.objects.filter(pk=anterior['venda_id']).update(
+                    **Venda.expressoes_totais(-anterior['subtotal'])
+                )
+                delta = self.subtotal
+            else:
+                delta = self.subtotal - anterior['subtotal']
+
+            if delta:
+                self.venda.aplicar_delta_total(delta)
+
+            registrar_item(self, anterior)
+            self._guardar_estado()
+
+    def delete(self, *args, **kwargs):
+        # Estoque e total da venda são devolvidos pelos sinais pre_delete e
+        # post_delete, que também cobrem exclusões em lote
+        return super().delete(*args, **kwargs)
 
     def __str__(self):
         return f"{self.quantidade}x {self.produto.nome} (Venda #{self.venda.pk})"
@@ -213,7 +444,148 @@ class ItemVenda(models.Model):
 # -------------------------------
 @receiver(pre_delete, sender=ItemVenda)
 def devolver_estoque_ao_excluir(sender, instance, **kwargs):
-    instance.produto.aumentar_estoque(instance.quantidade)
+    from .estoque import devolver_estoque
+
+    estado = instance._estado_salvo or {
+        'venda_id': instance.venda_id,
+        'produto_id': instance.produto_id,
+        'quantidade': instance.quantidade,
+    }
+    devolver_estoque(
+        [(estado['produto_id'], estado['quantidade'])],
+        venda_id=estado['venda_id'],
+        item_id=instance.pk,
+    )
+
+
+# -------------------------------
+# LIVRO DE ESTOQUE
+# -------------------------------
+class MovimentoEstoque(models.Model):
+    """
+    Entrada ou saída de estoque de um produto, só acrescentada (ver
+    estoque.py). A soma dos movimentos de um produto é o seu estoque.
+    Venda e item ficam guardados mesmo depois de excluídos.
+    """
+    VENDA = 'venda'
+    DEVOLUCAO = 'devolucao'
+    AJUSTE = 'ajuste'
+    MOTIVOS = [
+        (VENDA, 'Venda'),
+        (DEVOLUCAO, 'Devolução'),
+        (AJUSTE, 'Ajuste'),
+    ]
+
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='movimentos')
+    quantidade = models.IntegerField(help_text='Negativa na saída')
+    motivo = models.CharField(max_length=10, choices=MOTIVOS)
+    venda = models.ForeignKey(
+        Venda, on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True, related_name='movimentos_estoque',
+    )
+    item = models.ForeignKey(
+        ItemVenda, on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True, related_name='+',
+    )
+    data = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Movimento de estoque'
+        verbose_name_plural = 'Movimentos de estoque'
+        indexes = [
+            models.Index(fields=['produto', 'data'], name='movimento_produto_data_idx'),
+            models.Index(fields=['data'], name='movimento_data_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_motivo_display()} {self.quantidade:+d} {self.produto} em {self.data:%d/%m/%Y %H:%M}"
+
+
+class SaldoEstoque(models.Model):
+    """
+    Estoque do produto no fim do dia, gravado só nos dias em que ele mudou.
+    Montado a partir do MovimentoEstoque pelo comando saldos_estoque; os
+    mais antigos são compactados para o último dia de cada mês (ver
+    inventario.py).
+    """
+    dia = models.DateField()
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='saldos')
+    estoque = models.IntegerField()
+
+    class Meta:
+        verbose_name = 'Saldo de estoque'
+        verbose_name_plural = 'Saldos de estoque'
+        constraints = [
+            models.UniqueConstraint(fields=['produto', 'dia'], name='saldo_estoque_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['dia'], name='saldo_estoque_dia_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.produto} em {self.dia:%d/%m/%Y}: {self.estoque}"
+
+
+# -------------------------------
+# RESUMO DE VENDAS POR DIA
+# -------------------------------
+class ResumoVendaDia(models.Model):
+    """
+    Quantidade e valor vendidos por dia, produto e forma de pagamento.
+    Mantido por deltas em mercado/resumo.py; reconstruído com o comando
+    resumo_vendas.
+    """
+    dia = models.DateField()
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='resumos_dia')
+    categoria = models.CharField(max_length=20, choices=Produto.CATEGORIAS)
+    forma_pagamento = models.CharField(max_length=10, choices=Venda.FORMAS_PAGAMENTO)
+    quantidade = models.IntegerField(default=0)
+    valor = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = 'Resumo por Dia'
+        verbose_name_plural = 'Resumo por Dia'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dia', 'produto', 'forma_pagamento'],
+                name='resumo_venda_dia_unico',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.dia:%d/%m/%Y} - {self.produto} ({self.forma_pagamento}): {self.quantidade}"
+
+
+class ResumoVendaHora(models.Model):
+    """
+    Quantidade e valor vendidos por hora, categoria, forma de pagamento e
+    cliente. Base dos relatórios por período (hora, dia, semana, mês).
+    """
+    hora = models.DateTimeField()
+    categoria = models.CharField(max_length=20, choices=Produto.CATEGORIAS)
+    forma_pagamento = models.CharField(max_length=10, choices=Venda.FORMAS_PAGAMENTO)
+    cliente = models.ForeignKey(Cliente, on_delete=models.SET_NULL, null=True, blank=True, related_name='resumos_hora')
+    quantidade = models.IntegerField(default=0)
+    valor = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = 'Resumo por Hora'
+        verbose_name_plural = 'Resumo por Hora'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hora', 'categoria', 'forma_pagamento', 'cliente'],
+                name='resumo_venda_hora_unico',
+            ),
+            # NULL não se repete no índice acima: o balcão tem o seu
+            models.UniqueConstraint(
+                fields=['hora', 'categoria', 'forma_pagamento'],
+                condition=models.Q(cliente__isnull=True),
+                name='resumo_venda_hora_balcao_unico',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.hora:%d/%m/%Y %H}h - {self.categoria} ({self.forma_pagamento}): {self.quantidade}"
 
 
 # -------------------------------
@@ -226,28 +598,106 @@ class Caixa(models.Model):
     data_fechamento = models.DateTimeField(null=True, blank=True)
     observacoes = models.TextField(blank=True, null=True)
 
+    def save(self, *args, **kwargs):
+        novo = self.pk is None
+        super().save(*args, **kwargs)
+        if novo:
+            # Caixa aberto com data retroativa já começa com as vendas do período
+            from .caixa import recalcular_totais
+            recalcular_totais(self)
+
     def fechar_caixa(self, valor_fechamento=None):
-        self.valor_fechamento = valor_fechamento or self.valor_fechamento
-        self.data_fechamento = timezone.now()
-        self.save()
+        from .caixa import fechar_caixa
+        return fechar_caixa(self, valor_fechamento)
 
-    def get_total_vendas(self):
-        vendas = Venda.objects.filter(
-            data_venda__gte=self.data_abertura,
-            data_venda__lte=self.data_fechamento or timezone.now()
-        )
-        total = vendas.aggregate(total=Sum('valor_pago'))['total']
-        return total or Decimal('0.00')
+    def get_totais_por_forma(self):
+        """{forma_pagamento: valor} vendido neste caixa."""
+        if self.data_fechamento and hasattr(self, 'fechamento'):
+            return self.fechamento.totais_por_forma()
+        return dict(self.totais.values_list('forma_pagamento', 'valor'))
 
-    def get_total_saidas(self):
-        total = self.saidas.aggregate(total=Sum('valor'))['total']
-        return total or Decimal('0.00')
+    def get_total_vendas(self):
+        return sum(self.get_totais_por_forma().values(), Decimal('0.00'))
 
     def __str__(self):
         status = "Aberto" if not self.data_fechamento else "Fechado"
         return f"Caixa {self.data_abertura.strftime('%d/%m/%Y %H:%M')} - {status}"
 
 
+class CaixaTotal(models.Model):
+    """
+    Total corrente de um caixa aberto por forma de pagamento, mantido por
+    deltas junto com os resumos de vendas (ver caixa.py). `quitado` é o
+    recebido nessa forma em quitações de contas em aberto.
+    """
+    caixa = models.ForeignKey(Caixa, on_delete=models.CASCADE, related_name='totais')
+    forma_pagamento = models.CharField(max_length=10, choices=Venda.FORMAS_PAGAMENTO)
+    quantidade = models.IntegerField(default=0)
+    valor = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    quitado = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = 'Total do Caixa'
+        verbose_name_plural = 'Totais do Caixa'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['caixa', 'forma_pagamento'],
+                name='caixa_total_unico',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.caixa} - {self.forma_pagamento}: R$ {self.valor:.2f}"
+
+
+class FechamentoCaixa(models.Model):
+    """
+    Retrato congelado do caixa no fechamento. Relatórios de caixas
+    antigos leem só esta linha, sem voltar às vendas.
+    """
+    caixa = models.OneToOneField(Caixa, on_delete=models.CASCADE, related_name='fechamento')
+    data_fechamento = models.DateTimeField()
+    valor_inicial = models.DecimalField(max_digits=10, decimal_places=2)
+    total_pix = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total_credito = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total_debito = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total_dinheiro = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total_em_aberto = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    # Recebido em quitações de contas em aberto, em todas as formas
+    total_quitado = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    quantidade_itens = models.IntegerField(default=0)
+    # Dinheiro que deveria estar na gaveta: valor inicial + vendas e quitações em dinheiro
+    dinheiro_esperado = models.DecimalField(max_digits=12, decimal_places=2)
+    valor_fechamento = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    diferenca = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+
+    CAMPO_POR_FORMA = {
+        'pix': 'total_pix',
+        'credito': 'total_credito',
+        'debito': 'total_debito',
+        'dinheiro': 'total_dinheiro',
+        'em aberto': 'total_em_aberto',
+    }
+
+    class Meta:
+        verbose_name = 'Fechamento de Caixa'
+        verbose_name_plural = 'Fechamentos de Caixa'
+
+    def totais_por_forma(self):
+        return {forma: getattr(self, campo) for forma, campo in self.CAMPO_POR_FORMA.items()}
+
+    @property
+    def total_vendas(self):
+        return sum(self.totais_por_forma().values(), Decimal('0.00'))
+
+    @property
+    def total_recebido(self):
+        return self.total_vendas - self.total_em_aberto
+
+    def __str__(self):
+        return f"Fechamento {self.data_fechamento:%d/%m/%Y %H:%M} - R$ {self.total_vendas:.2f}"
+
+
 
 from django.conf import settings
 
@@ -262,3 +712,141 @@ class PDVSession(models.Model):
 
     def __str__(self):
         return f"PDVSession - {self.user.username} - Venda #{self.venda.pk if self.venda else '—'}"
+
+
+# -------------------------------
+# QUITAÇÃO DE CONTAS
+# -------------------------------
+class Quitacao(models.Model):
+    """
+    Pagamento de uma ou mais vendas pendentes de um cliente ou de uma
+    equipe inteira (ver quitacao.py). As vendas quitadas apontam para cá.
+    """
+    data = models.DateTimeField(default=timezone.now)
+    cliente = models.ForeignKey(Cliente, on_delete=models.SET_NULL, null=True, blank=True, related_name='quitacoes')
+    equipe = models.CharField(max_length=100, blank=True, null=True)
+    forma_pagamento = models.CharField(max_length=10, choices=[f for f in Venda.FORMAS_PAGAMENTO if f[0] != 'em aberto'])
+    valor = models.DecimalField(max_digits=12, decimal_places=2)
+    quantidade_vendas = models.IntegerField(default=0)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Quitação'
+        verbose_name_plural = 'Quitações'
+        ordering = ['-data']
+
+    def __str__(self):
+        devedor = self.cliente or self.equipe or 'Vendas avulsas'
+        return f"Quitação {self.data:%d/%m/%Y %H:%M} - {devedor}: R$ {self.valor:.2f}"
+
+
+# -------------------------------
+# HISTÓRICO ARQUIVADO
+# -------------------------------
+class ResumoHistorico(models.Model):
+    """
+    Quantas linhas do histórico de produtos e do log do admin foram
+    arquivadas por mês, origem, ação, tipo de objeto e usuário. As linhas
+    em si vão para o arquivo SQLite do comando arquivar_historico.
+    """
+    ORIGENS = [
+        ('produto', 'Histórico de produtos'),
+        ('admin', 'Log do admin'),
+    ]
+    ACOES = [
+        ('+', 'Criação'),
+        ('~', 'Alteração'),
+        ('-', 'Exclusão'),
+    ]
+
+    mes = models.DateField()
+    origem = models.CharField(max_length=10, choices=ORIGENS)
+    acao = models.CharField(max_length=1, choices=ACOES)
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.SET_NULL, null=True, blank=True)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    quantidade = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Resumo do histórico arquivado'
+        verbose_name_plural = 'Resumos do histórico arquivado'
+        ordering = ['-mes']
+        indexes = [
+            models.Index(fields=['mes', 'origem'], name='resumo_historico_mes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.mes:%m/%Y} {self.get_origem_display()} {self.get_acao_display()}: {self.quantidade}"
+
+
+# -------------------------------
+# FILA DE IMPRESSÃO DE CUPONS
+# -------------------------------
+class ImpressaoCupom(models.Model):
+    """
+    Cupom esperando a impressora serial do terminal. A view só grava a
+    linha; o comando perifericos_pdv monta o ESC/POS e imprime (ver
+    perifericos.py).
+    """
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    venda = models.ForeignKey(Venda, on_delete=models.CASCADE, related_name='impressoes')
+    criada_em = models.DateTimeField(default=timezone.now)
+    impressa_em = models.DateTimeField(null=True, blank=True)
+    tentativas = models.IntegerField(default=0)
+    erro = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = 'Impressão de cupom'
+        verbose_name_plural = 'Impressões de cupom'
+        indexes = [
+            models.Index(fields=['usuario', 'impressa_em'], name='impressao_pendente_idx'),
+        ]
+
+    def __str__(self):
+        return f"Cupom da venda #{self.venda_id} para {self.usuario}"
+
+
+class BipagemProcessada(models.Model):
+    """
+    Chave de idempotência de uma bipagem já aplicada ao carrinho. O PDV gera
+    a chave no navegador e guarda a bipagem no diário local até o servidor
+    responder; reenviar a mesma chave não baixa o estoque de novo.
+    """
+    chave = models.CharField(max_length=64, unique=True)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    venda = models.ForeignKey(Venda, on_delete=models.SET_NULL, null=True, blank=True)
+    criada_em = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = 'Bipagem processada'
+        verbose_name_plural = 'Bipagens processadas'
+
+    def __str__(self):
+        return self.chave
+
+
+class ReservaEstoque(models.Model):
+    """
+    Estoque preso ao carrinho aberto de uma sessão do PDV até `expira_em`.
+    O estoque já saiu do Produto quando o carrinho foi gravado; vencida a
+    reserva, o carrinho é dado como abandonado e o estoque volta (ver
+    reservas.py).
+    """
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='reservas')
+    sessao = models.ForeignKey(PDVSession, on_delete=models.CASCADE, related_name='reservas')
+    venda = models.ForeignKey(Venda, on_delete=models.CASCADE, related_name='reservas')
+    quantidade = models.PositiveIntegerField()
+    expira_em = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Reserva de estoque'
+        verbose_name_plural = 'Reservas de estoque'
+        constraints = [
+            models.UniqueConstraint(fields=['venda', 'produto'], name='reserva_venda_produto_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['produto', 'expira_em'], name='reserva_produto_expira_idx'),
+            models.Index(fields=['expira_em'], name='reserva_expira_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantidade}x {self.produto} até {self.expira_em:%d/%m/%Y %H:%M}"
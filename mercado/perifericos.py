@@ -0,0 +1,381 @@
+"""
+Leitores de código de barras e impressoras de cupom em porta serial.
+
+O comando perifericos_pdv roda um laço asyncio que escuta todos os
+leitores configurados em PDV_TERMINAIS ao mesmo tempo, com leituras não
+bloqueantes (add_reader no descritor da porta). Cada código lido vai
+direto para o carrinho da PDVSession do usuário do terminal; a mesma
+leitura repetida dentro de JANELA_REPETICAO é descartada.
+
+Os cupons seguem por uma fila: a view só grava uma ImpressaoCupom
+(enfileirar_cupom) e o daemon monta o ESC/POS e escreve na impressora do
+terminal, também sem bloquear. Nada aqui depende de hardware: as portas
+podem ser pseudo-terminais (pty), como nos testes.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+
+import serial
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ImpressaoCupom, Venda
+from .services import adicionar_ao_carrinho, get_or_create_pdv_session
+
+logger = logging.getLogger(__name__)
+
+BAUDRATE_PADRAO = 9600
+
+# Leituras iguais dentro deste intervalo (segundos) são a mesma bipagem
+JANELA_REPETICAO = 0.5
+
+# Espera entre consultas à fila de cupons e entre tentativas de reabrir uma porta
+INTERVALO_SPOOL = 1.0
+INTERVALO_RECONEXAO = 5.0
+
+MAX_TENTATIVAS_IMPRESSAO = 3
+
+FIM_DE_LINHA = re.compile(rb'[\r\n]')
+
+
+def terminais():
+    """PDV_TERMINAIS com `leitor` sempre como lista de portas."""
+    configurados = {}
+    for usuario, config in getattr(settings, 'PDV_TERMINAIS', {}).items():
+        leitores = config.get('leitor') or []
+        configurados[usuario] = {
+            'leitores': [leitores] if isinstance(leitores, str) else list(leitores),
+            'impressora': config.get('impressora'),
+            'baudrate': config.get('baudrate', BAUDRATE_PADRAO),
+        }
+    return configurados
+
+
+def abrir_porta(porta, baudrate=BAUDRATE_PADRAO):
+    return serial.Serial(porta, baudrate=baudrate, timeout=0, write_timeout=0)
+
+
+# -------------------------------
+# CUPOM ESC/POS
+# -------------------------------
+ESC = b'\x1b'
+GS = b'\x1d'
+
+INICIAR = ESC + b'@'
+PAGINA_850 = ESC + b't\x02'
+CENTRALIZAR = ESC + b'a\x01'
+ALINHAR_ESQUERDA = ESC + b'a\x00'
+NEGRITO = ESC + b'E\x01'
+SEM_NEGRITO = ESC + b'E\x00'
+CORTAR = GS + b'V\x42\x03'
+
+LARGURA_CUPOM = 42
+
+
+def _linha(esquerda, direita='', largura=LARGURA_CUPOM):
+    espaco = largura - len(direita) - 1
+    return f"{esquerda[:espaco]:<{espaco}} {direita}"
+
+
+def cupom_escpos(venda, largura=LARGURA_CUPOM):
+    """Bytes ESC/POS do cupom da venda (página de código 850)."""
+    linhas = [
+        _linha(f"{item.quantidade}x {item.produto.nome}", f"{item.subtotal:.2f}", largura)
+        for item in venda.itens.select_related('produto').order_by('pk')
+    ]
+    rodape = [_linha("Pagamento", venda.get_forma_pagamento_display(), largura)]
+    if venda.valor_pago is not None:
+        rodape.append(_linha("Valor pago", f"{venda.valor_pago:.2f}", largura))
+    if venda.troco:
+        rodape.append(_linha("Troco", f"{venda.troco:.2f}", largura))
+    if venda.cliente_id:
+        rodape.append(f"Cliente: {venda.cliente.nome}"[:largura])
+
+    def texto(*partes):
+        return '\n'.join(partes).encode('cp850', 'replace') + b'\n'
+
+    partes = [
+        INICIAR, PAGINA_850, CENTRALIZAR,
+        NEGRITO, texto(getattr(settings, 'PDV_CUPOM_CABECALHO', 'Mini Mercado')), SEM_NEGRITO,
+        texto(f"Venda #{venda.pk} - {timezone.localtime(venda.data_venda):%d/%m/%Y %H:%M}"),
+        ALINHAR_ESQUERDA,
+        texto('-' * largura, *linhas, '-' * largura),
+        NEGRITO, texto(_linha("TOTAL", f"R$ {venda.valor_total:.2f}", largura)), SEM_NEGRITO,
+        texto(*rodape),
+    ]
+    if venda.codigo_barras:
+        # GS k 2: EAN-13, texto terminado em NUL
+        partes += [CENTRALIZAR, GS, b'k\x02', venda.codigo_barras.encode('ascii'), b'\x00']
+    partes += [b'\n\n', CORTAR]
+    return b''.join(partes)
+
+
+def enfileirar_cupom(venda, usuario):
+    """Põe o cupom na fila se o terminal do usuário tiver impressora. Só um INSERT."""
+    if not terminais().get(usuario.username, {}).get('impressora'):
+        return None
+    return ImpressaoCupom.objects.create(usuario=usuario, venda=venda)
+
+
+# -------------------------------
+# ACESSO AO BANCO (fora do laço asyncio)
+# -------------------------------
+def bipar_no_carrinho(usuario, codigos):
+    """
+    Leva as bipagens de um terminal para o carrinho; devolve os erros. O
+    daemon roda num processo à parte, então grava direto no banco em vez de
+    usar o carrinho em memória do servidor web; este percebe o valor_total
+    novo da venda e relê o carrinho (ver carrinho.py).
+    """
+    close_old_connections()
+    user = get_user_model().objects.get(username=usuario)
+    session = get_or_create_pdv_session(user)
+    return adicionar_ao_carrinho(session, [(codigo, 1) for codigo in codigos])
+
+
+def cupons_pendentes(usuarios, ignorar=(), limite=20):
+    """[(id, usuario, bytes)] dos cupons ainda não impressos dos terminais."""
+    close_old_connections()
+    pendentes = (
+        ImpressaoCupom.objects
+        .filter(usuario__username__in=usuarios, impressa_em__isnull=True, tentativas__lt=MAX_TENTATIVAS_IMPRESSAO)
+        .exclude(pk__in=ignorar)
+        .select_related('usuario')
+        .order_by('pk')[:limite]
+    )
+    cupons = []
+    for impressao in pendentes:
+        venda = Venda.objects.select_related('cliente').get(pk=impressao.venda_id)
+        cupons.append((impressao.pk, impressao.usuario.username, cupom_escpos(venda)))
+    return cupons
+
+
+def registrar_impressao(impressao_id, erro=None):
+    close_old_connections()
+    if erro is None:
+        ImpressaoCupom.objects.filter(pk=impressao_id).update(impressa_em=timezone.now(), erro='')
+    else:
+        ImpressaoCupom.objects.filter(pk=impressao_id).update(tentativas=F('tentativas') + 1, erro=erro)
+
+
+# -------------------------------
+# PORTAS
+# -------------------------------
+class Debounce:
+    """Descarta o mesmo código lido de novo antes de `janela` segundos."""
+
+    def __init__(self, janela=JANELA_REPETICAO, relogio=time.monotonic):
+        self.janela = janela
+        self.relogio = relogio
+        self._ultimo = None
+        self._quando = None
+
+    def aceitar(self, codigo):
+        agora = self.relogio()
+        repetido = codigo == self._ultimo and agora - self._quando < self.janela
+        self._ultimo = codigo
+        self._quando = agora
+        return not repetido
+
+
+class LeitorSerial:
+    """Leitor de código de barras que termina cada leitura com CR ou LF."""
+
+    def __init__(self, porta, usuario, fila, baudrate=BAUDRATE_PADRAO, janela=JANELA_REPETICAO):
+        self.porta = porta
+        self.usuario = usuario
+        self.fila = fila
+        self.baudrate = baudrate
+        self.debounce = Debounce(janela)
+        self.serial = None
+        self._buffer = b''
+        self._loop = None
+        self._reabrir = None
+
+    def abrir(self, loop):
+        self._loop = loop
+        self._reabrir = None
+        try:
+            self.serial = abrir_porta(self.porta, self.baudrate)
+        except serial.SerialException as e:
+            logger.warning("Leitor %s indisponível: %s", self.porta, e)
+            self._reabrir = loop.call_later(INTERVALO_RECONEXAO, self.abrir, loop)
+            return
+        loop.add_reader(self.serial.fileno(), self._ler)
+        logger.info("Leitor %s ligado ao terminal %s", self.porta, self.usuario)
+
+    def fechar(self):
+        if self._reabrir is not None:
+            self._reabrir.cancel()
+            self._reabrir = None
+        if self.serial is not None:
+            self._loop.remove_reader(self.serial.fileno())
+            self.serial.close()
+            self.serial = None
+        self._buffer = b''
+
+    def _ler(self):
+        try:
+            self._buffer += self.serial.read(self.serial.in_waiting or 1)
+        except serial.SerialException as e:
+            logger.warning("Leitor %s desconectado: %s", self.porta, e)
+            self.fechar()
+            self._reabrir = self._loop.call_later(INTERVALO_RECONEXAO, self.abrir, self._loop)
+            return
+
+        *leituras, self._buffer = FIM_DE_LINHA.split(self._buffer)
+        for leitura in leituras:
+            codigo = leitura.decode('ascii', 'ignore').strip()
+            if codigo and self.debounce.aceitar(codigo):
+                self.fila.put_nowait((self.usuario, codigo))
+
+
+class ImpressoraSerial:
+    """Impressora ESC/POS; imprime da sua fila, um cupom por vez."""
+
+    def __init__(self, porta, baudrate=BAUDRATE_PADRAO):
+        self.porta = porta
+        self.baudrate = baudrate
+        self.fila = asyncio.Queue()
+        self.serial = None
+
+    async def escrever(self, dados):
+        """Escreve tudo, esperando a porta aceitar mais sem bloquear o laço."""
+        if self.serial is None:
+            self.serial = abrir_porta(self.porta, self.baudrate)
+        loop = asyncio.get_running_loop()
+        descritor = self.serial.fileno()
+        pendente = memoryview(dados)
+        while pendente:
+            try:
+                pendente = pendente[os.write(descritor, pendente):]
+                continue
+            except BlockingIOError:
+                pass
+            pronta = loop.create_future()
+            loop.add_writer(descritor, lambda: pronta.done() or pronta.set_result(None))
+            try:
+                await pronta
+            finally:
+                loop.remove_writer(descritor)
+
+    async def rodar(self, concluido):
+        """Consome a fila; `concluido(id, erro)` é chamado depois de cada cupom."""
+        while True:
+            impressao_id, dados = await self.fila.get()
+            try:
+                await self.escrever(dados)
+            except (OSError, serial.SerialException) as e:
+                logger.warning("Impressora %s falhou: %s", self.porta, e)
+                self.fechar()
+                await concluido(impressao_id, str(e))
+            else:
+                await concluido(impressao_id, None)
+
+    def fechar(self):
+        if self.serial is not None:
+            self.serial.close()
+            self.serial = None
+
+
+# -------------------------------
+# DAEMON
+# -------------------------------
+class DaemonPerifericos:
+    """
+    Liga leitores e impressoras dos `terminais` (formato de terminais()).
+    `bipar`, `buscar_cupons` e `concluir_cupom` são as funções síncronas de
+    banco; os testes trocam por versões em memória.
+    """
+
+    def __init__(self, terminais, bipar=bipar_no_carrinho, buscar_cupons=cupons_pendentes,
+                 concluir_cupom=registrar_impressao, janela=JANELA_REPETICAO, intervalo_spool=INTERVALO_SPOOL):
+        self.terminais = terminais
+        self.bipar = sync_to_async(bipar)
+        self.buscar_cupons = sync_to_async(buscar_cupons)
+        self.concluir_cupom = sync_to_async(concluir_cupom)
+        self.janela = janela
+        self.intervalo_spool = intervalo_spool
+        self.bipagens = None
+        self.leitores = []
+        self.impressoras = {}
+        self._em_impressao = set()
+        self._parar = None
+
+    async def rodar(self):
+        loop = asyncio.get_running_loop()
+        self._parar = asyncio.Event()
+        self.bipagens = asyncio.Queue()
+
+        for usuario, config in self.terminais.items():
+            for porta in config['leitores']:
+                leitor = LeitorSerial(porta, usuario, self.bipagens, config['baudrate'], self.janela)
+                leitor.abrir(loop)
+                self.leitores.append(leitor)
+            if config.get('impressora'):
+                self.impressoras[usuario] = ImpressoraSerial(config['impressora'], config['baudrate'])
+
+        tarefas = [asyncio.create_task(self._alimentar_carrinhos())]
+        if self.impressoras:
+            tarefas.append(asyncio.create_task(self._puxar_cupons()))
+            tarefas += [
+                asyncio.create_task(impressora.rodar(self._cupom_concluido))
+                for impressora in self.impressoras.values()
+            ]
+        try:
+            await self._parar.wait()
+        finally:
+            for tarefa in tarefas:
+                tarefa.cancel()
+            await asyncio.gather(*tarefas, return_exceptions=True)
+            for leitor in self.leitores:
+                leitor.fechar()
+            for impressora in self.impressoras.values():
+                impressora.fechar()
+
+    def parar(self):
+        if self._parar is not None:
+            self._parar.set()
+
+    async def _alimentar_carrinhos(self):
+        while True:
+            usuario, codigo = await self.bipagens.get()
+            # O que chegou junto vai numa transação só por terminal
+            rajada = {usuario: [codigo]}
+            while not self.bipagens.empty():
+                usuario, codigo = self.bipagens.get_nowait()
+                rajada.setdefault(usuario, []).append(codigo)
+
+            for usuario, codigos in rajada.items():
+                try:
+                    erros = await self.bipar(usuario, codigos)
+                except Exception:
+                    logger.exception("Falha ao bipar %s no terminal %s", codigos, usuario)
+                    continue
+                for erro in erros or ():
+                    logger.warning("Terminal %s: %s (%s)", usuario, erro['erro'], erro['codigo'])
+
+    async def _puxar_cupons(self):
+        while True:
+            try:
+                cupons = await self.buscar_cupons(list(self.impressoras), list(self._em_impressao))
+            except Exception:
+                logger.exception("Falha ao consultar a fila de cupons")
+                cupons = []
+            for impressao_id, usuario, dados in cupons:
+                self._em_impressao.add(impressao_id)
+                self.impressoras[usuario].fila.put_nowait((impressao_id, dados))
+            await asyncio.sleep(self.intervalo_spool)
+
+    async def _cupom_concluido(self, impressao_id, erro):
+        try:
+            await self.concluir_cupom(impressao_id, erro)
+        finally:
+            self._em_impressao.discard(impressao_id)
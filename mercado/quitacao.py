@@ -0,0 +1,112 @@
+"""
+Quitação de contas em aberto.
+
+Quita de uma vez as vendas pendentes de clientes ou de uma equipe com
+poucos comandos SQL, sem passar por Venda.save venda a venda: lê as
+pendentes numa consulta, grava as Quitacao com bulk_create, marca todas
+as vendas num único UPDATE e refaz o saldo dos clientes envolvidos. O
+valor recebido entra no caixa aberto (ver caixa.receber_no_caixa).
+
+Só vendas em aberto com saldo devedor, fora os carrinhos do PDV, são
+quitadas; as demais vendas do queryset são ignoradas.
+"""
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+from django.utils import timezone
+
+from .caixa import caixa_aberto_em, receber_no_caixa
+from .clientes import atualizar_saldo_aberto
+from .models import Quitacao, Venda
+
+FORMAS_QUITACAO = [forma for forma, _ in Quitacao._meta.get_field('forma_pagamento').choices]
+
+
+def a_quitar(vendas):
+    """
+    Das `vendas`, as em aberto que ainda devem alguma coisa, fora os
+    carrinhos abertos do PDV (também 'em aberto' até serem finalizados).
+    """
+    return vendas.filter(pago=False, forma_pagamento='em aberto', saldo_devedor__gt=0, pdvsession__isnull=True)
+
+
+def pendentes(cliente=None, equipe=None):
+    """Vendas ainda não pagas do cliente ou de todos os clientes da equipe."""
+    vendas = a_quitar(Venda.objects.all())
+    if cliente is not None:
+        vendas = vendas.filter(cliente=cliente)
+    if equipe is not None:
+        vendas = vendas.filter(cliente__equipe=equipe)
+    return vendas
+
+
+def quitar_vendas(vendas, forma_pagamento, usuario=None, equipe=None):
+    """
+    Quita as vendas em aberto do queryset `vendas` (ver a_quitar).
+
+    Gera uma Quitacao por cliente ou, se `equipe` for informada, uma só
+    para a equipe inteira. Devolve a lista de Quitacao criadas (vazia se
+    não havia nada a quitar).
+    """
+    if forma_pagamento not in FORMAS_QUITACAO:
+        raise ValidationError(f"Forma de pagamento inválida para quitação: {forma_pagamento}")
+
+    with transaction.atomic():
+        linhas = list(
+            a_quitar(vendas)
+            .select_for_update(of=('self',))
+            .order_by()
+            .values_list('pk', 'cliente_id', 'saldo_devedor')
+        )
+        if not linhas:
+            return []
+
+        grupos = {}
+        for pk, cliente_id, saldo in linhas:
+            chave = equipe if equipe is not None else cliente_id
+            grupo = grupos.setdefault(chave, {'vendas': [], 'valor': Decimal('0.00'), 'cliente_id': cliente_id})
+            grupo['vendas'].append(pk)
+            grupo['valor'] += saldo
+
+        quitacoes = Quitacao.objects.bulk_create([
+            Quitacao(
+                cliente_id=None if equipe is not None else grupo['cliente_id'],
+                equipe=equipe,
+                forma_pagamento=forma_pagamento,
+                valor=grupo['valor'],
+                quantidade_vendas=len(grupo['vendas']),
+                usuario=usuario,
+            )
+            for grupo in grupos.values()
+        ])
+
+        quitacao_da_venda = Case(
+            *[
+                When(pk__in=grupo['vendas'], then=Value(quitacao.pk))
+                for grupo, quitacao in zip(grupos.values(), quitacoes)
+            ],
+            output_field=IntegerField(),
+        )
+        Venda.objects.filter(pk__in=[linha[0] for linha in linhas]).update(
+            quitacao=quitacao_da_venda,
+            pago=True,
+            saldo_devedor=Decimal('0.00'),
+        )
+
+        atualizar_saldo_aberto({linha[1] for linha in linhas})
+
+        caixa_id = caixa_aberto_em(timezone.now())
+        if caixa_id is not None:
+            receber_no_caixa(caixa_id, forma_pagamento, sum(q.valor for q in quitacoes))
+
+    return quitacoes
+
+
+def quitar_cliente(cliente, forma_pagamento, usuario=None):
+    return quitar_vendas(pendentes(cliente=cliente), forma_pagamento, usuario)
+
+
+def quitar_equipe(equipe, forma_pagamento, usuario=None):
+    return quitar_vendas(pendentes(equipe=equipe), forma_pagamento, usuario, equipe=equipe)
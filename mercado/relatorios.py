@@ -0,0 +1,153 @@
+"""
+Consultas de leitura dos relatórios de vendas.
+
+Tudo aqui é pensado para não crescer com o volume: itens e clientes vêm
+em lote (sem N+1), a paginação é por cursor (data_venda, id) e os
+totais saem de um único aggregate.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db.models import Count, Min, Prefetch, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ItemVenda, Venda
+
+VENDAS_POR_PAGINA = 50
+
+_EPOCA = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def intervalo_do_dia(dia):
+    """[início, fim) do dia no fuso local, para filtrar data_venda por faixa."""
+    inicio = timezone.make_aware(datetime.combine(dia, time.min))
+    fim = timezone.make_aware(datetime.combine(dia + timedelta(days=1), time.min))
+    return inicio, fim
+
+
+def ler_limite(valor, fim=False):
+    """Aceita AAAA-MM-DD (dia inteiro) ou data e hora ISO."""
+    dia = parse_date(valor)
+    if dia is not None:
+        if fim:
+            dia += timedelta(days=1)
+        momento = datetime.combine(dia, time.min)
+    else:
+        momento = parse_datetime(valor)
+        if momento is None:
+            raise ValueError(valor)
+    if timezone.is_naive(momento):
+        momento = timezone.make_aware(momento)
+    return momento
+
+
+def codificar_cursor(venda):
+    delta = venda.data_venda - _EPOCA
+    microssegundos = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    return f"{microssegundos}-{venda.pk}"
+
+
+def ler_cursor(cursor):
+    """Devolve (data_venda, id) do cursor; ValueError se for inválido."""
+    microssegundos, pk = cursor.split("-")
+    return _EPOCA + timedelta(microseconds=int(microssegundos)), int(pk)
+
+
+def vendas_do_dia(dia, apos=None, limite=VENDAS_POR_PAGINA):
+    """
+    Uma página de vendas do dia, com cliente e itens/produtos já carregados.
+
+    `apos` é um cursor devolvido pela página anterior. Devolve
+    (vendas, cursor_da_proxima_pagina_ou_None).
+    """
+    inicio, fim = intervalo_do_dia(dia)
+    vendas = (
+        Venda.objects
+        .filter(data_venda__gte=inicio, data_venda__lt=fim)
+        .select_related('cliente')
+        .prefetch_related(Prefetch(
+            'itens',
+            queryset=ItemVenda.objects.select_related('produto').order_by('pk'),
+        ))
+        .order_by('data_venda', 'pk')
+    )
+    if apos:
+        data_venda, pk = ler_cursor(apos)
+        vendas = vendas.filter(Q(data_venda__gt=data_venda) | Q(data_venda=data_venda, pk__gt=pk))
+
+    pagina = list(vendas[:limite + 1])
+    proximo = codificar_cursor(pagina[limite - 1]) if len(pagina) > limite else None
+    return pagina[:limite], proximo
+
+
+def resumo_do_dia(dia):
+    """Total vendido, confirmadas, pendentes e saldo devedor do dia em uma consulta."""
+    inicio, fim = intervalo_do_dia(dia)
+    resumo = (
+        Venda.objects
+        .filter(data_venda__gte=inicio, data_venda__lt=fim)
+        .aggregate(
+            valor_total_dia=Sum('valor_total'),
+            vendas_confirmadas=Count('pk', filter=Q(pago=True)),
+            vendas_pendentes=Count('pk', filter=Q(pago=False)),
+            saldo_total_devedor=Sum('saldo_devedor', filter=Q(pago=False)),
+        )
+    )
+    resumo['valor_total_dia'] = resumo['valor_total_dia'] or 0
+    resumo['saldo_total_devedor'] = resumo['saldo_total_devedor'] or 0
+    return resumo
+
+
+# Faixas de atraso (em dias desde a venda) do relatório de contas a receber
+FAIXAS_ATRASO = (
+    ('ate_7', 0, 7),
+    ('de_8_a_30', 8, 30),
+    ('de_31_a_60', 31, 60),
+    ('acima_60', 61, None),
+)
+
+AGRUPAMENTOS_ATRASO = {
+    'cliente': ('cliente', 'cliente__nome', 'cliente__equipe', 'cliente__tipo'),
+    'equipe': ('cliente__equipe',),
+}
+
+
+def contas_a_receber(agrupar_por='cliente', hoje=None, tipo=None, equipe=None, cor=None):
+    """
+    Saldo em aberto por cliente ou equipe, separado nas FAIXAS_ATRASO,
+    numa única consulta agrupada sobre as vendas não pagas. O carrinho
+    aberto de uma sessão do PDV ainda não é conta de ninguém.
+    """
+    hoje = hoje or timezone.localdate()
+    # pago__in em vez de pago=False: o SQLite gera "NOT pago", que não usa índice
+    vendas = Venda.objects.filter(pago__in=[False], saldo_devedor__gt=0, pdvsession__isnull=True)
+    if tipo:
+        vendas = vendas.filter(cliente__tipo=tipo)
+    if equipe:
+        vendas = vendas.filter(cliente__equipe=equipe)
+    if cor:
+        vendas = vendas.filter(cliente__cor=cor)
+
+    faixas = {}
+    for nome, minimo, maximo in FAIXAS_ATRASO:
+        # Venda de `n` dias atrás: data_venda no dia hoje - n (fuso local)
+        filtro = Q(data_venda__lt=intervalo_do_dia(hoje - timedelta(days=minimo))[1])
+        if maximo is not None:
+            filtro &= Q(data_venda__gte=intervalo_do_dia(hoje - timedelta(days=maximo))[0])
+        faixas[nome] = Sum('saldo_devedor', filter=filtro)
+
+    linhas = (
+        vendas
+        .values(*AGRUPAMENTOS_ATRASO[agrupar_por])
+        .annotate(
+            vendas=Count('pk'),
+            total=Sum('saldo_devedor'),
+            venda_mais_antiga=Min('data_venda'),
+            **faixas,
+        )
+        .order_by('-total')
+    )
+    for linha in linhas:
+        for nome, _, _ in FAIXAS_ATRASO:
+            linha[nome] = linha[nome] or 0
+        yield linha
@@ -0,0 +1,149 @@
+"""
+Sugestão de reposição de estoque.
+
+A velocidade de venda de cada produto sai de uma matriz produto x dia
+montada a partir do ResumoVendaDia (que é mantido pelos itens de venda)
+dos últimos JANELA_DIAS dias. Média, desvio, dias de cobertura, ponto de
+pedido e quantidade sugerida são calculados para o catálogo inteiro de
+uma vez com NumPy.
+
+O resultado fica em memória do processo até o próximo lançamento nos
+resumos de vendas ou a próxima gravação de Produto (ver resumo.py e
+signals.py).
+"""
+import math
+import threading
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Produto, ResumoVendaDia
+
+JANELA_DIAS = 28
+
+# Dias entre pedir e receber, e quantos dias de venda o pedido deve cobrir
+PRAZO_ENTREGA_DIAS = getattr(settings, 'REPOSICAO_PRAZO_DIAS', 3)
+COBERTURA_ALVO_DIAS = getattr(settings, 'REPOSICAO_COBERTURA_DIAS', 14)
+
+# Fator do estoque de segurança sobre o desvio da venda diária (~95%)
+FATOR_SEGURANCA = 1.65
+
+SEM_ESTOQUE = 'sem_estoque'
+REPOR = 'repor'
+OK = 'ok'
+PARADO = 'parado'
+
+STATUS = {
+    SEM_ESTOQUE: 'Sem estoque',
+    REPOR: 'Repor',
+    OK: 'OK',
+    PARADO: 'Sem venda no período',
+}
+ORDEM_STATUS = [SEM_ESTOQUE, REPOR, OK, PARADO]
+
+
+def matriz_de_vendas(ids, inicio, dias):
+    """Quantidade vendida por produto (linhas, na ordem de `ids`) e dia (colunas)."""
+    matriz = np.zeros((len(ids), dias))
+    linhas = list(
+        ResumoVendaDia.objects
+        .filter(dia__gte=inicio, dia__lt=inicio + timedelta(days=dias))
+        .values('produto', 'dia')
+        .annotate(quantidade=Sum('quantidade'))
+        .order_by()
+        .values_list('produto', 'dia', 'quantidade')
+    )
+    if not linhas:
+        return matriz
+
+    posicao = {pk: i for i, pk in enumerate(ids)}
+    linhas = [(posicao[pk], (dia - inicio).days, qtd) for pk, dia, qtd in linhas if pk in posicao]
+    if linhas:
+        produto, dia, quantidade = np.array(linhas).T
+        np.add.at(matriz, (produto.astype(int), dia.astype(int)), quantidade)
+    return matriz
+
+
+def calcular(hoje=None, janela=JANELA_DIAS, prazo=PRAZO_ENTREGA_DIAS, cobertura_alvo=COBERTURA_ALVO_DIAS):
+    """
+    Sugestões de todo o catálogo, {produto_id: {...}}, com velocidade
+    (unidades/dia), dias de cobertura (None sem venda), ponto de pedido,
+    quantidade sugerida e status.
+    """
+    hoje = hoje or timezone.localdate()
+    inicio = hoje - timedelta(days=janela - 1)
+    produtos = list(Produto.objects.order_by('pk').values_list('pk', 'nome', 'categoria', 'estoque'))
+    if not produtos:
+        return {}
+
+    ids = [pk for pk, _, _, _ in produtos]
+    estoque = np.array([qtd for _, _, _, qtd in produtos], dtype=float)
+    vendas = matriz_de_vendas(ids, inicio, janela)
+
+    velocidade = vendas.mean(axis=1)
+    seguranca = FATOR_SEGURANCA * vendas.std(axis=1) * math.sqrt(prazo)
+    cobertura = np.divide(estoque, velocidade, out=np.full(len(ids), np.inf), where=velocidade > 0)
+    ponto_pedido = velocidade * prazo + seguranca
+    sugerido = np.ceil(np.maximum(velocidade * (prazo + cobertura_alvo) + seguranca - estoque, 0))
+
+    status = np.where(
+        estoque <= 0, SEM_ESTOQUE,
+        np.where(velocidade == 0, PARADO, np.where(estoque <= ponto_pedido, REPOR, OK)),
+    )
+
+    return {
+        pk: {
+            'produto': pk,
+            'nome': nome,
+            'categoria': categoria,
+            'estoque': int(estoque[i]),
+            'velocidade': round(float(velocidade[i]), 2),
+            'cobertura_dias': None if math.isinf(cobertura[i]) else round(float(cobertura[i]), 1),
+            'ponto_pedido': int(math.ceil(ponto_pedido[i])),
+            'sugerido': int(sugerido[i]),
+            'status': str(status[i]),
+            'status_nome': STATUS[str(status[i])],
+        }
+        for i, (pk, nome, categoria, _) in enumerate(produtos)
+    }
+
+
+class Reposicao:
+    """Guarda o último cálculo até ser invalidado, seguro entre threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sugestoes = None
+        self._dia = None
+
+    def sugestoes(self):
+        hoje = timezone.localdate()
+        with self._lock:
+            if self._sugestoes is None or self._dia != hoje:
+                self._sugestoes = calcular(hoje)
+                self._dia = hoje
+            return self._sugestoes
+
+    def invalidar(self):
+        with self._lock:
+            self._sugestoes = None
+
+
+reposicao = Reposicao()
+
+
+def sugestoes():
+    return reposicao.sugestoes()
+
+
+def listar(status=None):
+    """Sugestões em ordem de urgência: sem estoque, repor (menor cobertura primeiro), ok e paradas."""
+    itens = [s for s in sugestoes().values() if status is None or s['status'] == status]
+    return sorted(itens, key=lambda s: (
+        ORDEM_STATUS.index(s['status']),
+        math.inf if s['cobertura_dias'] is None else s['cobertura_dias'],
+        s['nome'],
+    ))
@@ -0,0 +1,102 @@
+"""
+Reservas de estoque dos carrinhos abertos do PDV.
+
+Quando o carrinho de uma sessão é gravado (services.adicionar_ao_carrinho),
+o estoque sai do Produto e cada produto do carrinho fica reservado até
+PDV_RESERVA_MINUTOS depois da última gravação. Finalizar a venda apaga as
+reservas. Reserva vencida é carrinho abandonado: expirar_reservas() tira
+os itens da venda em andamento, o que devolve o estoque pelos sinais de
+ItemVenda, sem varrer os itens de venda.
+
+A disponibilidade de um produto é o estoque mais o que está preso em
+reservas vencidas, numa consulta só pelo índice (produto, expira_em).
+Quem precisa desse saldo expira as reservas do produto na hora, sem
+esperar o comando expirar_reservas.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ItemVenda, Produto, ReservaEstoque
+
+RESERVA_MINUTOS = getattr(settings, 'PDV_RESERVA_MINUTOS', 30)
+
+LOTE = 500
+
+
+def prazo(agora=None):
+    return (agora or timezone.now()) + timedelta(minutes=RESERVA_MINUTOS)
+
+
+def reservar_carrinho(session, quantidades):
+    """
+    Grava {produto_id: quantidade no carrinho} como reservas da venda da
+    sessão e renova o prazo de todas as reservas dela.
+    """
+    expira_em = prazo()
+    ReservaEstoque.objects.bulk_create(
+        [
+            ReservaEstoque(sessao_id=session.pk, venda_id=session.venda_id, produto_id=produto_id,
+                           quantidade=quantidade, expira_em=expira_em)
+            for produto_id, quantidade in quantidades.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['venda', 'produto'],
+        update_fields=['quantidade', 'expira_em'],
+    )
+    ReservaEstoque.objects.filter(venda_id=session.venda_id).update(expira_em=expira_em)
+
+
+def liberar_reservas(venda_id):
+    """Apaga as reservas da venda; o estoque fica com ela (venda finalizada)."""
+    ReservaEstoque.objects.filter(venda_id=venda_id).delete()
+
+
+def disponibilidade(produto_ids, agora=None):
+    """{produto_id: estoque + quantidade em reservas vencidas}."""
+    agora = agora or timezone.now()
+    linhas = (
+        Produto.objects
+        .filter(pk__in=produto_ids)
+        .annotate(vencido=Coalesce(Sum('reservas__quantidade', filter=Q(reservas__expira_em__lte=agora)), 0))
+        .values_list('pk', 'estoque', 'vencido')
+    )
+    return {pk: estoque + vencido for pk, estoque, vencido in linhas}
+
+
+def expirar_reservas(agora=None, lote=LOTE, produtos=None, exceto_venda=None):
+    """
+    Expira as reservas vencidas, `lote` por transação: os itens reservados
+    saem da venda em andamento (devolvendo o estoque) e a reserva é
+    apagada. Só mexe em vendas que ainda são o carrinho de uma sessão.
+    Devolve quantas reservas expiraram.
+    """
+    agora = agora or timezone.now()
+    vencidas = ReservaEstoque.objects.filter(expira_em__lte=agora)
+    if produtos is not None:
+        vencidas = vencidas.filter(produto_id__in=produtos)
+    if exceto_venda is not None:
+        vencidas = vencidas.exclude(venda_id=exceto_venda)
+
+    expiradas = 0
+    while True:
+        with transaction.atomic():
+            bloco = list(vencidas.order_by('expira_em').values_list('pk', 'venda_id', 'produto_id')[:lote])
+            if not bloco:
+                break
+
+            pares = {(venda_id, produto_id) for _, venda_id, produto_id in bloco}
+            itens = (
+                ItemVenda.objects
+                .filter(venda_id__in={venda_id for venda_id, _ in pares}, venda__pdvsession__isnull=False)
+                .values_list('pk', 'venda_id', 'produto_id')
+            )
+            abandonados = [pk for pk, venda_id, produto_id in itens if (venda_id, produto_id) in pares]
+            ItemVenda.objects.filter(pk__in=abandonados).delete()
+            ReservaEstoque.objects.filter(pk__in=[pk for pk, _, _ in bloco]).delete()
+        expiradas += len(bloco)
+    return expiradas
@@ -0,0 +1,286 @@
+"""
+Resumos de vendas.
+
+Mantém, por deltas e na mesma transação que altera itens e vendas:
+
+- ResumoVendaDia: dia x produto x forma de pagamento (dashboard);
+- ResumoVendaHora: hora x categoria x forma de pagamento x cliente
+  (relatórios por período em qualquer resolução);
+- CaixaTotal: forma de pagamento do caixa aberto (ver caixa.py);
+- contadores de compra do Cliente (ver clientes.py).
+
+Cada lançamento descarta as sugestões de reposição em cache (reposicao.py).
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate, TruncDay, TruncHour, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .caixa import aplicar_no_caixa, caixa_aberto_em
+from .clientes import registrar_compra
+from .models import ItemVenda, Produto, ResumoVendaDia, ResumoVendaHora, Venda
+from .relatorios import intervalo_do_dia
+from .reposicao import reposicao
+
+RESOLUCOES = {
+    'hora': TruncHour,
+    'dia': TruncDay,
+    'semana': TruncWeek,
+    'mes': TruncMonth,
+}
+
+_DA_VENDA = object()
+
+
+def dia_da_venda(venda):
+    return timezone.localdate(venda.data_venda)
+
+
+def hora_da_venda(venda):
+    return timezone.localtime(venda.data_venda).replace(minute=0, second=0, microsecond=0)
+
+
+def registrar_venda(venda, linhas, categorias=None, forma_pagamento=None, cliente_id=_DA_VENDA):
+    """
+    Soma aos resumos as linhas (produto_id, quantidade, valor) da venda.
+
+    Valores negativos estornam. Forma de pagamento e cliente são os da
+    venda, a não ser que sejam informados (usado ao mover uma venda).
+    `categorias` ({produto_id: categoria}) evita consultar o Produto.
+    """
+    deltas = {}
+    for produto_id, quantidade, valor in linhas:
+        atual = deltas.setdefault(produto_id, [0, 0])
+        atual[0] += quantidade
+        atual[1] += valor
+    deltas = {pk: d for pk, d in deltas.items() if d[0] or d[1]}
+    if not deltas:
+        return
+
+    categorias = dict(categorias or {})
+    faltando = [pk for pk in deltas if pk not in categorias]
+    if faltando:
+        categorias.update(Produto.objects.filter(pk__in=faltando).values_list('pk', 'categoria'))
+    # Produto excluído não tem mais linha de resumo para atualizar
+    deltas = {pk: d for pk, d in deltas.items() if pk in categorias}
+
+    forma_pagamento = forma_pagamento or venda.forma_pagamento
+    if cliente_id is _DA_VENDA:
+        cliente_id = venda.cliente_id
+
+    por_categoria = {}
+    for produto_id, (quantidade, valor) in deltas.items():
+        atual = por_categoria.setdefault(categorias[produto_id], [0, 0])
+        atual[0] += quantidade
+        atual[1] += valor
+
+    caixa_id = caixa_aberto_em(venda.data_venda)
+    total_quantidade = sum(quantidade for quantidade, _ in por_categoria.values())
+    total_valor = sum(valor for _, valor in por_categoria.values())
+
+    for tentativa in range(2):
+        try:
+            with transaction.atomic():
+                _aplicar_dia(dia_da_venda(venda), forma_pagamento, dict(deltas), categorias)
+                _aplicar_hora(hora_da_venda(venda), forma_pagamento, cliente_id, dict(por_categoria))
+                if caixa_id is not None:
+                    aplicar_no_caixa(caixa_id, forma_pagamento, total_quantidade, total_valor)
+                if cliente_id is not None:
+                    registrar_compra(cliente_id, total_quantidade, total_valor, venda.data_venda)
+            transaction.on_commit(reposicao.invalidar)
+            return
+        except IntegrityError:
+            # Outro terminal criou a mesma linha; na segunda vez ela já existe
+            if tentativa:
+                raise
+
+
+def _somar(existentes, deltas, chave):
+    """
+    Soma os deltas nas linhas existentes e os tira de `deltas`. Se houver
+    mais de uma linha para a mesma chave, só a primeira recebe o delta.
+    """
+    atualizar = []
+    for resumo in existentes:
+        delta = deltas.pop(getattr(resumo, chave), None)
+        if delta is None:
+            continue
+        resumo.quantidade = F('quantidade') + delta[0]
+        resumo.valor = F('valor') + delta[1]
+        atualizar.append(resumo)
+    if atualizar:
+        type(atualizar[0]).objects.bulk_update(atualizar, ['quantidade', 'valor'])
+
+
+def _aplicar_dia(dia, forma_pagamento, deltas, categorias):
+    existentes = list(
+        ResumoVendaDia.objects
+        .filter(dia=dia, forma_pagamento=forma_pagamento, produto_id__in=deltas)
+        .only('pk', 'produto_id')
+    )
+    _somar(existentes, deltas, 'produto_id')
+
+    ResumoVendaDia.objects.bulk_create([
+        ResumoVendaDia(
+            dia=dia,
+            produto_id=produto_id,
+            categoria=categorias[produto_id],
+            forma_pagamento=forma_pagamento,
+            quantidade=quantidade,
+            valor=valor,
+        )
+        for produto_id, (quantidade, valor) in deltas.items()
+    ])
+
+
+def _aplicar_hora(hora, forma_pagamento, cliente_id, deltas):
+    existentes = list(
+        ResumoVendaHora.objects
+        .filter(hora=hora, forma_pagamento=forma_pagamento, cliente_id=cliente_id, categoria__in=deltas)
+        .only('pk', 'categoria')
+    )
+    _somar(existentes, deltas, 'categoria')
+
+    ResumoVendaHora.objects.bulk_create([
+        ResumoVendaHora(
+            hora=hora,
+            categoria=categoria,
+            forma_pagamento=forma_pagamento,
+            cliente_id=cliente_id,
+            quantidade=quantidade,
+            valor=valor,
+        )
+        for categoria, (quantidade, valor) in deltas.items()
+    ])
+
+
+def transferir_cliente(cliente_id):
+    """
+    Passa as linhas por hora do cliente para as do balcão (cliente nulo),
+    como acontece com as vendas dele quando o cliente é excluído.
+    """
+    linhas = list(
+        ResumoVendaHora.objects
+        .filter(cliente_id=cliente_id)
+        .values_list('pk', 'hora', 'forma_pagamento', 'categoria', 'quantidade', 'valor')
+    )
+    if not linhas:
+        return
+
+    por_hora = {}
+    for _, hora, forma_pagamento, categoria, quantidade, valor in linhas:
+        por_hora.setdefault((hora, forma_pagamento), {})[categoria] = [quantidade, valor]
+
+    with transaction.atomic():
+        ResumoVendaHora.objects.filter(pk__in=[linha[0] for linha in linhas]).delete()
+        for (hora, forma_pagamento), deltas in por_hora.items():
+            _aplicar_hora(hora, forma_pagamento, None, deltas)
+
+
+def registrar_item(item, anterior=None):
+    """Leva aos resumos a alteração de um ItemVenda (`anterior` é o estado gravado antes)."""
+    linhas = [(item.produto_id, item.quantidade, item.subtotal)]
+    categorias = {item.produto_id: item.produto.categoria}
+
+    if anterior is not None:
+        estorno = (anterior['produto_id'], -anterior['quantidade'], -anterior['subtotal'])
+        if anterior['venda_id'] == item.venda_id:
+            linhas.append(estorno)
+        else:
+            estornar_item(anterior['venda_id'], *estorno)
+
+    registrar_venda(item.venda, linhas, categorias)
+
+
+def estornar_item(venda_id, produto_id, quantidade, valor):
+    """Linha já negativa de um item que saiu da venda `venda_id`."""
+    venda = Venda.objects.only('data_venda', 'forma_pagamento', 'cliente').filter(pk=venda_id).first()
+    if venda is not None:
+        registrar_venda(venda, [(produto_id, quantidade, valor)])
+
+
+def mover_venda(venda, forma_anterior, cliente_anterior):
+    """Passa os itens da venda da forma de pagamento/cliente antigos para os atuais."""
+    itens = list(venda.itens.values_list('produto_id', 'quantidade', 'subtotal'))
+    if not itens:
+        return
+    registrar_venda(
+        venda,
+        [(pk, -qtd, -valor) for pk, qtd, valor in itens],
+        forma_pagamento=forma_anterior,
+        cliente_id=cliente_anterior,
+    )
+    registrar_venda(venda, itens)
+
+
+def calcular_a_partir_dos_itens(desde=None):
+    """
+    Resumo diário calculado do zero a partir de ItemVenda, no formato
+    {(dia, produto_id, forma_pagamento): (categoria, quantidade, valor)}.
+    """
+    linhas = (
+        _itens_desde(desde)
+        .annotate(dia=TruncDate('venda__data_venda'))
+        .values('dia', 'produto_id', 'produto__categoria', 'venda__forma_pagamento')
+        .annotate(total_quantidade=Sum('quantidade'), total_valor=Sum('subtotal'))
+        .order_by()
+    )
+    return {
+        (linha['dia'], linha['produto_id'], linha['venda__forma_pagamento']): (
+            linha['produto__categoria'], linha['total_quantidade'], linha['total_valor'],
+        )
+        for linha in linhas
+    }
+
+
+def calcular_horas_a_partir_dos_itens(desde=None):
+    """
+    Resumo por hora calculado do zero a partir de ItemVenda, no formato
+    {(hora, categoria, forma_pagamento, cliente_id): (quantidade, valor)}.
+    """
+    linhas = (
+        _itens_desde(desde)
+        .annotate(hora=TruncHour('venda__data_venda'))
+        .values('hora', 'produto__categoria', 'venda__forma_pagamento', 'venda__cliente_id')
+        .annotate(total_quantidade=Sum('quantidade'), total_valor=Sum('subtotal'))
+        .order_by()
+    )
+    return {
+        (linha['hora'], linha['produto__categoria'], linha['venda__forma_pagamento'], linha['venda__cliente_id']): (
+            linha['total_quantidade'], linha['total_valor'],
+        )
+        for linha in linhas
+    }
+
+
+def _itens_desde(desde):
+    itens = ItemVenda.objects.all()
+    if desde is not None:
+        itens = itens.filter(venda__data_venda__gte=intervalo_do_dia(desde)[0])
+    return itens
+
+
+def serie_vendas(inicio, fim, resolucao='dia', categorias=None, cliente_id=None, formas_pagamento=None):
+    """
+    Quantidade e valor vendidos em [inicio, fim), agrupados na resolução
+    pedida ('hora', 'dia', 'semana' ou 'mes'). Lê só ResumoVendaHora.
+    """
+    resumos = (
+        ResumoVendaHora.objects
+        .filter(hora__gte=inicio, hora__lt=fim)
+        .exclude(quantidade=0, valor=0)
+    )
+    if categorias:
+        resumos = resumos.filter(categoria__in=categorias)
+    if cliente_id is not None:
+        resumos = resumos.filter(cliente_id=cliente_id)
+    if formas_pagamento:
+        resumos = resumos.filter(forma_pagamento__in=formas_pagamento)
+
+    return list(
+        resumos
+        .annotate(periodo=RESOLUCOES[resolucao]('hora'))
+        .values('periodo')
+        .annotate(quantidade=Sum('quantidade'), valor=Sum('valor'))
+        .order_by('periodo')
+    )
@@ -0,0 +1,309 @@
+"""
+Serviços do PDV.
+
+Operações de venda que tocam várias tabelas ficam aqui, fora das views,
+para que API, admin e comandos usem o mesmo caminho.
+"""
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .catalogo import buscar_produto
+from .clientes import atualizar_saldo_aberto
+from .estoque import EstoqueInsuficiente, agrupar_linhas, baixar_estoque, registrar_movimentos
+from .models import BipagemProcessada, ItemVenda, MovimentoEstoque, PDVSession, Produto, Venda
+from .reservas import expirar_reservas, liberar_reservas, reservar_carrinho
+from .resumo import registrar_venda
+from .tempo_real import evento_item, evento_total, publicar_quando_confirmar
+
+# Faixa 2x do EAN-13 é reservada para uso interno da loja
+PREFIXO_CODIGO_VENDA = '29'
+
+# Dias que a chave de uma bipagem aplicada é lembrada: um diário do PDV
+# parado offline por mais tempo que isso reaplicaria as bipagens
+DIAS_BIPAGENS = 7
+
+
+def gerar_codigo_venda(venda_id):
+    """Código EAN-13 do cupom, derivado do id da venda."""
+    corpo = f"{PREFIXO_CODIGO_VENDA}{venda_id:010d}"
+    soma = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(corpo))
+    return f"{corpo}{(10 - soma % 10) % 10}"
+
+
+def _resolver_produtos(codigos):
+    produtos = {
+        p['codigo_barras']: p
+        for p in Produto.objects
+        .filter(codigo_barras__in=codigos)
+        .values('pk', 'codigo_barras', 'nome', 'preco', 'categoria')
+    }
+    faltando = [codigo for codigo in codigos if codigo not in produtos]
+    if faltando:
+        raise ValidationError(f"Produto não encontrado: {', '.join(faltando)}")
+    return produtos
+
+
+def finalizar_venda(itens, forma_pagamento, valor_pago=None, cliente=None):
+    """
+    Fecha uma cesta inteira numa única transação.
+
+    `itens` é uma sequência de pares (codigo_barras, quantidade). A venda e
+    todos os itens são gravados com bulk_create, o estoque sai num único
+    UPDATE condicional e o total é calculado uma vez só.
+
+    Levanta ValidationError (ou EstoqueInsuficiente) sem gravar nada se a
+    cesta for inválida.
+    """
+    itens = list(itens)
+    for codigo, quantidade in itens:
+        if not isinstance(quantidade, int) or quantidade <= 0:
+            raise ValidationError(f"Quantidade inválida para {codigo}.")
+
+    quantidades = agrupar_linhas(itens)
+    if not quantidades:
+        raise ValidationError("A venda não tem itens.")
+
+    venda = Venda(cliente=cliente, forma_pagamento=forma_pagamento, valor_pago=valor_pago)
+    venda.full_clean()
+
+    with transaction.atomic():
+        produtos = _resolver_produtos(list(quantidades))
+
+        # O livro de estoque é gravado junto com os itens, logo abaixo
+        falhas = baixar_estoque(
+            ((produtos[codigo]['pk'], quantidade) for codigo, quantidade in quantidades.items()),
+            motivo=None,
+        )
+        if falhas:
+            raise EstoqueInsuficiente(falhas, {p['pk']: p['nome'] for p in produtos.values()})
+
+        linhas = [
+            (produtos[codigo], quantidade, produtos[codigo]['preco'] * quantidade)
+            for codigo, quantidade in quantidades.items()
+        ]
+        venda.valor_total = sum((subtotal for _, _, subtotal in linhas), Decimal('0.00'))
+        venda.aplicar_regras_pagamento()
+        Venda.objects.bulk_create([venda])
+        # bulk_create não passa por Venda.save; mudanças posteriores movem os resumos
+        venda._estado_salvo = (venda.forma_pagamento, venda.cliente_id)
+
+        venda.codigo_barras = gerar_codigo_venda(venda.pk)
+        Venda.objects.filter(pk=venda.pk).update(codigo_barras=venda.codigo_barras)
+        atualizar_saldo_aberto([venda.cliente_id])
+
+        itens = ItemVenda.objects.bulk_create([
+            ItemVenda(venda=venda, produto_id=produto['pk'], quantidade=quantidade, subtotal=subtotal)
+            for produto, quantidade, subtotal in linhas
+        ])
+        registrar_movimentos(
+            [(item.produto_id, -item.quantidade, item.pk) for item in itens],
+            MovimentoEstoque.VENDA, venda.pk,
+        )
+
+        registrar_venda(
+            venda,
+            [(produto['pk'], quantidade, subtotal) for produto, quantidade, subtotal in linhas],
+            {produto['pk']: produto['categoria'] for produto, _, _ in linhas},
+        )
+
+    return venda
+
+
+def get_or_create_pdv_session(user):
+    """Sessão do PDV do usuário, já com uma venda em andamento."""
+    session, _ = PDVSession.objects.select_related('venda').get_or_create(user=user)
+    if session.venda is None:
+        session.venda = Venda.objects.create(forma_pagamento='em aberto')
+        session.save(update_fields=['venda'])
+    return session
+
+
+def adicionar_ao_carrinho(session, linhas, eventos=None, publicar=True):
+    """
+    Aplica uma rajada de bipagens ao carrinho da sessão numa transação só.
+
+    `linhas` é uma sequência de pares (codigo_barras, quantidade). Códigos
+    desconhecidos e produtos sem estoque não impedem os demais; voltam na
+    lista de erros como {"codigo": ..., "erro": ...}.
+
+    Os deltas do carrinho (itens alterados e o novo total) vão para a lista
+    `eventos`, se passada, e, com `publicar`, para quem assina a sessão em
+    tempo_real.
+    """
+    erros = []
+    quantidades = {}
+    for codigo, quantidade in agrupar_linhas(linhas).items():
+        if quantidade <= 0:
+            erros.append({"codigo": codigo, "erro": "Quantidade inválida"})
+            continue
+        produto = buscar_produto(codigo)
+        if produto is None:
+            erros.append({"codigo": codigo, "erro": "Produto não encontrado"})
+            continue
+        produto['codigo_barras'] = codigo
+        anterior = quantidades.get(produto['id'], (produto, 0))[1]
+        quantidades[produto['id']] = (produto, anterior + quantidade)
+
+    venda = session.venda
+    with transaction.atomic():
+        # Baixa tudo que tiver saldo; quem não tiver sai da rajada
+        recuperado = False
+        while quantidades:
+            falhas = baixar_estoque(((pk, qtd) for pk, (_, qtd) in quantidades.items()), motivo=None)
+            if not falhas:
+                break
+            if not recuperado:
+                # Carrinhos abandonados devolvem o estoque antes da recusa
+                recuperado = True
+                if expirar_reservas(produtos=[pk for pk, _, _ in falhas], exceto_venda=venda.pk):
+                    continue
+            for produto_id, _, disponivel in falhas:
+                produto, _ = quantidades.pop(produto_id)
+                erros.append({
+                    "codigo": produto['codigo_barras'],
+                    "erro": f"Estoque insuficiente para {produto['nome']}. Disponível: {disponivel}",
+                })
+
+        if not quantidades:
+            return erros
+
+        existentes = {
+            item.produto_id: item
+            for item in venda.itens.filter(produto_id__in=quantidades)
+        }
+        novos, alterados, resumo = [], [], []
+        delta = Decimal('0.00')
+        for produto_id, (produto, quantidade) in quantidades.items():
+            item = existentes.get(produto_id)
+            if item is None:
+                item = ItemVenda(venda=venda, produto_id=produto_id, quantidade=quantidade,
+                                 subtotal=produto['preco'] * quantidade)
+                novos.append(item)
+                diferenca = item.subtotal
+            else:
+                subtotal_anterior = item.subtotal
+                item.quantidade += quantidade
+                item.subtotal = produto['preco'] * item.quantidade
+                alterados.append(item)
+                diferenca = item.subtotal - subtotal_anterior
+            delta += diferenca
+            resumo.append((produto_id, quantidade, diferenca))
+
+        ItemVenda.objects.bulk_create(novos)
+        ItemVenda.objects.bulk_update(alterados, ['quantidade', 'subtotal'])
+        reservar_carrinho(session, {item.produto_id: item.quantidade for item in novos + alterados})
+        registrar_movimentos(
+            [(item.produto_id, -quantidades[item.produto_id][1], item.pk) for item in novos + alterados],
+            MovimentoEstoque.VENDA, venda.pk,
+        )
+        if delta:
+            venda.aplicar_delta_total(delta)
+        registrar_venda(venda, resumo, {pk: p['categoria'] for pk, (p, _) in quantidades.items()})
+
+        deltas = [
+            evento_item(item.produto_id, quantidades[item.produto_id][0]['codigo_barras'],
+                        quantidades[item.produto_id][0]['nome'], item.quantidade,
+                        quantidades[item.produto_id][0]['preco'], item.subtotal)
+            for item in novos + alterados
+        ]
+        deltas.append(evento_total(venda.valor_total))
+        if eventos is not None:
+            eventos.extend(deltas)
+        if publicar:
+            publicar_quando_confirmar(session.pk, deltas)
+
+    return erros
+
+
+def aplicar_bipagens(session, bipagens, eventos=None, publicar=True):
+    """
+    Aplica bipagens (codigo, quantidade, chave) numa transação só, pulando
+    as chaves já processadas. É o caminho da reposição do diário offline do
+    PDV: centenas de bipagens reenviadas de uma vez, talvez repetidas.
+
+    Bipagens sem chave (None) entram sempre. Devolve (erros, repetidas).
+    """
+    with transaction.atomic():
+        chaves = {chave for _, _, chave in bipagens if chave}
+        vistas = set(BipagemProcessada.objects.filter(chave__in=chaves).values_list('chave', flat=True))
+        repetidas = 0
+        novas = []
+        for codigo, quantidade, chave in bipagens:
+            if chave and chave in vistas:
+                repetidas += 1
+                continue
+            if chave:
+                vistas.add(chave)
+            novas.append((codigo, quantidade, chave))
+
+        linhas = [(codigo, qtd) for codigo, qtd, _ in novas]
+        erros = adicionar_ao_carrinho(session, linhas, eventos, publicar) if novas else []
+
+        # Chave de bipagem recusada não é gravada: reenviar não baixa nada a mais
+        recusados = {erro["codigo"] for erro in erros}
+        BipagemProcessada.objects.bulk_create([
+            BipagemProcessada(chave=chave, usuario_id=session.user_id, venda_id=session.venda_id)
+            for codigo, _, chave in novas
+            if chave and codigo not in recusados
+        ])
+    return erros, repetidas
+
+
+def esquecer_bipagens(antes_de, lote=5000):
+    """Apaga, `lote` por vez, as chaves de bipagem gravadas antes de `antes_de`. Devolve quantas."""
+    antigas = BipagemProcessada.objects.filter(criada_em__lt=antes_de)
+    apagadas = 0
+    while True:
+        bloco = list(antigas.order_by('criada_em').values_list('pk', flat=True)[:lote])
+        if not bloco:
+            return apagadas
+        BipagemProcessada.objects.filter(pk__in=bloco).delete()
+        apagadas += len(bloco)
+
+
+def finalizar_carrinho(session, forma_pagamento, valor_pago=None, cliente=None):
+    """
+    Fecha a venda em andamento da sessão do PDV com a forma de pagamento
+    escolhida e deixa a sessão livre para a próxima venda. O carrinho já
+    precisa estar gravado (ver carrinho.Carrinhos.fechar).
+    """
+    venda = session.venda
+    if venda is None or not venda.itens.exists():
+        raise ValidationError("A venda não tem itens.")
+
+    with transaction.atomic():
+        venda.forma_pagamento = forma_pagamento
+        venda.valor_pago = valor_pago
+        venda.cliente = cliente
+        venda.save()
+
+        venda.codigo_barras = gerar_codigo_venda(venda.pk)
+        Venda.objects.filter(pk=venda.pk).update(codigo_barras=venda.codigo_barras)
+        liberar_reservas(venda.pk)
+
+        session.venda = None
+        session.save(update_fields=['venda'])
+    return venda
+
+
+def carrinho(venda):
+    """Estado do carrinho para a tela do PDV."""
+    itens = (
+        venda.itens
+        .select_related('produto')
+        .order_by('pk')
+    )
+    return {
+        "venda": venda.pk,
+        "itens": [{
+            "produto_id": item.produto_id,
+            "produto": item.produto.nome,
+            "codigo_barras": item.produto.codigo_barras,
+            "quantidade": item.quantidade,
+            "preco": float(item.subtotal / item.quantidade),
+            "subtotal": float(item.subtotal),
+        } for item in itens],
+        "total": float(venda.valor_total),
+    }
@@ -1,21 +1,90 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from decimal import Decimal
-from django.db.models import Sum, F
-from .models import ItemVenda, Venda
+from simple_history.signals import post_create_historical_record
+from .busca import indice
+from .catalogo import catalogo
+from .clientes import atualizar_saldo_aberto
+from .models import Cliente, ItemVenda, PDVSession, Produto, Venda
+from .reposicao import reposicao
+from .resumo import estornar_item, registrar_venda, transferir_cliente
+from .tempo_real import evento_removido, evento_total, hub, publicar_quando_confirmar
 
-@receiver([post_save, post_delete], sender=ItemVenda)
+
+@receiver([post_save, post_delete], sender=Produto)
+def invalidar_catalogo(sender, instance, **kwargs):
+    catalogo.invalidar(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Produto)
+def invalidar_reposicao(sender, instance, **kwargs):
+    reposicao.invalidar()
+
+
+@receiver(post_save, sender=Produto)
+def reindexar_busca(sender, instance, **kwargs):
+    indice.atualizar(instance)
+
+
+@receiver(post_delete, sender=Produto)
+def remover_da_busca(sender, instance, **kwargs):
+    indice.remover(instance.pk)
+
+
+@receiver(post_create_historical_record, sender=Produto.history.model)
+def invalidar_catalogo_historico(sender, instance, **kwargs):
+    catalogo.invalidar(instance.pk)
+
+
+@receiver(post_delete, sender=ItemVenda)
 def atualizar_valor_total_venda(sender, instance, **kwargs):
-    venda = instance.venda
-    total = venda.itens.aggregate(
-        total=Sum(F('quantidade') * F('produto__preco'))
-    )['total'] or Decimal('0.00')
+    """Desconta do total da venda o subtotal do item excluído."""
+    estado = instance._estado_salvo or {'subtotal': instance.subtotal}
+    subtotal = estado['subtotal']
+    if not subtotal:
+        return
+
+    if ItemVenda.venda.is_cached(instance):
+        instance.venda.aplicar_delta_total(-subtotal)
+    else:
+        venda = Venda.objects.filter(pk=instance.venda_id)
+        venda.update(**Venda.expressoes_totais(-subtotal))
+        atualizar_saldo_aberto(venda.values('cliente_id'))
+
+
+@receiver(post_delete, sender=Venda)
+def atualizar_saldo_cliente(sender, instance, **kwargs):
+    atualizar_saldo_aberto([instance.cliente_id])
 
-    venda.valor_total = total
 
-    if venda.forma_pagamento == 'dinheiro' and venda.valor_pago is not None:
-        venda.troco = max(venda.valor_pago - total, Decimal('0.00'))
+@receiver(pre_delete, sender=Cliente)
+def transferir_resumo_cliente(sender, instance, **kwargs):
+    """As vendas do cliente excluído ficam sem cliente; os resumos por hora também."""
+    transferir_cliente(instance.pk)
+
+
+@receiver(post_delete, sender=ItemVenda)
+def estornar_resumo_venda(sender, instance, **kwargs):
+    estado = instance._estado_salvo or {
+        'produto_id': instance.produto_id,
+        'quantidade': instance.quantidade,
+        'subtotal': instance.subtotal,
+    }
+    linha = (estado['produto_id'], -estado['quantidade'], -estado['subtotal'])
+
+    if ItemVenda.venda.is_cached(instance):
+        registrar_venda(instance.venda, [linha])
     else:
-        venda.troco = None
+        estornar_item(instance.venda_id, *linha)
+
 
-    venda.save(update_fields=['valor_total', 'troco'], validate=False)
+@receiver(post_delete, sender=ItemVenda)
+def publicar_item_removido(sender, instance, **kwargs):
+    """Avisa a tela do PDV que acompanha a venda, se houver alguma aberta."""
+    if not hub.tem_assinantes():
+        return
+    sessao_id = PDVSession.objects.filter(venda_id=instance.venda_id).values_list('pk', flat=True).first()
+    if sessao_id is None:
+        return
+    estado = instance._estado_salvo or {'produto_id': instance.produto_id}
+    total = Venda.objects.filter(pk=instance.venda_id).values_list('valor_total', flat=True).first() or 0
+    publicar_quando_confirmar(sessao_id, [evento_removido(estado['produto_id']), evento_total(total)])
@@ -1,45 +1,190 @@
+// Bipagens que chegam dentro desta janela vão juntas numa requisição só
+const JANELA_BIPAGEM_MS = 80;
+
+// Sem conexão, as bipagens ficam no diário e o envio é tentado de novo
+const RETENTAR_MS = 3000;
+// Um diário por usuário: quem entrar depois no mesmo navegador não reenvia
+// as bipagens do outro no próprio carrinho
+const CHAVE_DIARIO = `pdv.diario.${document.getElementById("barcode")?.dataset.usuario || "visor"}`;
+
+// Diário local: toda bipagem entra aqui com uma chave de idempotência e só
+// sai quando o servidor responde sem ela em "pendentes", isto é, depois que
+// ela foi gravada no banco (ou recusada). Reenviar a mesma chave não baixa o
+// estoque duas vezes, então perder a resposta ou o servidor cair antes de
+// gravar não perde nem duplica a bipagem.
+let diario = lerDiario();
+let timerBipagens = null;
+let prazoEnvio = 0;
+let enviandoBipagens = false;
+let semConexao = false;
+
 document.addEventListener("DOMContentLoaded", function () {
-    const input = document.getElementById("codigo_barras");
+    conectarEventos();
+
+    const input = document.getElementById("barcode");
+    if (!input) return;
+
+    // Reenvia o que ficou no diário de uma queda anterior
+    window.addEventListener("online", () => agendarEnvio());
+    agendarEnvio();
 
-    input.addEventListener("keypress", async function (e) {
+    input.addEventListener("keypress", function (e) {
         if (e.key === "Enter") {
             e.preventDefault();
             const codigo = input.value.trim();
+            input.value = "";
             if (!codigo) return;
 
-            try {
-                const response = await fetch(`/api/pdv/scan/?codigo=${codigo}`);
-                const data = await response.json();
-
-                if (data.erro) {
-                    alert(data.erro);
-                    input.value = "";
-                    return;
-                }
-
-                atualizarTabela(data);
-                input.value = "";
-            } catch (error) {
-                console.error("Erro:", error);
-            }
+            enfileirarBipagem(codigo);
         }
     });
 });
 
-function atualizarTabela(data) {
-    const tbody = document.getElementById("tabela-itens");
-    const totalEl = document.getElementById("total-geral");
+function lerDiario() {
+    try {
+        return JSON.parse(localStorage.getItem(CHAVE_DIARIO)) || [];
+    } catch (error) {
+        return [];
+    }
+}
+
+function gravarDiario() {
+    localStorage.setItem(CHAVE_DIARIO, JSON.stringify(diario));
+    mostrarPendentes();
+}
+
+function mostrarPendentes() {
+    const status = document.getElementById("pdv-status");
+    if (!status) return;
+    status.innerText = semConexao && diario.length ? `Sem conexão: ${diario.length} bipagem(ns) pendente(s)` : "";
+}
+
+function novaChave() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + "-" + Math.random().toString(36).slice(2, 12);
+}
+
+function enfileirarBipagem(codigo) {
+    diario.push({ chave: novaChave(), codigo, quantidade: 1 });
+    gravarDiario();
+    agendarEnvio();
+}
+
+function agendarEnvio(espera = JANELA_BIPAGEM_MS) {
+    if (enviandoBipagens || !diario.length) return;
+    // Bipagem nova não espera a conferência das já enviadas
+    const prazo = Date.now() + espera;
+    if (timerBipagens) {
+        if (prazo >= prazoEnvio) return;
+        clearTimeout(timerBipagens);
+    }
+    prazoEnvio = prazo;
+    timerBipagens = setTimeout(enviarBipagens, espera);
+}
+
+async function enviarBipagens() {
+    timerBipagens = null;
+    if (!diario.length) return;
+
+    // O diário inteiro vai numa requisição só; o servidor aplica numa transação
+    const codigos = diario.slice();
+    enviandoBipagens = true;
+    let espera = RETENTAR_MS;
+
+    try {
+        const response = await fetch("/api/pdv/scan/", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ codigos })
+        });
+        if (response.status >= 500) throw new Error(`HTTP ${response.status}`);
+        const data = await response.json();
 
-    const novaLinha = `
-        <tr>
-            <td>${data.produto}</td>
-            <td>${data.quantidade}</td>
-            <td>R$ ${data.subtotal.toFixed(2)}</td>
-            <td>R$ ${data.total_venda.toFixed(2)}</td>
-        </tr>
-    `;
+        // Respondido: saem do diário as chaves enviadas, mesmo com erro de
+        // produto, menos as que o servidor ainda não gravou
+        const pendentes = new Set(data.pendentes || []);
+        const enviadas = new Set(codigos.map(b => b.chave).filter(chave => !pendentes.has(chave)));
+        diario = diario.filter(b => !enviadas.has(b.chave));
+        semConexao = false;
+        gravarDiario();
+        // O que foi bipado durante o envio segue logo; o resto é conferido depois
+        if (diario.some(b => !codigos.includes(b))) espera = JANELA_BIPAGEM_MS;
+
+        if (data.alterados) {
+            data.alterados.forEach(aplicarItem);
+            definirTotal(data.total);
+        }
+        if (data.erros && data.erros.length) {
+            alert(data.erros.map(e => `${e.codigo}: ${e.erro}`).join("\n"));
+        }
+    } catch (error) {
+        console.error("Erro:", error);
+        semConexao = true;
+        mostrarPendentes();
+    } finally {
+        enviandoBipagens = false;
+        agendarEnvio(espera);
+    }
+}
+
+// Carrinho empurrado pelo servidor: inteiro ao conectar, depois só deltas.
+// O EventSource reconecta sozinho e recebe o carrinho inteiro de novo.
+function conectarEventos() {
+    const tbody = document.getElementById("itens-list");
+    if (!tbody || !tbody.dataset.eventos || !window.EventSource) return;
+
+    const fonte = new EventSource(tbody.dataset.eventos);
+    fonte.addEventListener("carrinho", e => atualizarTabela(JSON.parse(e.data)));
+    fonte.addEventListener("item", e => aplicarItem(JSON.parse(e.data)));
+    fonte.addEventListener("removido", e => removerItem(JSON.parse(e.data).produto_id));
+    fonte.addEventListener("total", e => definirTotal(JSON.parse(e.data).total));
+}
+
+// Nome do produto vem do cadastro: entra como texto, nunca como HTML
+function preencherLinha(tr, item) {
+    const celulas = [
+        item.produto,
+        item.quantidade,
+        `R$ ${item.preco.toFixed(2)}`,
+        `R$ ${item.subtotal.toFixed(2)}`,
+    ].map(texto => {
+        const td = document.createElement("td");
+        td.textContent = texto;
+        return td;
+    });
+    tr.replaceChildren(...celulas);
+}
+
+function novaLinha(item) {
+    const tr = document.createElement("tr");
+    tr.dataset.produto = item.produto_id;
+    preencherLinha(tr, item);
+    return tr;
+}
+
+function aplicarItem(item) {
+    const tbody = document.getElementById("itens-list");
+    const tr = tbody.querySelector(`tr[data-produto="${Number(item.produto_id)}"]`);
+    if (tr) {
+        preencherLinha(tr, item);
+    } else {
+        tbody.appendChild(novaLinha(item));
+    }
+}
+
+function removerItem(produtoId) {
+    const tr = document.getElementById("itens-list").querySelector(`tr[data-produto="${Number(produtoId)}"]`);
+    if (tr) tr.remove();
+}
+
+function definirTotal(total) {
+    document.getElementById("total-geral").innerText = total.toFixed(2);
+}
+
+function atualizarTabela(data) {
+    const tbody = document.getElementById("itens-list");
 
-    tbody.innerHTML += novaLinha;
+    tbody.replaceChildren(...data.itens.map(novaLinha));
 
-    totalEl.innerText = `Total: R$ ${data.total_venda.toFixed(2)}`;
+    definirTotal(data.total);
 }
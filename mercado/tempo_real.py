@@ -0,0 +1,123 @@
+"""
+Atualizações do carrinho do PDV empurradas pelo servidor (SSE).
+
+Cada PDVSession tem um canal. A tela do caixa e o visor do cliente abrem
+/api/pdv/eventos/ (um EventSource, mantido aberto pelo servidor ASGI) e
+recebem o carrinho inteiro uma vez na conexão; depois, só os deltas:
+
+- item: produto adicionado ou com quantidade nova;
+- removido: produto que saiu do carrinho;
+- total: novo total da venda.
+
+O hub vive na memória do processo: quem publica (views síncronas, em
+threads) e quem escuta (no laço asyncio do servidor) precisam estar no
+mesmo processo. Com vários processos, o PDV continua funcionando pela
+resposta do próprio scan, só sem o visor.
+
+Sob WSGI cada conexão aberta prenderia um worker para sempre: as telas só
+abrem o fluxo quando a página veio de um servidor ASGI (ver sob_asgi).
+"""
+import asyncio
+import json
+import threading
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+
+# Intervalo dos comentários que mantêm a conexão viva em proxies
+INTERVALO_PING = 15
+
+
+class HubCarrinhos:
+    """Assinantes por sessão do PDV; publicar() pode ser chamado de qualquer thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assinantes = {}
+
+    def assinar(self, sessao_id):
+        """Fila do laço asyncio atual que passa a receber os eventos da sessão."""
+        assinatura = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._assinantes.setdefault(sessao_id, set()).add(assinatura)
+        return assinatura
+
+    def cancelar(self, sessao_id, assinatura):
+        with self._lock:
+            assinaturas = self._assinantes.get(sessao_id)
+            if assinaturas is not None:
+                assinaturas.discard(assinatura)
+                if not assinaturas:
+                    del self._assinantes[sessao_id]
+
+    def tem_assinantes(self, sessao_id=None):
+        with self._lock:
+            return bool(self._assinantes.get(sessao_id) if sessao_id is not None else self._assinantes)
+
+    def publicar(self, sessao_id, eventos):
+        with self._lock:
+            assinaturas = list(self._assinantes.get(sessao_id, ()))
+        for loop, fila in assinaturas:
+            for evento in eventos:
+                try:
+                    loop.call_soon_threadsafe(fila.put_nowait, evento)
+                except RuntimeError:
+                    # Laço já encerrado; a assinatura sai quando o fluxo fechar
+                    pass
+
+
+hub = HubCarrinhos()
+
+
+def sob_asgi(request):
+    """A requisição chegou por um servidor ASGI, que aguenta o fluxo aberto."""
+    return isinstance(request, ASGIRequest)
+
+
+def evento_item(produto_id, codigo_barras, nome, quantidade, preco, subtotal):
+    return ('item', {
+        "produto_id": produto_id,
+        "codigo_barras": codigo_barras,
+        "produto": nome,
+        "quantidade": quantidade,
+        "preco": float(preco),
+        "subtotal": float(subtotal),
+    })
+
+
+def evento_removido(produto_id):
+    return ('removido', {"produto_id": produto_id})
+
+
+def evento_total(total):
+    return ('total', {"total": float(total)})
+
+
+def publicar_quando_confirmar(sessao_id, eventos):
+    """Publica os eventos da sessão depois que a transação atual confirmar."""
+    if eventos and hub.tem_assinantes(sessao_id):
+        transaction.on_commit(lambda: hub.publicar(sessao_id, eventos))
+
+
+def formatar(tipo, dados):
+    return f"event: {tipo}\ndata: {json.dumps(dados)}\n\n"
+
+
+async def fluxo_de_eventos(sessao_id, inicial):
+    """
+    Gerador do corpo text/event-stream: o carrinho `inicial` e depois os
+    deltas publicados, com um ping a cada INTERVALO_PING segundos.
+    """
+    assinatura = hub.assinar(sessao_id)
+    _, fila = assinatura
+    try:
+        yield formatar('carrinho', inicial)
+        while True:
+            try:
+                tipo, dados = await asyncio.wait_for(fila.get(), INTERVALO_PING)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield formatar(tipo, dados)
+    finally:
+        hub.cancelar(sessao_id, assinatura)
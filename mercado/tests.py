@@ -1,3 +1,1446 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import os
+import sqlite3
+import tempfile
+from contextlib import closing
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.models import CHANGE, LogEntry
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .admin import ContagemAproximadaPaginator, ContagemPodadaPaginator, LogEntryProxyAdmin
+from .busca import IndiceProdutos, buscar_ids, indice as indice_busca
+from .caixa import calcular_totais, recalcular_totais
+from .carrinho import VENDA_ALTERADA, carrinhos
+from .catalogo import CatalogoCache, catalogo
+from .clientes import contadores_divergentes, recalcular_contadores
+from .estoque import EstoqueInsuficiente, baixar_estoque, devolver_estoque
+from .inventario import estoque_em, fotografar_dia
+from .models import (
+    BipagemProcessada, Caixa, Cliente, ImpressaoCupom, ItemVenda, MovimentoEstoque, PDVSession, Produto, ReservaEstoque,
+    ResumoHistorico, ResumoVendaDia, ResumoVendaHora, SaldoEstoque, Venda,
+)
+from .perifericos import CORTAR, INICIAR, DaemonPerifericos, cupom_escpos, enfileirar_cupom
+from .quitacao import pendentes, quitar_vendas
+from .relatorios import FAIXAS_ATRASO, contas_a_receber, intervalo_do_dia, vendas_do_dia
+from .reposicao import PARADO, calcular as calcular_reposicao, listar as listar_reposicao, reposicao
+from .reservas import disponibilidade
+from .resumo import dia_da_venda
+from .services import adicionar_ao_carrinho, finalizar_carrinho, finalizar_venda, get_or_create_pdv_session
+from .tempo_real import hub
+
+
+class IndicesRelatoriosTests(TestCase):
+    """Os agregados do dia/período devem ser varreduras por faixa de índice."""
+
+    def setUp(self):
+        self.inicio, self.fim = intervalo_do_dia(date(2026, 1, 15))
+
+    def assertUsaIndice(self, queryset, indice):
+        plano = queryset.explain()
+        self.assertRegex(plano, rf"USING (COVERING )?INDEX {indice}\b")
+
+    def test_resumo_do_dia_usa_indice_data_pago(self):
+        vendas = Venda.objects.filter(data_venda__gte=self.inicio, data_venda__lt=self.fim, pago=False)
+        self.assertUsaIndice(vendas.values('pk'), 'venda_data_pago_idx')
+
+    def test_vendas_por_forma_usam_indice_data_forma(self):
+        vendas = (
+            Venda.objects
+            .filter(data_venda__gte=self.inicio, data_venda__lt=self.fim)
+            .values('forma_pagamento')
+            .annotate(vendas=Count('pk'))
+        )
+        self.assertUsaIndice(vendas, 'venda_data_forma_idx')
+
+    def test_contas_a_receber_usam_indice_pago_data(self):
+        vendas = (
+            Venda.objects
+            .filter(pago__in=[False], saldo_devedor__gt=0)
+            .values('cliente')
+            .annotate(vendas=Count('pk'))
+        )
+        self.assertUsaIndice(vendas, 'venda_pago_data_idx')
+
+    def test_itens_da_venda_por_produto_usam_indice_venda_produto(self):
+        itens = ItemVenda.objects.filter(venda_id=1, produto_id=2).values('subtotal')
+        self.assertUsaIndice(itens, 'itemvenda_venda_produto_idx')
+
+    def test_filtros_do_log_do_admin_usam_indices_com_data(self):
+        filtros = {
+            'user_id': 'mercado_log_usuario_data_idx',
+            'content_type_id': 'mercado_log_tipo_data_idx',
+            'action_flag': 'mercado_log_acao_data_idx',
+        }
+        for campo, indice in filtros.items():
+            with self.subTest(campo=campo):
+                log = LogEntry.objects.filter(**{campo: 1}).order_by('-action_time').values('pk')[:100]
+                self.assertUsaIndice(log, indice)
+
+
+class AdminConsultasTests(TestCase):
+    """O número de consultas das telas do admin não pode crescer com as linhas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', password='admin')
+        Produto.objects.create(nome='Água', preco=Decimal('3.00'), estoque=1000, categoria='bebida_nao_alcoolica', codigo_barras='789001')
+        Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=1000, categoria='comida', codigo_barras='789002')
+        cls.cliente = Cliente.objects.create(nome='Equipe Azul', tipo='conta', equipe='azul')
+        Caixa.objects.create(valor_inicial=Decimal('100.00'))
+        for _ in range(25):
+            finalizar_venda([('789001', 2), ('789002', 1)], 'em aberto', cliente=cls.cliente)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def test_changelist_vendas(self):
+        with self.assertNumQueries(7):
+            resposta = self.client.get(reverse('admin:mercado_venda_changelist'))
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_inline_vendas_do_cliente(self):
+        with self.assertNumQueries(6):
+            resposta = self.client.get(reverse('admin:mercado_cliente_change', args=[self.cliente.pk]))
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_changelist_resumo_clientes(self):
+        with self.assertNumQueries(5):
+            resposta = self.client.get(reverse('admin:mercado_clienteresumo_changelist'))
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_changelist_caixas(self):
+        with self.assertNumQueries(5):
+            resposta = self.client.get(reverse('admin:mercado_caixa_changelist'))
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_contagem_aproximada_sem_filtro(self):
+        paginador = ContagemAproximadaPaginator(Venda.objects.order_by('pk'), 10)
+        paginador.LIMITE_EXATO = 0
+        Venda.objects.filter(pk=Venda.objects.order_by('pk').first().pk).delete()
+        # Maior id, não COUNT(*): a venda excluída ainda conta
+        self.assertEqual(paginador.count, 25)
+        filtrado = ContagemAproximadaPaginator(Venda.objects.filter(pago=False).order_by('pk'), 10)
+        self.assertEqual(filtrado.count, 24)
+
+    def test_contagem_do_log_podado_pelo_comeco(self):
+        self.assertIs(LogEntryProxyAdmin.paginator, ContagemPodadaPaginator)
+        tipo = ContentType.objects.get_for_model(Venda)
+        for venda in Venda.objects.order_by('pk')[:10]:
+            LogEntry.objects.create(user=self.usuario, content_type=tipo, object_id=str(venda.pk), object_repr=str(venda), action_flag=CHANGE)
+        # arquivar_historico leva as linhas mais antigas
+        LogEntry.objects.filter(pk__in=LogEntry.objects.order_by('pk').values('pk')[:6]).delete()
+
+        paginador = ContagemPodadaPaginator(LogEntry.objects.order_by('pk'), 10)
+        paginador.LIMITE_EXATO = 0
+        self.assertEqual(paginador.count, 4)
+
+
+class PerifericosSeriaisTests(SimpleTestCase):
+    """O daemon de periféricos roda contra pseudo-terminais, sem hardware."""
+
+    def abrir_pty(self):
+        mestre, escravo = os.openpty()
+        self.addCleanup(os.close, mestre)
+        self.addCleanup(os.close, escravo)
+        os.set_blocking(mestre, False)
+        return mestre, os.ttyname(escravo)
+
+    def terminal(self, leitores=(), impressora=None):
+        return {'leitores': list(leitores), 'impressora': impressora, 'baudrate': 9600}
+
+    async def esperar(self, condicao, limite=3.0):
+        prazo = asyncio.get_running_loop().time() + limite
+        while not condicao():
+            if asyncio.get_running_loop().time() > prazo:
+                self.fail("Tempo esgotado esperando o daemon.")
+            await asyncio.sleep(0.01)
+
+    def test_leitores_alimentam_o_carrinho_de_cada_terminal(self):
+        mestre1, porta1 = self.abrir_pty()
+        mestre2, porta2 = self.abrir_pty()
+        bipagens = []
+
+        def bipar(usuario, codigos):
+            bipagens.extend((usuario, codigo) for codigo in codigos)
+            return []
+
+        async def cenario():
+            daemon = DaemonPerifericos(
+                {'caixa1': self.terminal([porta1]), 'caixa2': self.terminal([porta2])},
+                bipar=bipar, janela=60,
+            )
+            tarefa = asyncio.create_task(daemon.rodar())
+            await asyncio.sleep(0.05)
+            # Leitura repetida (debounce) e código partido em duas escritas
+            os.write(mestre1, b'789001\r\n789001\r\n')
+            os.write(mestre2, b'7890')
+            await asyncio.sleep(0.02)
+            os.write(mestre2, b'02\n')
+            os.write(mestre1, b'789003\r\n')
+            await self.esperar(lambda: len(bipagens) >= 3)
+            await asyncio.sleep(0.05)
+            daemon.parar()
+            await tarefa
+
+        asyncio.run(cenario())
+        self.assertEqual(sorted(bipagens), [('caixa1', '789001'), ('caixa1', '789003'), ('caixa2', '789002')])
+
+    def test_spooler_imprime_cupom_maior_que_o_buffer_da_porta(self):
+        mestre, porta = self.abrir_pty()
+        cupom = INICIAR + bytes(range(32, 127)) * 1000 + CORTAR
+        fila = [[(1, 'caixa1', cupom)]]
+        concluidos = []
+        recebido = bytearray()
+
+        def buscar_cupons(usuarios, ignorar):
+            return fila.pop() if fila else []
+
+        async def cenario():
+            daemon = DaemonPerifericos(
+                {'caixa1': self.terminal(impressora=porta)},
+                bipar=lambda usuario, codigos: [],
+                buscar_cupons=buscar_cupons,
+                concluir_cupom=lambda impressao_id, erro: concluidos.append((impressao_id, erro)),
+                intervalo_spool=0.01,
+            )
+            tarefa = asyncio.create_task(daemon.rodar())
+
+            def ler():
+                try:
+                    recebido.extend(os.read(mestre, 65536))
+                except BlockingIOError:
+                    pass
+                return len(recebido) >= len(cupom) and concluidos
+
+            await self.esperar(ler)
+            daemon.parar()
+            await tarefa
+
+        asyncio.run(cenario())
+        self.assertEqual(bytes(recebido), cupom)
+        self.assertEqual(concluidos, [(1, None)])
+
+
+class CupomTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('caixa1')
+        Produto.objects.create(nome='Pão de Açúcar', preco=Decimal('1.50'), estoque=10, categoria='comida', codigo_barras='789002')
+        cliente = Cliente.objects.create(nome='Ana', tipo='cliente')
+        self.venda = finalizar_venda([('789002', 2)], 'dinheiro', valor_pago=Decimal('5.00'), cliente=cliente)
+
+    def test_cupom_escpos(self):
+        cupom = cupom_escpos(self.venda)
+        self.assertTrue(cupom.startswith(INICIAR))
+        self.assertTrue(cupom.endswith(CORTAR))
+        self.assertIn('2x Pão de Açúcar'.encode('cp850'), cupom)
+        self.assertIn(b'3.00', cupom)
+        self.assertIn(self.venda.codigo_barras.encode(), cupom)
+
+    def test_enfileira_so_para_terminal_com_impressora(self):
+        self.assertIsNone(enfileirar_cupom(self.venda, self.usuario))
+        with override_settings(PDV_TERMINAIS={'caixa1': {'impressora': '/dev/ttyUSB0'}}):
+            enfileirar_cupom(self.venda, self.usuario)
+        self.assertEqual(ImpressaoCupom.objects.filter(venda=self.venda, impressa_em__isnull=True).count(), 1)
+
+
+class CarrinhoTempoRealTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('caixa1')
+        self.client.force_login(self.usuario)
+        Produto.objects.create(nome='Leite', preco=Decimal('4.00'), estoque=10, categoria='comida', codigo_barras='789010')
+        Produto.objects.create(nome='Café', preco=Decimal('12.00'), estoque=10, categoria='comida', codigo_barras='789011')
+        self.sessao = get_or_create_pdv_session(self.usuario)
+        carrinhos.limpar()
+        self.addCleanup(carrinhos.limpar)
+
+    def test_scan_devolve_e_publica_so_os_deltas(self):
+        self.client.post('/api/pdv/scan/', {'codigo': '789010'}, content_type='application/json')
+
+        loop = asyncio.new_event_loop()
+
+        async def assinar():
+            return hub.assinar(self.sessao.pk)
+
+        assinatura = loop.run_until_complete(assinar())
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                resposta = self.client.post(
+                    '/api/pdv/scan/', {'codigos': ['789011', '789011']}, content_type='application/json',
+                ).json()
+            loop.run_until_complete(asyncio.sleep(0))
+        finally:
+            hub.cancelar(self.sessao.pk, assinatura)
+            loop.close()
+
+        self.assertNotIn('itens', resposta)
+        self.assertEqual([item['produto'] for item in resposta['alterados']], ['Café'])
+        self.assertEqual(resposta['total'], 28.0)
+
+        fila = assinatura[1]
+        eventos = [fila.get_nowait() for _ in range(fila.qsize())]
+        self.assertEqual([tipo for tipo, _ in eventos], ['item', 'total'])
+        self.assertEqual(eventos[0][1]['quantidade'], 2)
+        self.assertEqual(eventos[1][1]['total'], 28.0)
+        self.assertFalse(hub.tem_assinantes())
+
+    def test_reenvio_do_diario_nao_baixa_duas_vezes(self):
+        diario = [{'codigo': '789010', 'quantidade': 1, 'chave': f'k{i}'} for i in range(300)]
+        diario.append({'codigo': '000000', 'quantidade': 1, 'chave': 'desconhecido'})
+        Produto.objects.filter(codigo_barras='789010').update(estoque=1000)
+
+        primeira = self.client.post('/api/pdv/scan/', {'codigos': diario[:150]}, content_type='application/json').json()
+        self.assertEqual(primeira['repetidas'], 0)
+        segunda = self.client.post('/api/pdv/scan/', {'codigos': diario}, content_type='application/json').json()
+
+        self.assertEqual(segunda['repetidas'], 150)
+        self.assertEqual([erro['codigo'] for erro in segunda['erros']], ['000000'])
+        self.assertEqual(carrinhos.gravar(self.sessao.pk), [])
+        self.assertEqual(Produto.objects.get(codigo_barras='789010').estoque, 1000 - 300)
+        self.assertEqual(BipagemProcessada.objects.count(), 300)
+
+    def test_bipagem_reserva_em_memoria_e_grava_ao_finalizar(self):
+        with self.assertNumQueries(5):
+            self.client.post('/api/pdv/scan/', {'codigos': ['789010'] * 6}, content_type='application/json')
+        self.assertFalse(ItemVenda.objects.exists())
+        self.assertEqual(carrinhos.reservado(Produto.objects.get(codigo_barras='789010').pk), 6)
+
+        resposta = self.client.post('/api/pdv/scan/', {'codigos': ['789010'] * 5}, content_type='application/json')
+        self.assertEqual(resposta.status_code, 409)
+        self.assertIn('Disponível: 4', resposta.json()['error'])
+
+        resposta = self.client.post('/api/pdv/finalizar/', {'forma_pagamento': 'pix', 'cliente': Cliente.objects.create(nome='Ana', tipo='cliente').pk}, content_type='application/json')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['total'], 24.0)
+        self.assertEqual(Produto.objects.get(codigo_barras='789010').estoque, 4)
+        self.assertEqual(carrinhos.reservado(Produto.objects.get(codigo_barras='789010').pk), 0)
+        self.sessao.refresh_from_db()
+        self.assertIsNone(self.sessao.venda)
+
+    def test_diario_guarda_a_chave_ate_o_banco_gravar(self):
+        bipagem = {'codigos': [{'codigo': '789010', 'quantidade': 1, 'chave': 'k1'}]}
+        resposta = self.client.post('/api/pdv/scan/', bipagem, content_type='application/json').json()
+        self.assertEqual(resposta['pendentes'], ['k1'])
+
+        # Reenvio antes do checkpoint: continua pendente e não entra de novo
+        resposta = self.client.post('/api/pdv/scan/', bipagem, content_type='application/json').json()
+        self.assertEqual((resposta['repetidas'], resposta['pendentes']), (1, ['k1']))
+
+        carrinhos.gravar(self.sessao.pk)
+        resposta = self.client.post('/api/pdv/scan/', bipagem, content_type='application/json').json()
+        self.assertEqual((resposta['repetidas'], resposta['pendentes']), (1, []))
+
+    def test_queda_antes_de_gravar_reaplica_o_diario(self):
+        bipagem = {'codigos': [{'codigo': '789010', 'quantidade': 1, 'chave': 'k1'}]}
+        self.client.post('/api/pdv/scan/', bipagem, content_type='application/json')
+        carrinhos.limpar()
+
+        resposta = self.client.post('/api/pdv/scan/', bipagem, content_type='application/json').json()
+        self.assertEqual((resposta['repetidas'], resposta['total']), (0, 4.0))
+
+    def test_bipagem_do_daemon_chega_ao_carrinho_em_memoria(self):
+        self.client.post('/api/pdv/scan/', {'codigo': '789010'}, content_type='application/json')
+
+        # O daemon dos periféricos grava direto na venda, em outro processo
+        adicionar_ao_carrinho(get_or_create_pdv_session(self.usuario), [('789011', 1)])
+
+        resposta = self.client.post('/api/pdv/scan/', {'codigo': '789010'}, content_type='application/json').json()
+        self.assertEqual(resposta['total'], 20.0)
+
+        resposta = self.client.post('/api/pdv/finalizar/', {'forma_pagamento': 'em aberto'}, content_type='application/json')
+        self.assertEqual(resposta.json()['total'], 20.0)
+        self.assertEqual(
+            sorted(ItemVenda.objects.values_list('produto__codigo_barras', 'quantidade')),
+            [('789010', 2), ('789011', 1)],
+        )
+
+    def test_fluxo_de_eventos_so_sob_asgi(self):
+        resposta = self.client.get('/pdv/')
+        self.assertNotContains(resposta, 'data-eventos')
+        self.assertEqual(self.client.get('/api/pdv/eventos/').status_code, 503)
+
+    def test_chaves_antigas_sao_apagadas(self):
+        for chave in ('antiga', 'nova'):
+            BipagemProcessada.objects.create(chave=chave, usuario=self.usuario)
+        BipagemProcessada.objects.filter(chave='antiga').update(criada_em=timezone.now() - timedelta(days=8))
+
+        saida = StringIO()
+        call_command('expirar_reservas', stdout=saida)
+        self.assertIn('1 chave(s) de bipagem apagada(s)', saida.getvalue())
+        self.assertEqual(list(BipagemProcessada.objects.values_list('chave', flat=True)), ['nova'])
+
+    def test_bipagem_no_meio_do_fechamento_volta_com_erro(self):
+        leite = Produto.objects.get(codigo_barras='789010')
+        self.client.post('/api/pdv/scan/', {'codigo': '789010'}, content_type='application/json')
+        # Requisição que leu a sessão antes do fechamento, com a venda antiga
+        antiga = get_or_create_pdv_session(self.usuario)
+        no_meio = []
+
+        def finalizar_com_bipagem(*args, **kwargs):
+            no_meio.extend(carrinhos.bipar(antiga, [('789010', 2, 'k-meio')])[0])
+            return finalizar_carrinho(*args, **kwargs)
+
+        with mock.patch('mercado.carrinho.finalizar_carrinho', side_effect=finalizar_com_bipagem):
+            resposta = self.client.post('/api/pdv/finalizar/', {'forma_pagamento': 'em aberto'}, content_type='application/json')
+        self.assertEqual(resposta.json()['total'], 4.0)
+        self.assertEqual(no_meio, [{'codigo': '789010', 'erro': VENDA_ALTERADA}])
+
+        # Depois do fechamento a sessão antiga continua recusada
+        erros, _ = carrinhos.bipar(antiga, [('789010', 2, 'k-depois')])
+        self.assertEqual(erros, [{'codigo': '789010', 'erro': VENDA_ALTERADA}])
+        self.assertEqual(carrinhos.reservado(leite.pk), 0)
+        self.assertEqual(carrinhos.gravar(self.sessao.pk), [])
+        self.assertEqual(carrinhos.pendentes(antiga, ['k-meio', 'k-depois']), [])
+
+        resposta = self.client.post('/api/pdv/scan/', {'codigo': '789010'}, content_type='application/json').json()
+        self.assertNotEqual(resposta['venda'], antiga.venda_id)
+        self.assertEqual(resposta['total'], 4.0)
+        leite.refresh_from_db()
+        self.assertEqual(leite.estoque, 9)
+
+    def test_venda_fechada_por_fora_libera_as_pendentes(self):
+        leite = Produto.objects.get(codigo_barras='789010')
+        carrinhos.bipar(self.sessao, [('789010', 2, 'k1')])
+
+        # Outro processo fecha a venda e abre a próxima
+        PDVSession.objects.filter(pk=self.sessao.pk).update(venda=None)
+        erros = carrinhos.gravar(self.sessao.pk)
+        self.assertEqual(erros, [{'codigo': '789010', 'erro': VENDA_ALTERADA}])
+        self.assertEqual(carrinhos.reservado(leite.pk), 0)
+
+        erros, _ = carrinhos.bipar(self.sessao, [('789010', 1, 'k2')])
+        self.assertEqual(erros, [{'codigo': '789010', 'erro': VENDA_ALTERADA}])
+        nova = get_or_create_pdv_session(self.usuario)
+        erros, _ = carrinhos.bipar(nova, [('789011', 1, 'k3')])
+        self.assertEqual(erros, [])
+        self.assertEqual(carrinhos.reservado(leite.pk), 0)
+        self.assertEqual(carrinhos.gravar(nova.pk), [])
+        self.assertEqual(list(ItemVenda.objects.values_list('produto__codigo_barras', flat=True)), ['789011'])
+
+        # Carrinho trocado com bipagem pendente: ela volta como erro e a reserva sai
+        carrinhos.bipar(nova, [('789011', 1, 'k4')])
+        PDVSession.objects.filter(pk=nova.pk).update(venda=Venda.objects.create(forma_pagamento='em aberto'))
+        with self.assertLogs('mercado.carrinho', 'WARNING'):
+            erros, _ = carrinhos.bipar(get_or_create_pdv_session(self.usuario), [('789010', 1, 'k5')])
+        self.assertEqual(erros, [{'codigo': '789011', 'erro': VENDA_ALTERADA}])
+        self.assertEqual(carrinhos.reservado(Produto.objects.get(codigo_barras='789011').pk), 0)
+
+
+class ReservasEstoqueTests(TestCase):
+    def setUp(self):
+        Produto.objects.create(nome='Arroz', preco=Decimal('20.00'), estoque=5, categoria='comida', codigo_barras='789020')
+        self.caixa1 = get_or_create_pdv_session(User.objects.create_user('caixa1'))
+        self.caixa2 = get_or_create_pdv_session(User.objects.create_user('caixa2'))
+        carrinhos.limpar()
+        self.addCleanup(carrinhos.limpar)
+
+        carrinhos.bipar(self.caixa1, [('789020', 4, None)])
+        with self.captureOnCommitCallbacks(execute=True):
+            carrinhos.gravar(self.caixa1.pk)
+
+    def test_carrinho_gravado_reserva_o_estoque(self):
+        reserva = ReservaEstoque.objects.get()
+        self.assertEqual((reserva.sessao_id, reserva.quantidade), (self.caixa1.pk, 4))
+        self.assertEqual(Produto.objects.get().estoque, 1)
+
+        erros, _ = carrinhos.bipar(self.caixa2, [('789020', 3, None)])
+        self.assertIn('Disponível: 1', erros[0]['erro'])
+
+    def test_reserva_vencida_devolve_o_estoque(self):
+        ReservaEstoque.objects.update(expira_em=timezone.now() - timedelta(minutes=1))
+        produto = Produto.objects.get()
+        self.assertEqual(disponibilidade([produto.pk]), {produto.pk: 5})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            erros, _ = carrinhos.bipar(self.caixa2, [('789020', 3, None)])
+        self.assertEqual(erros, [])
+        self.assertFalse(ItemVenda.objects.filter(venda=self.caixa1.venda).exists())
+        self.assertFalse(ReservaEstoque.objects.exists())
+        self.assertEqual(Produto.objects.get().estoque, 5)
+
+    def test_comando_expira_em_lotes(self):
+        ReservaEstoque.objects.update(expira_em=timezone.now() - timedelta(minutes=1))
+        saida = StringIO()
+        call_command('expirar_reservas', '--lote', '1', stdout=saida)
+        self.assertIn('1 reserva(s) expirada(s)', saida.getvalue())
+        self.assertEqual(Produto.objects.get().estoque, 5)
+        self.assertEqual(Venda.objects.get(pk=self.caixa1.venda_id).valor_total, Decimal('0.00'))
+
+
+class ResumosVendaTests(TestCase):
+    def setUp(self):
+        Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=100, categoria='comida', codigo_barras='789030')
+
+    def assertResumosConferem(self):
+        call_command('resumo_vendas', '--verificar', stdout=StringIO())
+
+    def test_clientes_excluidos_somam_no_balcao(self):
+        ana = Cliente.objects.create(nome='Ana', tipo='cliente')
+        bia = Cliente.objects.create(nome='Bia', tipo='cliente')
+        finalizar_venda([('789030', 1)], 'em aberto', cliente=ana)
+        finalizar_venda([('789030', 2)], 'em aberto', cliente=bia)
+        finalizar_venda([('789030', 3)], 'em aberto')
+
+        ana.delete()
+        bia.delete()
+        finalizar_venda([('789030', 4)], 'em aberto')
+
+        resumo = ResumoVendaHora.objects.get()
+        self.assertEqual((resumo.cliente_id, resumo.quantidade, resumo.valor), (None, 10, Decimal('15.00')))
+        self.assertResumosConferem()
+
+    def test_resumo_diario_acompanha_itens_e_forma_de_pagamento(self):
+        Produto.objects.create(nome='Água', preco=Decimal('3.00'), estoque=100, categoria='bebida_nao_alcoolica', codigo_barras='789031')
+        ana = Cliente.objects.create(nome='Ana', tipo='cliente')
+        venda = finalizar_venda([('789030', 2), ('789031', 1)], 'em aberto', cliente=ana)
+        finalizar_venda([('789030', 1)], 'pix', cliente=ana)
+
+        item = venda.itens.get(produto__codigo_barras='789030')
+        item.quantidade = 4
+        item.save()
+        venda.itens.get(produto__codigo_barras='789031').delete()
+        venda.forma_pagamento = 'pix'
+        venda.save()
+
+        hoje = dia_da_venda(venda)
+        self.assertEqual(
+            sorted(ResumoVendaDia.objects.filter(dia=hoje).exclude(quantidade=0).values_list('produto__nome', 'forma_pagamento', 'quantidade', 'valor')),
+            [('Pão', 'pix', 5, Decimal('7.50'))],
+        )
+        self.assertResumosConferem()
+
+    def test_verificar_acusa_e_reconstruir_corrige(self):
+        finalizar_venda([('789030', 2)], 'em aberto')
+        ResumoVendaDia.objects.update(quantidade=99)
+
+        with self.assertRaisesMessage(CommandError, '1 divergência(s)'):
+            self.assertResumosConferem()
+        call_command('resumo_vendas', '--reconstruir', stdout=StringIO())
+        self.assertEqual(ResumoVendaDia.objects.get().quantidade, 2)
+        self.assertResumosConferem()
+
+
+class RelatorioVendasTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('gerente'))
+        Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=100, categoria='comida', codigo_barras='789060')
+        Produto.objects.create(nome='Água', preco=Decimal('3.00'), estoque=100, categoria='bebida_nao_alcoolica', codigo_barras='789061')
+        self.ana = Cliente.objects.create(nome='Ana', tipo='cliente')
+        vendas = [
+            (datetime(2026, 3, 4, 9, 10), [('789060', 2)], 'em aberto', self.ana),
+            # 02:30 do dia 5 em UTC: conta no dia 4 local
+            (datetime(2026, 3, 4, 23, 30), [('789061', 1)], 'pix', self.ana),
+            (datetime(2026, 3, 9, 10, 0), [('789060', 4)], 'em aberto', None),
+            (datetime(2026, 4, 2, 10, 0), [('789060', 1)], 'em aberto', None),
+        ]
+        for quando, itens, forma, cliente in vendas:
+            venda = finalizar_venda(itens, forma, cliente=cliente)
+            Venda.objects.filter(pk=venda.pk).update(data_venda=timezone.make_aware(quando))
+        call_command('resumo_vendas', '--reconstruir', stdout=StringIO())
+
+    def relatorio(self, **params):
+        resposta = self.client.get(reverse('api_relatorio_vendas'), {'de': '2026-03-01', 'ate': '2026-04-30', **params})
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()
+
+    def periodos(self, **params):
+        return [(p['inicio'], p['quantidade'], p['valor']) for p in self.relatorio(**params)['periodos']]
+
+    def test_cada_resolucao_comeca_no_fuso_local(self):
+        self.assertEqual(self.periodos(resolucao='hora'), [
+            ('2026-03-04T09:00:00-03:00', 2, 3.0),
+            ('2026-03-04T23:00:00-03:00', 1, 3.0),
+            ('2026-03-09T10:00:00-03:00', 4, 6.0),
+            ('2026-04-02T10:00:00-03:00', 1, 1.5),
+        ])
+        self.assertEqual(self.periodos(), [
+            ('2026-03-04T00:00:00-03:00', 3, 6.0),
+            ('2026-03-09T00:00:00-03:00', 4, 6.0),
+            ('2026-04-02T00:00:00-03:00', 1, 1.5),
+        ])
+        self.assertEqual(self.periodos(resolucao='semana'), [
+            ('2026-03-02T00:00:00-03:00', 3, 6.0),
+            ('2026-03-09T00:00:00-03:00', 4, 6.0),
+            ('2026-03-30T00:00:00-03:00', 1, 1.5),
+        ])
+        self.assertEqual(self.periodos(resolucao='mes'), [
+            ('2026-03-01T00:00:00-03:00', 7, 12.0),
+            ('2026-04-01T00:00:00-03:00', 1, 1.5),
+        ])
+
+        relatorio = self.relatorio(resolucao='mes')
+        self.assertEqual((relatorio['inicio'], relatorio['fim']), ('2026-03-01T00:00:00-03:00', '2026-05-01T00:00:00-03:00'))
+        self.assertEqual(relatorio['total'], {'quantidade': 8, 'valor': 13.5})
+
+    def test_filtros(self):
+        self.assertEqual(self.periodos(categoria='bebida_nao_alcoolica'), [('2026-03-04T00:00:00-03:00', 1, 3.0)])
+        self.assertEqual(self.relatorio(categoria='comida')['total'], {'quantidade': 7, 'valor': 10.5})
+        self.assertEqual(self.periodos(cliente=self.ana.pk), [('2026-03-04T00:00:00-03:00', 3, 6.0)])
+        self.assertEqual(self.periodos(forma_pagamento='pix'), [('2026-03-04T00:00:00-03:00', 1, 3.0)])
+        self.assertEqual(self.relatorio(forma_pagamento=['pix', 'em aberto'])['total'], {'quantidade': 8, 'valor': 13.5})
+        self.assertEqual(self.relatorio(de='2026-03-05', ate='2026-03-31')['total'], {'quantidade': 4, 'valor': 6.0})
+
+    def test_parametros_invalidos(self):
+        url = reverse('api_relatorio_vendas')
+        for params in ({'resolucao': 'ano'}, {'de': '2026-04-01', 'ate': '2026-03-01'}, {'cliente': 'abc'}, {'de': 'ontem'}):
+            resposta = self.client.get(url, params)
+            self.assertEqual(resposta.status_code, 400, params)
+            self.assertIn('erro', resposta.json())
+
+
+class ContadoresClienteTests(TestCase):
+    def setUp(self):
+        Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=100, categoria='comida', codigo_barras='789150')
+        Produto.objects.create(nome='Água', preco=Decimal('3.00'), estoque=100, categoria='bebida_nao_alcoolica', codigo_barras='789151')
+        self.ana = Cliente.objects.create(nome='Ana', tipo='cliente')
+        self.bia = Cliente.objects.create(nome='Bia', tipo='cliente')
+
+    def test_deltas_batem_com_o_recalculo(self):
+        primeira = finalizar_venda([('789150', 2), ('789151', 1)], 'em aberto', cliente=self.ana)
+        segunda = finalizar_venda([('789150', 4)], 'pix', cliente=self.ana)
+        item = primeira.itens.get(produto__codigo_barras='789150')
+        item.quantidade = 3
+        item.save()
+        primeira.itens.get(produto__codigo_barras='789151').delete()
+        segunda.cliente = self.bia
+        segunda.save()
+
+        self.ana.refresh_from_db()
+        self.assertEqual(
+            (self.ana.total_itens, self.ana.total_comprado, self.ana.saldo_aberto),
+            (3, Decimal('4.50'), Decimal('4.50')),
+        )
+        self.assertEqual(contadores_divergentes(), [])
+
+        Cliente.objects.update(total_itens=0, saldo_aberto=Decimal('0.00'))
+        self.assertEqual(len(contadores_divergentes()), 2)
+        recalcular_contadores()
+        self.assertEqual(contadores_divergentes(), [])
+
+
+class QuitacaoTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(self.usuario)
+        Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=100, categoria='comida', codigo_barras='789040')
+        self.caixa = Caixa.objects.create(valor_inicial=Decimal('100.00'))
+        self.cliente = Cliente.objects.create(nome='Ana', tipo='cliente')
+        self.em_aberto = finalizar_venda([('789040', 4)], 'em aberto', cliente=self.cliente)
+        self.pix = finalizar_venda([('789040', 2)], 'pix', cliente=self.cliente)
+        finalizar_venda([('789040', 2)], 'dinheiro', valor_pago=Decimal('3.00'), cliente=self.cliente)
+
+    def test_acao_do_admin_so_quita_vendas_em_aberto(self):
+        resposta = self.client.post(reverse('admin:mercado_venda_changelist'), {
+            'action': 'quitar_em_dinheiro',
+            '_selected_action': [self.em_aberto.pk, self.pix.pk],
+        }, follow=True)
+        self.assertContains(resposta, '1 venda(s) ignoradas')
+
+        self.em_aberto.refresh_from_db()
+        self.pix.refresh_from_db()
+        self.assertTrue(self.em_aberto.pago)
+        self.assertIsNone(self.pix.quitacao_id)
+        self.assertFalse(self.pix.pago)
+
+    def test_quitacao_em_dinheiro_entra_no_caixa(self):
+        self.client.post('/api/quitacoes/', {'cliente': self.cliente.pk, 'forma_pagamento': 'dinheiro'}, content_type='application/json')
+
+        fechamento = self.caixa.fechar_caixa(Decimal('109.00'))
+        self.assertEqual(fechamento.total_quitado, Decimal('6.00'))
+        self.assertEqual(fechamento.dinheiro_esperado, Decimal('109.00'))
+        self.assertEqual(fechamento.diferenca, Decimal('0.00'))
+
+    def test_recalcular_totais_mantem_as_quitacoes(self):
+        self.client.post('/api/quitacoes/', {'cliente': self.cliente.pk, 'forma_pagamento': 'pix'}, content_type='application/json')
+        recalcular_totais(self.caixa)
+        self.assertEqual(self.caixa.totais.get(forma_pagamento='pix').quitado, Decimal('6.00'))
+
+    def test_cliente_invalido_na_quitacao(self):
+        resposta = self.client.post('/api/quitacoes/', {'cliente': 'abc', 'forma_pagamento': 'pix'}, content_type='application/json')
+        self.assertEqual(resposta.status_code, 400)
+        resposta = self.client.post('/api/quitacoes/', {'cliente': 9999, 'forma_pagamento': 'pix'}, content_type='application/json')
+        self.assertEqual(resposta.status_code, 404)
+
+
+class FinalizarVendaTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('caixa1')
+        self.client.force_login(self.usuario)
+        Produto.objects.create(nome='Leite', preco=Decimal('4.00'), estoque=10, categoria='comida', codigo_barras='789050')
+        Produto.objects.create(nome='Café', preco=Decimal('12.00'), estoque=1, categoria='comida', codigo_barras='789051')
+        self.cliente = Cliente.objects.create(nome='Ana', tipo='cliente')
+
+    def test_cesta_inteira_numa_transacao(self):
+        venda = finalizar_venda([('789050', 2), ('789051', 1), ('789050', 1)], 'pix', cliente=self.cliente)
+
+        self.assertEqual(
+            sorted(venda.itens.values_list('produto__codigo_barras', 'quantidade', 'subtotal')),
+            [('789050', 3, Decimal('12.00')), ('789051', 1, Decimal('12.00'))],
+        )
+        venda.refresh_from_db()
+        self.assertEqual((venda.valor_total, venda.saldo_devedor), (Decimal('24.00'), Decimal('0.00')))
+        self.assertEqual(dict(Produto.objects.values_list('codigo_barras', 'estoque')), {'789050': 7, '789051': 0})
+
+    def test_cesta_sem_estoque_nao_grava_nada(self):
+        with self.assertRaises(EstoqueInsuficiente):
+            finalizar_venda([('789050', 2), ('789051', 2)], 'pix', cliente=self.cliente)
+
+        self.assertFalse(Venda.objects.exists())
+        self.assertEqual(dict(Produto.objects.values_list('codigo_barras', 'estoque')), {'789050': 10, '789051': 1})
+
+    def test_api_recusa_cliente_invalido(self):
+        cesta = {'itens': [['789050', 1]], 'forma_pagamento': 'pix'}
+        resposta = self.client.post('/api/pdv/finalizar/', dict(cesta, cliente='abc'), content_type='application/json')
+        self.assertEqual(resposta.status_code, 400)
+        resposta = self.client.post('/api/pdv/finalizar/', dict(cesta, cliente=9999), content_type='application/json')
+        self.assertEqual(resposta.status_code, 404)
+        self.assertFalse(Venda.objects.exists())
+
+    def test_venda_devolvida_move_os_resumos_ao_trocar_de_cliente(self):
+        bia = Cliente.objects.create(nome='Bia', tipo='cliente')
+        venda = finalizar_venda([('789050', 2)], 'pix', cliente=self.cliente)
+        venda.cliente = bia
+        venda.save()
+
+        self.cliente.refresh_from_db()
+        bia.refresh_from_db()
+        self.assertEqual((self.cliente.total_itens, bia.total_itens), (0, 2))
+        self.assertEqual(list(ResumoVendaHora.objects.filter(quantidade__gt=0).values_list('cliente_id', flat=True)), [bia.pk])
+
+
+class MigracaoTestCase(TransactionTestCase):
+    """Migra para `antes`, onde o teste cria os dados, e depois para `depois`."""
+
+    def migrar(self, alvo):
+        executor = MigrationExecutor(connection)
+        executor.migrate(alvo)
+        return executor.loader.project_state(alvo).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+class ResumosMigracaoTests(MigracaoTestCase):
+    antes = [('mercado', '0028_venda_codigo_barras')]
+    depois = [('mercado', '0033_cliente_saldo_aberto_cliente_total_comprado_and_more')]
+
+    def test_resumos_e_contadores_partem_das_vendas_existentes(self):
+        apps = self.migrar(self.antes)
+        Produto = apps.get_model('mercado', 'Produto')
+        Cliente = apps.get_model('mercado', 'Cliente')
+        Venda = apps.get_model('mercado', 'Venda')
+        ItemVenda = apps.get_model('mercado', 'ItemVenda')
+        pao = Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=10, categoria='comida', codigo_barras='789140')
+        agua = Produto.objects.create(nome='Água', preco=Decimal('3.00'), estoque=10, categoria='bebida_nao_alcoolica', codigo_barras='789141')
+        cliente = Cliente.objects.create(nome='Equipe Azul', tipo='conta', equipe='azul')
+        momento = timezone.now().replace(minute=10, second=0, microsecond=0) - timedelta(days=1)
+        vendas = [
+            (cliente, 'em aberto', False, [(pao, 2), (agua, 1)]),
+            (cliente, 'pix', True, [(pao, 1)]),
+            (None, 'pix', True, [(pao, 3)]),
+        ]
+        for dono, forma, pago, itens in vendas:
+            total = sum(produto.preco * quantidade for produto, quantidade in itens)
+            venda = Venda.objects.create(
+                cliente=dono, forma_pagamento=forma, pago=pago, valor_total=total,
+                saldo_devedor=Decimal('0.00') if pago else total,
+            )
+            # data_venda é auto_now_add
+            Venda.objects.filter(pk=venda.pk).update(data_venda=momento)
+            for produto, quantidade in itens:
+                ItemVenda.objects.create(venda=venda, produto=produto, quantidade=quantidade, subtotal=produto.preco * quantidade)
+
+        apps = self.migrar(self.depois)
+        ResumoVendaDia = apps.get_model('mercado', 'ResumoVendaDia')
+        ResumoVendaHora = apps.get_model('mercado', 'ResumoVendaHora')
+        cliente = apps.get_model('mercado', 'Cliente').objects.get()
+        self.assertEqual(
+            sorted(ResumoVendaDia.objects.values_list('produto__nome', 'forma_pagamento', 'quantidade', 'valor')),
+            [('Pão', 'em aberto', 2, Decimal('3.00')), ('Pão', 'pix', 4, Decimal('6.00')), ('Água', 'em aberto', 1, Decimal('3.00'))],
+        )
+        self.assertEqual(
+            sorted(ResumoVendaHora.objects.values_list('categoria', 'forma_pagamento', 'cliente_id', 'quantidade'), key=str),
+            [
+                ('bebida_nao_alcoolica', 'em aberto', cliente.pk, 1),
+                ('comida', 'em aberto', cliente.pk, 2),
+                ('comida', 'pix', cliente.pk, 1),
+                ('comida', 'pix', None, 3),
+            ],
+        )
+        self.assertEqual(ResumoVendaHora.objects.values('hora').distinct().count(), 1)
+        self.assertEqual(
+            (cliente.total_itens, cliente.total_comprado, cliente.ultima_compra, cliente.saldo_aberto),
+            (4, Decimal('7.50'), momento, Decimal('6.00')),
+        )
+
+
+class LivroEstoqueMigracaoTests(MigracaoTestCase):
+    antes = [('mercado', '0035_venda_venda_pago_data_idx')]
+    depois = [('mercado', '0036_movimentoestoque')]
+
+    def test_livro_refaz_o_estoque_do_historico(self):
+        apps = self.migrar(self.antes)
+        Produto = apps.get_model('mercado', 'Produto')
+        HistoricalProduto = apps.get_model('mercado', 'HistoricalProduto')
+        produto = Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=10, categoria='comida', codigo_barras='789060')
+        ontem = timezone.now() - timedelta(days=1)
+        for estoque, horas, tipo in [(10, 0, '+'), (7, 2, '~'), (7, 3, '~'), (12, 4, '~')]:
+            HistoricalProduto.objects.create(
+                id=produto.pk, nome='Pão', preco=Decimal('1.50'), estoque=estoque, categoria='comida',
+                codigo_barras='789060', history_date=ontem + timedelta(hours=horas), history_type=tipo,
+            )
+        # Baixa por UPDATE direto, sem linha no histórico
+        Produto.objects.filter(pk=produto.pk).update(estoque=9)
+
+        apps = self.migrar(self.depois)
+        MovimentoEstoque = apps.get_model('mercado', 'MovimentoEstoque')
+        movimentos = list(MovimentoEstoque.objects.filter(produto_id=produto.pk).order_by('data', 'pk'))
+        self.assertEqual([m.quantidade for m in movimentos], [10, -3, 5, -3])
+        self.assertEqual([m.data for m in movimentos[:3]], [ontem, ontem + timedelta(hours=2), ontem + timedelta(hours=4)])
+
+
+class TotaisVendaTests(TestCase):
+    def setUp(self):
+        self.leite = Produto.objects.create(nome='Leite', preco=Decimal('4.00'), estoque=50, categoria='comida', codigo_barras='789170')
+        self.cliente = Cliente.objects.create(nome='Ana', tipo='cliente')
+
+    def totais(self, venda):
+        return Venda.objects.filter(pk=venda.pk).values_list(*Venda.CAMPOS_TOTAIS).get()
+
+    def test_deltas_seguem_as_regras_de_pagamento(self):
+        for forma, valor_pago in [('dinheiro', Decimal('10.00')), ('em aberto', None), ('pix', None)]:
+            venda = Venda(cliente=self.cliente, forma_pagamento=forma, valor_pago=valor_pago)
+            venda.save()
+            item = ItemVenda(venda=venda, produto=self.leite, quantidade=2)
+            item.save()
+            ItemVenda(venda=venda, produto=self.leite, quantidade=1).save()
+            item.delete()
+            ItemVenda(venda=venda, produto=self.leite, quantidade=2).save()
+
+            incremental = self.totais(venda)
+            venda.refresh_from_db()
+            venda.recalcular_totais()
+            self.assertEqual(incremental, self.totais(venda), forma)
+            self.assertEqual(incremental[0], Decimal('12.00'))
+
+        dinheiro = Venda.objects.get(forma_pagamento='dinheiro')
+        self.assertEqual((dinheiro.troco, dinheiro.saldo_devedor, dinheiro.pago), (Decimal('0.00'), Decimal('2.00'), False))
+        self.assertEqual(Venda.objects.get(forma_pagamento='em aberto').saldo_devedor, Decimal('12.00'))
+
+    def test_reconciliar_totais_corrige_as_divergentes(self):
+        venda = finalizar_venda([('789170', 3)], 'em aberto', cliente=self.cliente)
+        Venda.objects.filter(pk=venda.pk).update(valor_total=Decimal('1.00'))
+
+        saida = StringIO()
+        call_command('reconciliar_totais', stdout=saida)
+        self.assertIn(f"Venda #{venda.pk}: valor_total=1.00 ", saida.getvalue())
+
+        call_command('reconciliar_totais', '--corrigir', stdout=StringIO())
+        venda.refresh_from_db()
+        self.assertEqual((venda.valor_total, venda.saldo_devedor), (Decimal('12.00'), Decimal('12.00')))
+        saida = StringIO()
+        call_command('reconciliar_totais', stdout=saida)
+        self.assertIn("Nenhuma divergência", saida.getvalue())
+
+
+class MotorEstoqueTests(TestCase):
+    def setUp(self):
+        self.leite = Produto.objects.create(nome='Leite', preco=Decimal('4.00'), estoque=5, categoria='comida', codigo_barras='789160')
+        self.cafe = Produto.objects.create(nome='Café', preco=Decimal('12.00'), estoque=2, categoria='comida', codigo_barras='789161')
+        self.historico = Produto.history.count()
+
+    def estoques(self):
+        return dict(Produto.objects.values_list('codigo_barras', 'estoque'))
+
+    def test_baixa_soma_as_linhas_do_mesmo_produto(self):
+        self.assertEqual(baixar_estoque([(self.leite.pk, 2), (self.cafe.pk, 2), (self.leite.pk, 3)]), [])
+
+        self.assertEqual(self.estoques(), {'789160': 0, '789161': 0})
+        self.assertEqual(
+            sorted(MovimentoEstoque.objects.filter(motivo=MovimentoEstoque.VENDA).values_list('produto_id', 'quantidade')),
+            sorted([(self.leite.pk, -5), (self.cafe.pk, -2)]),
+        )
+        # UPDATE direto: sem linha nova no histórico
+        self.assertEqual(Produto.history.count(), self.historico)
+
+    def test_baixa_tudo_ou_nada(self):
+        falhas = baixar_estoque([(self.leite.pk, 1), (self.cafe.pk, 3)])
+
+        self.assertEqual(falhas, [(self.cafe.pk, 3, 2)])
+        self.assertEqual(self.estoques(), {'789160': 5, '789161': 2})
+        self.assertFalse(MovimentoEstoque.objects.filter(motivo=MovimentoEstoque.VENDA).exists())
+
+    def test_devolucao_e_troca_de_quantidade_no_item(self):
+        cliente = Cliente.objects.create(nome='Ana', tipo='cliente')
+        venda = finalizar_venda([('789160', 2)], 'pix', cliente=cliente)
+        item = venda.itens.get()
+        item.quantidade = 4
+        item.save()
+        self.assertEqual(self.estoques()['789160'], 1)
+
+        item.quantidade = 1
+        item.save()
+        self.assertEqual(self.estoques()['789160'], 4)
+
+        item.quantidade = 6
+        with self.assertRaises(EstoqueInsuficiente):
+            item.save()
+        self.assertEqual(self.estoques()['789160'], 4)
+
+        item.delete()
+        self.assertEqual(self.estoques()['789160'], 5)
+        devolver_estoque([(self.cafe.pk, 3)])
+        self.assertEqual(self.estoques()['789161'], 5)
+
+
+class LivroEstoqueTests(TestCase):
+    def setUp(self):
+        self.leite = Produto.objects.create(nome='Leite', preco=Decimal('4.00'), estoque=20, categoria='comida', codigo_barras='789070')
+        self.cafe = Produto.objects.create(nome='Café', preco=Decimal('12.00'), estoque=20, categoria='comida', codigo_barras='789071')
+
+    def assertLivroFecha(self):
+        livro = dict(Produto.objects.annotate(soma=Sum('movimentos__quantidade')).values_list('pk', 'soma'))
+        self.assertEqual(livro, dict(Produto.objects.values_list('pk', 'estoque')))
+
+    def test_soma_dos_movimentos_e_o_estoque(self):
+        venda = finalizar_venda([('789070', 3), ('789071', 1)], 'em aberto')
+        outra = finalizar_venda([('789070', 1)], 'em aberto')
+        self.assertLivroFecha()
+
+        item = venda.itens.get(produto=self.leite)
+        item.quantidade = 5
+        item.save()
+        self.assertLivroFecha()
+
+        # Item passa para outra venda e troca de produto
+        item.venda = outra
+        item.produto = self.cafe
+        item.save()
+        self.assertLivroFecha()
+
+        produto = Produto.objects.get(pk=self.leite.pk)
+        produto.estoque = 50
+        produto.save()
+        self.assertLivroFecha()
+
+        item.delete()
+        self.assertLivroFecha()
+        venda.delete()
+        outra.delete()
+        self.assertLivroFecha()
+        self.assertEqual(dict(Produto.objects.values_list('codigo_barras', 'estoque')), {'789070': 51, '789071': 20})
+
+
+class VendasPorDataTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('gerente')
+        self.client.force_login(self.usuario)
+        Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=100, categoria='comida', codigo_barras='789180')
+        Produto.objects.create(nome='Água', preco=Decimal('3.00'), estoque=100, categoria='bebida_nao_alcoolica', codigo_barras='789181')
+        self.cliente = Cliente.objects.create(nome='Ana', tipo='cliente')
+        self.hoje = timezone.localdate()
+
+    def vender(self, vezes):
+        for _ in range(vezes):
+            finalizar_venda([('789180', 1), ('789181', 2)], 'em aberto', cliente=self.cliente)
+
+    def test_cursor_percorre_empates_sem_repetir(self):
+        self.vender(5)
+        # Mesmo instante para todas: o desempate é pelo id
+        Venda.objects.update(data_venda=timezone.now())
+
+        vistas, cursor = [], None
+        while True:
+            pagina, cursor = vendas_do_dia(self.hoje, apos=cursor, limite=2)
+            vistas += [venda.pk for venda in pagina]
+            if cursor is None:
+                break
+        self.assertEqual(vistas, list(Venda.objects.order_by('pk').values_list('pk', flat=True)))
+
+    def test_consultas_nao_crescem_com_as_vendas(self):
+        self.vender(2)
+        with self.assertNumQueries(2):
+            pagina, _ = vendas_do_dia(self.hoje)
+            [(venda.cliente.nome, [item.produto.nome for item in venda.itens.all()]) for venda in pagina]
+
+        url = reverse('vendas_por_data', args=[self.hoje.isoformat()])
+        with CaptureQueriesContext(connection) as poucas:
+            self.client.get(url)
+        self.vender(6)
+        with self.assertNumQueries(len(poucas)):
+            resposta = self.client.get(url)
+        self.assertEqual(len(resposta.context['vendas']), 8)
+        self.assertEqual(resposta.context['valor_total_dia'], Decimal('60.00'))
+
+    def test_api_pagina_e_recusa_cursor_invalido(self):
+        self.vender(3)
+        url = reverse('api_vendas_por_data', args=[self.hoje.isoformat()])
+        dados = self.client.get(url).json()
+        self.assertEqual(len(dados['vendas']), 3)
+        self.assertEqual(dados['resumo']['vendas_pendentes'], 3)
+        self.assertEqual(self.client.get(url, {'apos': 'abc'}).status_code, 400)
+
+
+class ExportacaoVendasTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('contador'))
+        pao = Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=100, categoria='comida', codigo_barras='789190')
+        self.cliente = Cliente.objects.create(nome='Ana', tipo='cliente')
+        self.venda = finalizar_venda([('789190', 2)], 'em aberto', cliente=self.cliente)
+        Venda(cliente=self.cliente, forma_pagamento='em aberto').save()
+        # O item guarda o preço da hora da venda
+        pao.preco = Decimal('2.00')
+        pao.save()
+        self.hoje = timezone.localdate().isoformat()
+
+    def exportar(self, **params):
+        return self.client.get(reverse('exportar_vendas'), {'de': self.hoje, 'ate': self.hoje, **params})
+
+    def test_csv_em_fluxo(self):
+        resposta = self.exportar()
+        self.assertTrue(resposta.streaming)
+        linhas = list(csv.reader(io.StringIO(b''.join(resposta.streaming_content).decode('utf-8-sig'))))
+
+        self.assertEqual(linhas[0][:3], ['venda', 'data', 'cliente'])
+        self.assertEqual(len(linhas), 3)
+        self.assertEqual(linhas[1][7:], ['Pão', '789190', 'comida', '2', '1.50', '3.00'])
+        # Venda sem itens sai numa linha só, com as colunas do item vazias
+        self.assertEqual(linhas[2][7:], ['', '', '', '', '', ''])
+
+    def test_xlsx(self):
+        from openpyxl import load_workbook
+
+        resposta = self.exportar(formato='xlsx')
+        self.assertIn('.xlsx', resposta['Content-Disposition'])
+        aba = load_workbook(io.BytesIO(b''.join(resposta.streaming_content)), read_only=True)['Vendas']
+        linhas = list(aba.values)
+        self.assertEqual(len(linhas), 3)
+        self.assertEqual(linhas[1][0], self.venda.pk)
+        self.assertEqual(linhas[1][7:], ('Pão', '789190', 'comida', 2, 1.5, 3))
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.exportar(formato='pdf').status_code, 400)
+        self.assertEqual(self.exportar(de='ontem').status_code, 400)
+
+
+class FechamentoCaixaTests(TestCase):
+    def setUp(self):
+        Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=100, categoria='comida', codigo_barras='789200')
+        self.cliente = Cliente.objects.create(nome='Ana', tipo='cliente')
+
+    def vender(self):
+        finalizar_venda([('789200', 2)], 'dinheiro', valor_pago=Decimal('10.00'), cliente=self.cliente)
+        finalizar_venda([('789200', 4)], 'pix', cliente=self.cliente)
+        return finalizar_venda([('789200', 1)], 'em aberto', cliente=self.cliente)
+
+    def totais(self, caixa):
+        return {forma: (quantidade, valor) for forma, quantidade, valor in caixa.totais.values_list('forma_pagamento', 'quantidade', 'valor')}
+
+    def test_fechamento_congela_os_totais(self):
+        caixa = Caixa.objects.create(valor_inicial=Decimal('100.00'))
+        em_aberto = self.vender()
+        self.assertEqual(self.totais(caixa), calcular_totais(caixa))
+
+        fechamento = caixa.fechar_caixa(Decimal('102.50'))
+        self.assertEqual(
+            (fechamento.total_dinheiro, fechamento.total_pix, fechamento.total_em_aberto, fechamento.quantidade_itens),
+            (Decimal('3.00'), Decimal('6.00'), Decimal('1.50'), 7),
+        )
+        self.assertEqual((fechamento.dinheiro_esperado, fechamento.diferenca), (Decimal('103.00'), Decimal('-0.50')))
+
+        # Depois do fechamento, nem venda nova nem alteração mexem no caixa
+        congelado = self.totais(caixa)
+        item = em_aberto.itens.get()
+        item.quantidade = 3
+        item.save()
+        self.vender()
+        self.assertEqual(self.totais(caixa), congelado)
+        caixa.refresh_from_db()
+        self.assertEqual(caixa.get_total_vendas(), Decimal('10.50'))
+        with self.assertRaises(ValidationError):
+            caixa.fechar_caixa()
+
+    def test_caixa_retroativo_comeca_com_as_vendas(self):
+        self.vender()
+        caixa = Caixa.objects.create(data_abertura=timezone.now() - timedelta(hours=1))
+        self.assertEqual(
+            self.totais(caixa),
+            {'dinheiro': (2, Decimal('3.00')), 'pix': (4, Decimal('6.00')), 'em aberto': (1, Decimal('1.50'))},
+        )
+
+
+class EstoqueNoPassadoTests(TestCase):
+    def setUp(self):
+        self.arroz = Produto.objects.create(nome='Arroz', preco=Decimal('6.00'), estoque=0, categoria='comida', codigo_barras='789210')
+        self.feijao = Produto.objects.create(nome='Feijão', preco=Decimal('8.00'), estoque=0, categoria='comida', codigo_barras='789211')
+        mes = (timezone.localdate() - timedelta(days=200)).replace(day=1)
+        self.movimentos = [
+            (self.arroz, mes + timedelta(days=2), 10),
+            (self.feijao, mes + timedelta(days=2), 6),
+            (self.arroz, mes + timedelta(days=10), -3),
+            (self.arroz, mes + timedelta(days=10), -1),
+            (self.feijao, mes + timedelta(days=20), -2),
+            (self.arroz, mes + timedelta(days=40), 4),
+            (self.arroz, timezone.localdate() - timedelta(days=5), -5),
+        ]
+        MovimentoEstoque.objects.bulk_create([
+            MovimentoEstoque(produto=produto, quantidade=quantidade, motivo=MovimentoEstoque.AJUSTE, data=self.meio_dia(dia))
+            for produto, dia, quantidade in self.movimentos
+        ])
+
+    @staticmethod
+    def meio_dia(dia, horas=12):
+        return timezone.make_aware(datetime.combine(dia, time(horas)))
+
+    def somado(self, momento):
+        """Estoque direto do livro, sem saldos."""
+        estoques = {}
+        for produto, dia, quantidade in self.movimentos:
+            if self.meio_dia(dia) < momento:
+                estoques[produto.pk] = estoques.get(produto.pk, 0) + quantidade
+        return estoques
+
+    def test_posicao_igual_ao_livro_com_meses_compactados(self):
+        momentos = [self.meio_dia(dia, horas) for _, dia, _ in self.movimentos for horas in (9, 18)]
+        momentos.append(timezone.now())
+        antes = {momento: estoque_em(momento) for momento in momentos}
+
+        call_command('saldos_estoque', stdout=StringIO())
+
+        # Meses antigos ficam com um saldo só, no último dia do mês
+        dias = set(SaldoEstoque.objects.filter(produto=self.arroz).values_list('dia', flat=True))
+        self.assertTrue(all((dia + timedelta(days=1)).day == 1 for dia in dias if dia < timezone.localdate() - timedelta(days=90)))
+        self.assertLess(len(dias), 4)
+        for momento in momentos:
+            self.assertEqual(estoque_em(momento), self.somado(momento), momento)
+            self.assertEqual(estoque_em(momento), antes[momento], momento)
+        self.assertEqual(estoque_em(timezone.now(), produtos=[self.feijao.pk]), {self.feijao.pk: 4})
+
+    def test_refazer_um_dia_substitui_os_saldos(self):
+        call_command('saldos_estoque', '--sem-compactar', stdout=StringIO())
+        dia = self.movimentos[-1][1]
+        MovimentoEstoque.objects.create(produto=self.arroz, quantidade=2, motivo=MovimentoEstoque.AJUSTE, data=self.meio_dia(dia, 15))
+
+        self.assertEqual(fotografar_dia(dia), 1)
+        self.assertEqual(SaldoEstoque.objects.get(produto=self.arroz, dia=dia).estoque, 7)
+        self.assertEqual(estoque_em(timezone.now())[self.arroz.pk], 7)
+
+    def test_api_posicao_estoque(self):
+        self.client.force_login(User.objects.create_user('gerente'))
+        url = reverse('api_posicao_estoque')
+        call_command('saldos_estoque', stdout=StringIO())
+        dia = self.movimentos[0][1]
+
+        resposta = self.client.get(url, {'em': dia.isoformat()})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json(), {
+            'em': self.meio_dia(dia + timedelta(days=1), 0).isoformat(),
+            'produtos': [
+                {'produto': self.arroz.pk, 'nome': 'Arroz', 'estoque': 10, 'valor': 60.0},
+                {'produto': self.feijao.pk, 'nome': 'Feijão', 'estoque': 6, 'valor': 48.0},
+            ],
+            'valor_total': 108.0,
+        })
+
+        # Data e hora ISO; o valor usa o preço atual
+        Produto.objects.filter(pk=self.feijao.pk).update(preco=Decimal('7.50'))
+        momento = self.meio_dia(self.movimentos[2][1], 18)
+        self.assertEqual(self.client.get(url, {'em': momento.isoformat()}).json()['valor_total'], 6 * 6.0 + 6 * 7.5)
+
+        atual = self.client.get(url, {'produto': [self.arroz.pk, self.feijao.pk]}).json()
+        self.assertEqual([(p['nome'], p['estoque']) for p in atual['produtos']], [('Arroz', 5), ('Feijão', 4)])
+        self.assertEqual(atual['valor_total'], 5 * 6.0 + 4 * 7.5)
+        so_feijao = self.client.get(url, {'produto': self.feijao.pk}).json()
+        self.assertEqual(so_feijao['produtos'], [{'produto': self.feijao.pk, 'nome': 'Feijão', 'estoque': 4, 'valor': 30.0}])
+
+        for params in ({'produto': 'abc'}, {'em': 'ontem'}):
+            resposta = self.client.get(url, params)
+            self.assertEqual(resposta.status_code, 400, params)
+            self.assertIn('erro', resposta.json())
+
+
+class ReposicaoTests(TestCase):
+    def setUp(self):
+        reposicao.invalidar()
+        self.addCleanup(reposicao.invalidar)
+        self.hoje = timezone.localdate()
+        self.constante = Produto.objects.create(nome='Arroz', preco=Decimal('6.00'), estoque=5, categoria='comida', codigo_barras='789220')
+        self.irregular = Produto.objects.create(nome='Feijão', preco=Decimal('8.00'), estoque=3, categoria='comida', codigo_barras='789221')
+        self.esgotado = Produto.objects.create(nome='Sal', preco=Decimal('2.00'), estoque=0, categoria='comida', codigo_barras='789222')
+        self.parado = Produto.objects.create(nome='Vela', preco=Decimal('3.00'), estoque=10, categoria='acessorios', codigo_barras='789223')
+
+        vendas = [
+            # Dia 0 dividido entre duas formas de pagamento
+            (self.constante, 0, 'pix', 1), (self.constante, 0, 'em aberto', 1),
+            (self.constante, 1, 'pix', 2), (self.constante, 2, 'pix', 2), (self.constante, 3, 'pix', 2),
+            # Fora da janela de 4 dias
+            (self.constante, 4, 'pix', 100),
+            (self.irregular, 0, 'pix', 4), (self.irregular, 2, 'pix', 4),
+            (self.esgotado, 1, 'pix', 1),
+        ]
+        ResumoVendaDia.objects.bulk_create([
+            ResumoVendaDia(dia=self.hoje - timedelta(days=dias_atras), produto=produto, categoria=produto.categoria,
+                           forma_pagamento=forma, quantidade=quantidade, valor=produto.preco * quantidade)
+            for produto, dias_atras, forma, quantidade in vendas
+        ])
+
+    def test_velocidade_cobertura_e_sugestao(self):
+        sugestoes = calcular_reposicao(self.hoje, janela=4, prazo=2, cobertura_alvo=3)
+
+        constante = sugestoes[self.constante.pk]
+        self.assertEqual(
+            (constante['velocidade'], constante['cobertura_dias'], constante['ponto_pedido'], constante['sugerido'], constante['status']),
+            (2.0, 2.5, 4, 5, 'ok'),
+        )
+        # Desvio 2 por dia: segurança de 1,65 * 2 * raiz(2) unidades
+        irregular = sugestoes[self.irregular.pk]
+        self.assertEqual(
+            (irregular['velocidade'], irregular['cobertura_dias'], irregular['ponto_pedido'], irregular['sugerido'], irregular['status']),
+            (2.0, 1.5, 9, 12, 'repor'),
+        )
+        self.assertEqual(sugestoes[self.esgotado.pk]['status'], 'sem_estoque')
+        parado = sugestoes[self.parado.pk]
+        self.assertEqual((parado['cobertura_dias'], parado['sugerido'], parado['status']), (None, 0, 'parado'))
+
+    def test_lista_por_urgencia_e_recalcula_apos_venda(self):
+        # Na janela padrão entra a venda de 100: o arroz cobre menos dias que o feijão
+        self.assertEqual(
+            [(s['nome'], s['status']) for s in listar_reposicao()],
+            [('Sal', 'sem_estoque'), ('Arroz', 'repor'), ('Feijão', 'repor'), ('Vela', 'parado')],
+        )
+        cliente = Cliente.objects.create(nome='Ana', tipo='cliente')
+        with self.captureOnCommitCallbacks(execute=True):
+            finalizar_venda([('789223', 1)], 'pix', cliente=cliente)
+        self.assertEqual(listar_reposicao(PARADO), [])
+
+
+class ContasAReceberTests(TestCase):
+    def setUp(self):
+        Produto.objects.create(nome='Pão', preco=Decimal('2.00'), estoque=100, categoria='comida', codigo_barras='789080')
+        self.ana = Cliente.objects.create(nome='Ana', tipo='cliente', equipe='azul')
+        agora = timezone.now()
+        for dias, quantidade in [(0, 1), (10, 2), (70, 3)]:
+            venda = finalizar_venda([('789080', quantidade)], 'em aberto', cliente=self.ana)
+            Venda.objects.filter(pk=venda.pk).update(data_venda=agora - timedelta(days=dias))
+        finalizar_venda([('789080', 1)], 'pix', cliente=self.ana)
+
+        # Carrinho aberto no PDV: 'em aberto' com saldo até ser finalizado
+        self.sessao = get_or_create_pdv_session(User.objects.create_user('caixa1'))
+        adicionar_ao_carrinho(self.sessao, [('789080', 5)])
+
+    def test_saldo_por_faixa_de_atraso(self):
+        linhas = list(contas_a_receber('cliente'))
+        self.assertEqual(len(linhas), 1)
+        linha = linhas[0]
+        self.assertEqual(linha['cliente'], self.ana.pk)
+        self.assertEqual(linha['vendas'], 3)
+        self.assertEqual(
+            [linha[nome] for nome, _, _ in FAIXAS_ATRASO],
+            [Decimal('2.00'), Decimal('4.00'), 0, Decimal('6.00')],
+        )
+        self.assertEqual(linha['total'], Decimal('12.00'))
+
+        por_equipe = list(contas_a_receber('equipe'))
+        self.assertEqual([(linha['cliente__equipe'], linha['total']) for linha in por_equipe], [('azul', Decimal('12.00'))])
+
+    def test_carrinho_do_pdv_nao_e_quitado(self):
+        self.assertNotIn(self.sessao.venda_id, pendentes().values_list('pk', flat=True))
+        quitacoes = quitar_vendas(Venda.objects.all(), 'pix')
+        self.assertEqual(sum(q.quantidade_vendas for q in quitacoes), 3)
+        self.assertFalse(Venda.objects.get(pk=self.sessao.venda_id).pago)
+
+
+class CatalogoCacheTests(TestCase):
+    def setUp(self):
+        self.produto = Produto.objects.create(nome='Leite', preco=Decimal('4.00'), estoque=10, categoria='comida', codigo_barras='789090')
+        catalogo.limpar()
+        self.addCleanup(catalogo.limpar)
+
+    def test_sinais_descartam_a_entrada(self):
+        catalogo.buscar('789090')
+        with self.assertNumQueries(0):
+            self.assertEqual(catalogo.buscar('789090')['preco'], Decimal('4.00'))
+
+        self.produto.preco = Decimal('4.50')
+        self.produto.codigo_barras = '789091'
+        self.produto.save()
+        self.assertIsNone(catalogo.buscar('789090'))
+        self.assertEqual(catalogo.buscar('789091')['preco'], Decimal('4.50'))
+
+        self.produto.delete()
+        self.assertIsNone(catalogo.buscar('789091'))
+
+    def test_baixa_ajusta_o_estoque_em_cache(self):
+        catalogo.buscar('789090')
+        with self.captureOnCommitCallbacks(execute=True):
+            baixar_estoque([(self.produto.pk, 3)])
+        with self.assertNumQueries(0):
+            self.assertEqual(catalogo.buscar('789090')['estoque'], 7)
+
+        # Baixa recusada não mexe no cache
+        with self.captureOnCommitCallbacks(execute=True):
+            baixar_estoque([(self.produto.pk, 30)])
+        self.assertEqual(catalogo.buscar('789090')['estoque'], 7)
+
+    def test_limite_descarta_o_menos_usado(self):
+        Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=10, categoria='comida', codigo_barras='789092')
+        cache = CatalogoCache(limite=1)
+        cache.buscar('789090')
+        cache.buscar('789092')
+        self.assertEqual(cache.estatisticas(), {'itens': 1, 'limite': 1, 'acertos': 0, 'falhas': 2})
+        with self.assertNumQueries(1):
+            cache.buscar('789090')
+
+    def test_entrada_vencida_e_relida_do_banco(self):
+        # Alteração feita por outro processo: nenhum sinal chega a este cache
+        cache = CatalogoCache(validade=None)
+        cache.buscar('789090')
+        Produto.objects.filter(pk=self.produto.pk).update(preco=Decimal('5.00'))
+        self.assertEqual(cache.buscar('789090')['preco'], Decimal('4.00'))
+
+        cache.validade = 0
+        self.assertEqual(cache.buscar('789090')['preco'], Decimal('5.00'))
+
+
+class BuscaProdutosTests(TestCase):
+    def setUp(self):
+        indice_busca.limpar()
+        self.addCleanup(indice_busca.limpar)
+        self.usuario = User.objects.create_superuser('admin', password='admin')
+        self.acucar = Produto.objects.create(nome='Açúcar Cristal', preco=Decimal('5.00'), estoque=10, categoria='comida', codigo_barras='7891000100')
+        self.arroz = Produto.objects.create(nome='Arroz Branco', preco=Decimal('6.00'), estoque=10, categoria='comida', codigo_barras='7892000200')
+        self.cafe = Produto.objects.create(nome='Café Torrado', preco=Decimal('9.00'), estoque=10, categoria='comida', codigo_barras='7893000300')
+
+    def test_indice_ignora_acento_e_aceita_prefixo_e_erro(self):
+        self.assertEqual(buscar_ids('acucar')[0], self.acucar.pk)
+        self.assertEqual(buscar_ids('CAFE')[0], self.cafe.pk)
+        self.assertEqual(buscar_ids('arr')[0], self.arroz.pk)
+        self.assertEqual(buscar_ids('acucra cristal')[0], self.acucar.pk)
+        self.assertEqual(buscar_ids('7892'), [self.arroz.pk])
+        # Trecho do meio do nome, com um trigrama só em comum
+        self.assertIn(self.acucar.pk, buscar_ids('car'))
+        self.assertIn(self.arroz.pk, buscar_ids('branc'))
+        self.assertEqual(len(buscar_ids('789', limite=None)), 3)
+
+    def test_indice_remontado_depois_da_validade(self):
+        indice = IndiceProdutos(validade=None)
+        indice.buscar_ids('arroz')
+        # Gravação em outro processo: o sinal não chega a este índice
+        Produto.objects.filter(pk=self.arroz.pk).update(nome='Feijão Preto')
+        self.assertEqual(indice.buscar_ids('feijao'), [])
+
+        indice.validade = 0
+        self.assertEqual(indice.buscar_ids('feijao'), [self.arroz.pk])
+        self.assertNotIn(self.arroz.pk, indice.buscar_ids('arroz'))
+
+    def test_indice_acompanha_os_sinais(self):
+        buscar_ids('arroz')
+        self.arroz.nome = 'Feijão Preto'
+        self.arroz.save()
+        self.assertNotIn(self.arroz.pk, buscar_ids('arroz'))
+        self.assertEqual(buscar_ids('feijao'), [self.arroz.pk])
+        self.cafe.delete()
+        self.assertEqual(buscar_ids('cafe'), [])
+
+    def listados(self, termo, **params):
+        self.client.force_login(self.usuario)
+        resposta = self.client.get(reverse('admin:mercado_produto_changelist'), {'q': termo, **params})
+        return list(resposta.context['cl'].result_list)
+
+    def test_admin_busca_so_pelo_indice(self):
+        self.assertIn(self.acucar, self.listados('car'))
+        self.assertEqual(self.listados('7892'), [self.arroz])
+        self.assertEqual(self.listados('acucar'), [self.acucar])
+        self.assertEqual(self.listados('cafe torado'), [self.cafe])
+        self.assertEqual(len(self.listados('789', o='1')), 3)
+        self.assertEqual(self.listados('xyz'), [])
+
+        with CaptureQueriesContext(connection) as consultas:
+            self.listados('acucar')
+        self.assertFalse([c['sql'] for c in consultas if 'LIKE' in c['sql']])
+
+    def test_api_pdv_buscar(self):
+        self.client.force_login(self.usuario)
+        url = reverse('api_pdv_buscar')
+
+        resposta = self.client.get(url, {'q': 'acucar'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json(), {'produtos': [{
+            'id': self.acucar.pk, 'nome': 'Açúcar Cristal', 'codigo_barras': '7891000100',
+            'preco': 5.0, 'categoria': 'comida',
+        }]})
+        self.assertEqual(len(self.client.get(url, {'q': '789', 'limite': '2'}).json()['produtos']), 2)
+
+        self.assertEqual(self.client.get(url, {'q': ' '}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'q': 'arroz', 'limite': 'dez'}).status_code, 400)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(url, {'q': 'arroz'}).status_code, 302)
+
+
+class ArquivoHistoricoTests(TestCase):
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        self.arquivo = os.path.join(pasta.name, 'historico.sqlite3')
+
+        self.usuario = User.objects.create_user('admin')
+        produto = Produto.objects.create(nome='Pão', preco=Decimal('1.50'), estoque=10, categoria='comida', codigo_barras='789100')
+        for nome in ('Pão francês', 'Pão de sal'):
+            produto.nome = nome
+            produto.save()
+        antigo = timezone.now() - timedelta(days=400)
+        Produto.history.update(history_date=antigo)
+        LogEntry.objects.create(
+            user=self.usuario, content_type=ContentType.objects.get_for_model(Produto), object_id=str(produto.pk),
+            object_repr='Pão', action_flag=CHANGE, action_time=antigo,
+        )
+
+    def arquivadas(self, tabela, colunas):
+        with closing(sqlite3.connect(self.arquivo)) as conexao:
+            return conexao.execute(f'SELECT {colunas} FROM "{tabela}" ORDER BY 1').fetchall()
+
+    def test_move_as_linhas_antigas_para_o_arquivo(self):
+        call_command('arquivar_historico', '--arquivo', self.arquivo, stdout=StringIO())
+
+        # Fica a linha mais recente de cada produto
+        self.assertEqual(list(Produto.history.values_list('nome', flat=True)), ['Pão de sal'])
+        self.assertFalse(LogEntry.objects.exists())
+        tabela = Produto.history.model._meta.db_table
+        self.assertEqual(self.arquivadas(tabela, 'history_type, nome'), [('+', 'Pão'), ('~', 'Pão francês')])
+        self.assertEqual(self.arquivadas(LogEntry._meta.db_table, 'object_repr'), [('Pão',)])
+        self.assertEqual(
+            sorted(ResumoHistorico.objects.values_list('origem', 'acao', 'quantidade')),
+            [('admin', '~', 1), ('produto', '+', 1), ('produto', '~', 1)],
+        )
+
+    def test_arquivo_de_esquema_antigo_ganha_as_colunas_novas(self):
+        tabela = Produto.history.model._meta.db_table
+        with closing(sqlite3.connect(self.arquivo)) as conexao:
+            # Arquivo de uma versão com estoque no histórico e sem categoria
+            conexao.execute(f'CREATE TABLE "{tabela}" ("history_id" PRIMARY KEY, "nome", "estoque", "history_type")')
+            conexao.execute(f'INSERT INTO "{tabela}" VALUES (0, \'Arroz\', 5, \'+\')')
+            conexao.commit()
+
+        call_command('arquivar_historico', '--arquivo', self.arquivo, stdout=StringIO())
+
+        self.assertEqual(
+            [linha[1:] for linha in self.arquivadas(tabela, 'history_id, nome, estoque, categoria')],
+            [('Arroz', 5, None), ('Pão', None, 'comida'), ('Pão francês', None, 'comida')],
+        )
@@ -1,13 +1,16 @@
 from django.urls import path, include
 from . import views
 from django.contrib.auth import views as auth_views
-from .api_pdv import api_bipar
-from .api_pdv import api_bipar
+from .api_pdv import api_bipar, api_finalizar_venda, api_quitar_contas
+from .views_api import api_pdv_buscar, api_pdv_eventos, api_pdv_scan
+from .api_relatorios import api_contas_a_receber, api_posicao_estoque, api_relatorio_vendas, api_reposicao, api_vendas_por_data
 
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
     path('produtos/', views.produtos, name='produtos'),
+    path('pdv/', views.pdv, name='pdv'),
+    path('pdv/visor/', views.pdv_visor, name='pdv_visor'),
 
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
@@ -15,13 +18,25 @@ urlpatterns = [
     # rota sem data → redireciona para hoje
     path('vendas/', views.vendas_por_data, name='vendas'),
 
+    path('vendas/exportar/', views.exportar_vendas, name='exportar_vendas'),
+
     # rota com data
     path('vendas/<str:data>/', views.vendas_por_data, name='vendas_por_data'),
 
     
-    path('api/pdv/scan/', api_bipar, name='api_pdv_scan'),
+    path('api/pdv/scan/', api_pdv_scan, name='api_pdv_scan'),
+    path('api/pdv/buscar/', api_pdv_buscar, name='api_pdv_buscar'),
+    path('api/pdv/eventos/', api_pdv_eventos, name='api_pdv_eventos'),
+    path('api/pdv/finalizar/', api_finalizar_venda, name='api_pdv_finalizar'),
+    path('api/quitacoes/', api_quitar_contas, name='api_quitar_contas'),
 
     path("admin/scan/", api_bipar, name="api_bipar"),
 
+    path('api/relatorios/vendas/', api_relatorio_vendas, name='api_relatorio_vendas'),
+    path('api/relatorios/vendas/<str:data>/', api_vendas_por_data, name='api_vendas_por_data'),
+    path('api/relatorios/contas-a-receber/', api_contas_a_receber, name='api_contas_a_receber'),
+    path('api/relatorios/estoque/', api_posicao_estoque, name='api_posicao_estoque'),
+    path('api/relatorios/reposicao/', api_reposicao, name='api_reposicao'),
+
 ]
 
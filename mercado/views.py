@@ -1,76 +1,73 @@
 from django.shortcuts import render, redirect
-from django.db.models import Sum, F, ExpressionWrapper, DecimalField
+from django.db.models import Sum
+from django.http import FileResponse, HttpResponseBadRequest, StreamingHttpResponse
 from datetime import date, timedelta, datetime
-from .models import Produto, Venda
+import tempfile
+from .exportacao import FORMATOS, csv_em_fluxo, escrever_xlsx, linhas_vendas
+from .models import Produto, ResumoVendaDia
+from .relatorios import ler_limite, resumo_do_dia, vendas_do_dia
+from .reposicao import REPOR, sugestoes
+from .tempo_real import sob_asgi
 from django.contrib.auth.decorators import login_required 
 from django.contrib.auth import authenticate, login, logout
+from django.utils import timezone
 
 # ==========================
 # DASHBOARD
 # ==========================
 @login_required
 def dashboard(request):
-    hoje = date.today()
+    hoje = timezone.localdate()
+    inicio = hoje - timedelta(days=29)
 
     # Últimos 30 dias
     dias_range = [hoje - timedelta(days=i) for i in range(29, -1, -1)]
 
+    # Tudo vem do resumo diário: o número de consultas não depende do histórico
+    resumos = ResumoVendaDia.objects
+
     # Quantidade total vendida por dia
-    vendas_dias = {
-        dia: (
-            Venda.objects
-            .filter(data_venda__date=dia)
-            .aggregate(total=Sum("itens__quantidade"))
-            ['total'] or 0
-        )
-        for dia in dias_range
-    }
+    por_dia = dict(
+        resumos
+        .filter(dia__range=(inicio, hoje))
+        .values('dia')
+        .annotate(total=Sum('quantidade'))
+        .values_list('dia', 'total')
+    )
+    vendas_dias = {dia: por_dia.get(dia) or 0 for dia in dias_range}
 
     dias_labels = [d.strftime('%d/%m') for d in dias_range]
     dias_totais = list(vendas_dias.values())
 
     # -------------------------------
-    # Total vendido HOJE (valor)
+    # Totais por forma de pagamento (HOJE)
     # -------------------------------
-    total_hoje = (
-        Venda.objects
-        .filter(data_venda__date=hoje)
-        .annotate(
-            total_produto=ExpressionWrapper(
-                F('itens__quantidade') * F('itens__produto__preco'),
-                output_field=DecimalField()
-            )
-        )
-        .aggregate(soma=Sum('total_produto'))['soma'] or 0
+    vendas_por_forma = list(
+        resumos
+        .filter(dia=hoje)
+        .values('forma_pagamento')
+        .annotate(total=Sum('valor'))
+        .exclude(total=0)
+        .order_by('forma_pagamento')
     )
 
     # -------------------------------
-    # Totais por forma de pagamento
+    # Total vendido HOJE (valor)
     # -------------------------------
-    vendas_por_forma = (
-        Venda.objects
-        .filter(data_venda__date=hoje)
-        .annotate(
-            total_produto=ExpressionWrapper(
-                F('itens__quantidade') * F('itens__produto__preco'),
-                output_field=DecimalField()
-            )
-        )
-        .values('forma_pagamento')
-        .annotate(total=Sum('total_produto'))
-    )
+    total_hoje = sum((item['total'] for item in vendas_por_forma), 0)
 
     # -------------------------------
     # Totais por categoria
     # -------------------------------
-    categorias = (
-        Produto.objects
+    por_categoria = dict(
+        resumos
         .values('categoria')
-        .annotate(total=Sum('itemvenda__quantidade'))
+        .annotate(total=Sum('quantidade'))
+        .values_list('categoria', 'total')
     )
 
-    categorias_labels = [c['categoria'] for c in categorias]
-    categorias_totais = [c['total'] or 0 for c in categorias]
+    categorias_labels = [categoria for categoria, _ in Produto.CATEGORIAS]
+    categorias_totais = [por_categoria.get(categoria) or 0 for categoria in categorias_labels]
 
     return render(request, 'dashboard.html', {
         'vendas_dias': vendas_dias,
@@ -105,43 +102,53 @@ def vendas_por_data(request, data=None):
         hoje = date.today().strftime("%Y-%m-%d")
         return redirect("vendas_por_data", data=hoje)
 
-    # Vendas do dia
-    vendas = Venda.objects.filter(data_venda__date=data_formatada)
-
-    # Total do dia
-    valor_total_dia = (
-        vendas
-        .annotate(
-            total_produto=ExpressionWrapper(
-                F('itens__quantidade') * F('itens__produto__preco'),
-                output_field=DecimalField()
-            )
-        )
-        .aggregate(soma=Sum('total_produto'))['soma'] or 0
-    )
-
-    # Confirmadas e pendentes
-    vendas_confirmadas = vendas.filter(pago=True).count()
-    vendas_pendentes = vendas.filter(pago=False).count()
-
-    # Saldo devedor
-    saldo_total_devedor = (
-        vendas
-        .filter(pago=False)
-        .aggregate(total=Sum('saldo_devedor'))['total'] or 0
-    )
+    # Vendas do dia, uma página por vez
+    try:
+        vendas, proxima_pagina = vendas_do_dia(data_formatada, apos=request.GET.get("apos"))
+    except ValueError:
+        return redirect("vendas_por_data", data=data)
 
     return render(request, "vendas_por_data.html", {
         "vendas": vendas,
+        "proxima_pagina": proxima_pagina,
         "data": data_formatada,
         "data_hoje": date.today(),
-        "valor_total_dia": valor_total_dia,
-        "vendas_confirmadas": vendas_confirmadas,
-        "vendas_pendentes": vendas_pendentes,
-        "saldo_total_devedor": saldo_total_devedor,
+        **resumo_do_dia(data_formatada),
         "data_relatorio": data_formatada.strftime("%d/%m/%Y"),
     })
 
+# ==========================
+# EXPORTAÇÃO DE VENDAS
+# ==========================
+@login_required
+def exportar_vendas(request):
+    """Baixa as vendas de ?de=...&ate=... em CSV (padrão) ou XLSX (?formato=xlsx)."""
+    formato = request.GET.get("formato", "csv")
+    if formato not in FORMATOS:
+        return HttpResponseBadRequest("Formato inválido")
+
+    try:
+        hoje = timezone.localdate()
+        inicio = ler_limite(request.GET.get("de") or str(hoje.replace(day=1)))
+        fim = ler_limite(request.GET.get("ate") or str(hoje), fim=True)
+    except ValueError:
+        return HttpResponseBadRequest("Período inválido")
+
+    nome = f"vendas_{timezone.localtime(inicio):%Y%m%d}_{timezone.localtime(fim - timedelta(microseconds=1)):%Y%m%d}.{formato}"
+    linhas = linhas_vendas(inicio, fim)
+
+    if formato == "csv":
+        resposta = StreamingHttpResponse(csv_em_fluxo(linhas), content_type="text/csv; charset=utf-8")
+        resposta["Content-Disposition"] = f'attachment; filename="{nome}"'
+        return resposta
+
+    # O XLSX é um zip e só fica pronto no fim; vai para um arquivo
+    # temporário em disco e é enviado de lá em blocos.
+    arquivo = tempfile.TemporaryFile()
+    escrever_xlsx(linhas, arquivo)
+    arquivo.seek(0)
+    return FileResponse(arquivo, as_attachment=True, filename=nome)
+
 # ==========================
 # LOGIN
 # ==========================
@@ -177,5 +184,22 @@ def logout_view(request):
 # ==========================
 @login_required
 def produtos(request):
-    produtos = Produto.objects.all().order_by('nome')
+    produtos = list(Produto.objects.all().order_by('nome'))
+    status = sugestoes()
+    for produto in produtos:
+        sugestao = status.get(produto.pk)
+        produto.repor = produto.estoque == 0 or (sugestao is not None and sugestao['status'] == REPOR)
     return render(request, 'produtos.html', {"produtos": produtos})
+
+# ==========================
+# PDV
+# ==========================
+@login_required
+def pdv(request):
+    return render(request, 'pdv.html', {"eventos": sob_asgi(request)})
+
+
+@login_required
+def pdv_visor(request):
+    """Visor do cliente: acompanha o carrinho de um caixa (?sessao=<id>) sem bipar."""
+    return render(request, 'pdv_visor.html', {"sessao": request.GET.get("sessao", ""), "eventos": sob_asgi(request)})
@@ -1,42 +1,130 @@
 # mercado/views_api.py
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 import json
-from .models import Produto, ItemVenda
+from .busca import LIMITE_PADRAO, buscar_produtos
+from .models import PDVSession
+from .carrinho import carrinhos
 from .services import get_or_create_pdv_session
+from .tempo_real import fluxo_de_eventos, sob_asgi
+
+
+def _ler_bipagens(request):
+    """
+    Lê as bipagens da requisição como (codigo, quantidade, chave).
+
+    Aceita GET ?codigo=..., POST {"codigo": ...} ou uma rajada
+    POST {"codigos": [{"codigo": ..., "quantidade": ..., "chave": ...}, "789...", ...]}.
+    A chave de idempotência é opcional.
+    """
+    if request.method == "GET":
+        return [(request.GET.get("codigo"), 1, request.GET.get("chave"))]
+
+    data = json.loads(request.body)
+    if "codigos" not in data:
+        return [(data.get("codigo"), int(data.get("quantidade", 1)), data.get("chave"))]
+
+    bipagens = []
+    for item in data["codigos"]:
+        if isinstance(item, dict):
+            bipagens.append((item.get("codigo"), int(item.get("quantidade", 1)), item.get("chave")))
+        else:
+            bipagens.append((item, 1, None))
+    return bipagens
+
 
 @csrf_exempt
 @login_required
 def api_pdv_scan(request):
-    data = json.loads(request.body)
-    codigo = data.get("codigo")
-
     try:
-        produto = Produto.objects.get(codigo_barras=codigo)
-    except Produto.DoesNotExist:
-        return JsonResponse({"error": "Produto não encontrado"}, status=404)
+        bipagens = [
+            (str(codigo), qtd, str(chave)[:64] if chave else None)
+            for codigo, qtd, chave in _ler_bipagens(request) if codigo
+        ]
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({"error": "Requisição inválida"}, status=400)
+
+    if not bipagens:
+        return JsonResponse({"error": "Código não enviado"}, status=400)
 
     session = get_or_create_pdv_session(request.user)
-    venda = session.venda
+    eventos = []
+    erros, repetidas = carrinhos.bipar(session, bipagens, eventos)
+
+    # Só o que mudou; ?completo=1 devolve o carrinho inteiro
+    if request.GET.get("completo"):
+        resposta = carrinhos.retrato(session)
+    else:
+        resposta = {"venda": session.venda_id, "total": float(carrinhos.total(session))}
+    resposta["alterados"] = [dados for tipo, dados in eventos if tipo == "item"]
+    resposta["erros"] = erros
+    resposta["repetidas"] = repetidas
+    # Ainda só na memória do servidor: o diário do PDV deve reenviá-las
+    resposta["pendentes"] = carrinhos.pendentes(session, [chave for _, _, chave in bipagens])
+
+    status = 200
+    if erros and not resposta["alterados"]:
+        # Nada entrou no carrinho
+        resposta["error"] = erros[0]["erro"]
+        status = 404 if all(e["erro"] == "Produto não encontrado" for e in erros) else 409
+    return JsonResponse(resposta, status=status)
 
-    item, created = ItemVenda.objects.get_or_create(
-        venda=venda,
-        produto=produto,
-        defaults={"quantidade": 1, "preco": produto.preco}
-    )
 
-    if not created:
-        item.quantidade += 1
-        item.save()
+def _carrinho_da_sessao(user, sessao_id):
+    if sessao_id is None:
+        session = get_or_create_pdv_session(user)
+    else:
+        session = PDVSession.objects.select_related('venda').get(pk=sessao_id)
+    return session.pk, carrinhos.retrato(session)
 
-    itens = [{
-        "nome": i.produto.nome,
-        "quantidade": i.quantidade,
-        "preco": float(i.preco),
-    } for i in venda.itens.all()]
+
+@login_required
+async def api_pdv_eventos(request):
+    """
+    Fluxo SSE do carrinho de uma sessão do PDV: o carrinho inteiro ao
+    conectar e depois só os deltas (ver tempo_real). Equipe pode acompanhar
+    a sessão de outro caixa com ?sessao=<id>, como num visor do cliente.
+    """
+    if not sob_asgi(request):
+        return JsonResponse({"error": "Atualizações em tempo real exigem um servidor ASGI"}, status=503)
+
+    user = await request.auser()
+    sessao_id = request.GET.get("sessao")
+    if sessao_id is not None and not user.is_staff:
+        return JsonResponse({"error": "Sem permissão"}, status=403)
+
+    try:
+        sessao_id, inicial = await sync_to_async(_carrinho_da_sessao)(user, sessao_id)
+    except (PDVSession.DoesNotExist, ValueError):
+        return JsonResponse({"error": "Sessão não encontrada"}, status=404)
+
+    resposta = StreamingHttpResponse(fluxo_de_eventos(sessao_id, inicial), content_type="text/event-stream")
+    resposta["Cache-Control"] = "no-cache"
+    resposta["X-Accel-Buffering"] = "no"
+    return resposta
+
+
+@login_required
+def api_pdv_buscar(request):
+    """Busca manual de produtos no PDV (?q=nome ou começo do código)."""
+    termo = request.GET.get("q", "").strip()
+    if not termo:
+        return JsonResponse({"error": "Informe o termo da busca"}, status=400)
+
+    try:
+        limite = min(int(request.GET.get("limite", LIMITE_PADRAO)), 50)
+    except ValueError:
+        return JsonResponse({"error": "Limite inválido"}, status=400)
 
     return JsonResponse({
-        "itens": itens,
-        "total": float(venda.valor_total())
+        "produtos": [{
+            "id": produto["id"],
+            "nome": produto["nome"],
+            "codigo_barras": produto["codigo_barras"],
+            "preco": float(produto["preco"]),
+            "categoria": produto["categoria"],
+        } for produto in buscar_produtos(termo, limite)],
     })
+